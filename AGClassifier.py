@@ -3,12 +3,20 @@
 
 import PySimpleGUI as sg
 
-from AGClassifier_layouts import layout_selector
-
-from AGClassifier_event_manager import event_loop
-from AGClassifier_utilities import set_correction_yaml_global
-
+from AGClassifier_layouts import layout_selector, convert_layout_pickle
+
+from AGClassifier_event_manager import event_loop, start_session_loader
+from AGClassifier_contact_sheet import parse_contact_sheet_grid
+from AGClassifier_metrics import set_metrics_file, set_session_profiler, parse_profile_events, SessionProfiler
+from AGClassifier_prerender import prerender, get_render_cache_dir
+from AGClassifier_report import report, add_report_arguments
+from AGClassifier_utilities import set_render_cache_budget, IMAGE_TRANSFER_FORMATS, set_image_transfer_format, \
+    CORRECTION_BACKENDS, set_correction_backend, SQLiteCorrectionStore
+
+import argparse
+import logging
 import os
+import time
 
 
 def select_folders():
@@ -36,7 +44,6 @@ def select_folders():
         os.mkdir(output_folder)
     # The file that will store all the output
     correction_yaml_file = os.path.join(output_folder, "correction.yaml")
-    set_correction_yaml_global(correction_yaml_file)
 
     if not os.path.exists(correction_yaml_file):
         open(correction_yaml_file, "w").close()
@@ -44,20 +51,127 @@ def select_folders():
     return input_folder, correction_yaml_file
 
 
+def parse_arguments(argv=None):
+    """
+    Parse the command line. Without a command, the GUI is started.
+    :param argv: Command line arguments, default is sys.argv
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="AliGater image classifier")
+    parser.add_argument("--prefetch-depth", type=int, default=2,
+                        help="Number of upcoming samples rendered in the background (0 turns prefetching off)")
+    parser.add_argument("--render-cache-mb", type=float, default=256,
+                        help="Memory budget of the rendered page cache, in MB")
+    parser.add_argument("--image-format", choices=IMAGE_TRANSFER_FORMATS, default=IMAGE_TRANSFER_FORMATS[0],
+                        help="Format pages are handed to the image elements in. ppm skips PNG compression and "
+                             "decompression but takes more memory and disk space")
+    parser.add_argument("--render-processes", type=int, default=None,
+                        help="Number of worker processes rendering the pages of a sample in parallel. Default is one "
+                             "per page for layouts with 2 or 3 images, up to the number of cores minus one, and none "
+                             "with fewer than 3 cores. 0 renders the pages one by one")
+    parser.add_argument("--no-preview", action="store_true",
+                        help="Only show pages once they are rendered at full resolution, instead of showing a low "
+                             "resolution preview of the pages that are not rendered yet first")
+    parser.add_argument("--contact-sheet-grid", type=parse_contact_sheet_grid, default="4x6", metavar="ROWSxCOLUMNS",
+                        help="Number of thumbnails on a page of the contact sheet")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="WARNING",
+                        help="Messages below this level are not shown. DEBUG shows every event and rendered page")
+    parser.add_argument("--profile", action="store_const", const="all", default=os.environ.get("AGCLASSIFIER_PROFILE"),
+                        help="Profile the session with cProfile and write the profile next to correction.yaml. "
+                             "Can also be set with the AGCLASSIFIER_PROFILE environment variable, to 'all' or EVENTS")
+    parser.add_argument("--profile-events", dest="profile", metavar="EVENTS",
+                        help="Only profile GUI events FIRST to LAST, given as FIRST:LAST, e.g. 10:60")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Also include PDFs in subfolders of the input folder")
+    parser.add_argument("--rescan-interval", type=float, default=10,
+                        help="Seconds between checks of the input folder for new PDFs while the GUI is idle "
+                             "(0 turns it off)")
+    parser.add_argument("--storage", choices=tuple(CORRECTION_BACKENDS), default="yaml",
+                        help="Where corrections are kept while annotating. sqlite keeps them in "
+                             "output/correction.sqlite and exports correction.yaml at exit")
+    subparsers = parser.add_subparsers(dest="command")
+
+    prerender_parser = subparsers.add_parser("prerender",
+                                             help="Render the layout's pages of every PDF in the input folder ahead of "
+                                                  "an annotation session, into output/render_cache")
+    prerender_parser.add_argument("input_folder", help="Folder with the PDF files")
+    prerender_parser.add_argument("layout_file",
+                                  help="Layout file of the gate, .layout.yaml, .layout.json or .pickle")
+    prerender_parser.add_argument("--recursive", action="store_true",
+                                  help="Also include PDFs in subfolders of the input folder")
+    prerender_parser.add_argument("--workers", type=int, default=None,
+                                  help="Number of worker processes, default is the number of cores")
+
+    export_parser = subparsers.add_parser("export",
+                                          help="Export the corrections of the sqlite storage backend to "
+                                               "output/correction.yaml")
+    export_parser.add_argument("input_folder", help="Folder with the PDF files")
+
+    convert_parser = subparsers.add_parser("convert-layout",
+                                           help="Convert a layout pickle file, made by the older template scripts, "
+                                                "to a declarative layout spec")
+    convert_parser.add_argument("layout_pickle", help="Layout pickle file")
+    convert_parser.add_argument("--output", default=None,
+                                help="Layout spec to write, .layout.yaml or .layout.json. Default is the pickle's "
+                                     "path with .layout.yaml")
+
+    report_parser = subparsers.add_parser("report",
+                                          help="Per-gate and per-descriptor counts, discard rates and a merged sample "
+                                               "table over the correction files of many runs")
+    add_report_arguments(report_parser)
+
+    return parser.parse_args(argv)
+
+
 def main():
     """
     Main function
     :return:
     """
 
+    args = parse_arguments()
+    logging.basicConfig(level=args.log_level, format="%(levelname)s: %(message)s")
+    profiler = None
+    if args.profile:
+        profiler = SessionProfiler(*parse_profile_events(args.profile))
+        set_session_profiler(profiler)
+    if args.command == "prerender":
+        prerender(args.input_folder, args.layout_file, workers=args.workers, image_format=args.image_format,
+                  recursive=args.recursive)
+        return
+    if args.command == "convert-layout":
+        convert_layout_pickle(args.layout_pickle, args.output)
+        return
+    if args.command == "report":
+        report(args.folders, args.output, report_format=args.report_format, workers=args.workers)
+        return
+    if args.command == "export":
+        yaml_file = os.path.join(args.input_folder, "output", "correction.yaml")
+        if not os.path.exists(os.path.splitext(yaml_file)[0] + ".sqlite"):
+            raise ValueError("No correction database found in " + os.path.dirname(yaml_file))
+        SQLiteCorrectionStore(yaml_file).close()
+        return
+
+    set_correction_backend(args.storage)
+    set_render_cache_budget(args.render_cache_mb)
+    set_image_transfer_format(args.image_format)
+
     # First select input and output folders
     input_folder, yaml_file = select_folders()
 
+    # Per-event latency histograms of this session, written at exit
+    set_metrics_file(os.path.join(os.path.dirname(yaml_file), "metrics_" + time.strftime("%Y%m%d-%H%M%S") + ".json"))
+    if profiler is not None:
+        profiler.output_folder = os.path.dirname(yaml_file)
+
     # Then select layout
-    layout, event_descriptor_dict, page_no, gate_name = layout_selector(input_folder)
+    layout, event_descriptor_dict, page_no, gate_name, category_table = layout_selector(input_folder)
 
-    # Create the window
+    # Create the window, and load the samples and corrections in the background while it is shown. START is enabled
+    # once they are loaded. The rendered pages are shared with other sessions and with "AGClassifier.py prerender"
     window = sg.Window(title="AliGater image classifier", layout=layout, resizable=True, finalize=True)
+    session_loader = start_session_loader(window, input_folder, gate_name, yaml_file=yaml_file,
+                                          recursive=args.recursive, render_cache_dir=get_render_cache_dir(input_folder))
 
     # Bind arrows to next/previous image
     #window.bind("<Right>", "DONE, next image")
@@ -65,7 +179,10 @@ def main():
     #window.unbind("<Left>")
 
     # Run the event loop
-    event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name)
+    event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name, prefetch_depth=args.prefetch_depth,
+               recursive=args.recursive, rescan_interval=args.rescan_interval, category_table=category_table,
+               session_loader=session_loader, render_processes=args.render_processes,
+               preview=not args.no_preview, contact_sheet_grid=args.contact_sheet_grid)
 
     window.close()
 
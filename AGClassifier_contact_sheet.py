@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Contact sheet: a window showing the samples as a grid of thumbnails of the first page of the layout, a page of
+rows x columns samples at a time, for reviewing gates where nearly every sample is fine. The samples ticked on the
+sheet are approved, set to NA, discarded or given a descriptor of the layout together, in one write to the correction
+store and the review log.
+
+The thumbnails are rendered in the background, in parallel when there is a render pool, as each page of the sheet is
+shown, and the next page is rendered ahead while the user looks at the current one.
+"""
+
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor, BrokenExecutor, as_completed
+
+import PySimpleGUI as sg
+
+from AGClassifier_metrics import logger, metrics
+from AGClassifier_utilities import default_image_size, lookup_page_image, store_page_image, render_page_data, \
+    get_render_pool, get_image_transfer_format, get_navigation_index, collect_name_of_pdf_at_index, \
+    get_correction_store, get_review_log, add_many_to_output_yaml, replace_many_in_yaml, record_reviews, \
+    create_discard_are_you_sure_popup
+
+# Rows and columns of thumbnails on a page of the contact sheet
+DEFAULT_CONTACT_SHEET_GRID = (4, 6)
+
+# Width of the thumbnails. The height follows from the aspect ratio of the pages in the main window
+THUMBNAIL_WIDTH = 192
+
+# Buttons of the contact sheet applying a review to the ticked samples, and the review state each one records
+BULK_REVIEWS = {"Approve": "approved", "NA": "NA", "DISCARD": "DISCARD", "Apply descriptor": "corrected"}
+
+NEXT_PAGE_EVENTS = ("Next page", "Next:34", "MouseWheel:Down")
+PREVIOUS_PAGE_EVENTS = ("Previous page", "Prior:33", "MouseWheel:Up")
+
+
+def parse_contact_sheet_grid(spec: str) -> tuple:
+    """
+    Parse the size of the contact sheet, as given to --contact-sheet-grid.
+
+    :param spec: "ROWSxCOLUMNS", e.g. "4x6"
+    :return: (rows, columns)
+    """
+    rows, separator, columns = spec.lower().partition("x")
+    try:
+        grid = (int(rows), int(columns))
+    except ValueError:
+        grid = None
+    if not separator or grid is None or min(grid) < 1:
+        raise ValueError("Expected ROWSxCOLUMNS, e.g. 4x6, found: " + spec)
+    return grid
+
+
+def contact_sheet_page(page_no) -> int:
+    """
+    :param page_no: page number(s) from the layout
+    :return: Page of the PDFs shown on the contact sheet: the first page of the layout
+    """
+    return page_no if isinstance(page_no, int) else page_no[0]
+
+
+def thumbnail_size(page_no) -> tuple:
+    """
+    :param page_no: page number(s) from the layout
+    :return: (width, height) of the thumbnails, with the aspect ratio of the pages in the main window
+    """
+    width, height = default_image_size(contact_sheet_page(page_no))
+    return THUMBNAIL_WIDTH, int(round(THUMBNAIL_WIDTH * height / width))
+
+
+def blank_thumbnail(width: int, height: int) -> bytes:
+    """
+    :return: White PPM image, shown on tiles while their thumbnail is rendered and on tiles without a sample
+    """
+    return b"P6\n%d %d\n255\n" % (width, height) + b"\xff" * (3 * width * height)
+
+
+class ThumbnailRenderer:
+    """
+    Renders the thumbnails of a page of the contact sheet on a background thread, and posts each one to the window as
+    a "-THUMB-" event, (generation, tile, data), as soon as it is done. With a render pool, the thumbnails are rendered
+    in parallel by its worker processes. Once the page is done, the thumbnails of the next page are rendered into the
+    render cache, so that paging forward shows them at once.
+    Showing another page bumps the generation and cancels the renders sent to the render pool: the thumbnails of the
+    page that was left are then neither shown nor, if they were not started, rendered.
+    """
+
+    def __init__(self, window, pno: int, width: int, height: int):
+        """
+        :param window: Contact sheet window the thumbnails are posted to
+        :param pno: Page of the PDFs shown as thumbnails
+        :param width: Width of the thumbnails
+        :param height: Height of the thumbnails
+        """
+        self.window = window
+        self.pno = pno
+        self.width = width
+        self.height = height
+        self.generation = 0  # Bumped for every page shown
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AGClassifier-thumbnails")
+        self._lock = threading.Lock()
+        self._pool_futures = []  # Renders of the current generation sent to the render pool
+        self.cached = 0  # Thumbnails found in the render cache or the page archive
+        self.rendered = 0  # Thumbnails rendered, including those rendered ahead
+
+    def _lookup(self, filenames: list) -> tuple:
+        """
+        :return: (found, missing): lists of (tile, data) and of (tile, filename, cache_key, archive_key)
+        """
+        found = []
+        missing = []
+        for tile, filename in enumerate(filenames):
+            data, cache_key, archive_key = lookup_page_image(filename, self.pno, self.width, self.height,
+                                                             get_image_transfer_format())
+            if data is not None:
+                found.append((tile, data))
+            else:
+                missing.append((tile, filename, cache_key, archive_key))
+        return found, missing
+
+    def show(self, filenames: list, next_filenames: list = ()) -> list:
+        """
+        Start rendering the thumbnails of a page of the sheet.
+
+        :param filenames: PDFs of the samples on the page, in the order of the tiles
+        :param next_filenames: PDFs of the samples on the next page, rendered ahead
+        :return: List of (tile, data) of the thumbnails that did not need rendering, to be shown right away
+        """
+
+        self._next_generation()
+        found, missing = self._lookup(filenames)
+        self.cached += len(found)
+        self._executor.submit(self._render, self.generation, missing, list(next_filenames))
+        return found
+
+    def _next_generation(self) -> None:
+        """
+        Bump the generation and cancel the renders of the previous one that are still in the render pool.
+        """
+        with self._lock:
+            self.generation += 1
+            for future in self._pool_futures:
+                future.cancel()
+            self._pool_futures = []
+
+    def _render(self, generation: int, missing: list, next_filenames: list) -> None:
+        try:
+            self._render_tiles(generation, missing, post=True)
+            if generation == self.generation:
+                self._render_tiles(generation, self._lookup(next_filenames)[1], post=False)
+        except Exception as e:
+            logger.warning("Rendering the contact sheet thumbnails failed: %s", e)
+
+    def _render_tiles(self, generation: int, missing: list, post: bool) -> None:
+        """
+        Render the thumbnails, until the generation changes.
+
+        :param generation: Generation of the page the thumbnails are on
+        :param missing: List of (tile, filename, cache_key, archive_key)
+        :param post: If True, post each thumbnail to the window, otherwise only add it to the render cache
+        :return: None
+        """
+
+        image_format = get_image_transfer_format()
+        pool = get_render_pool()
+        if len(missing) > 1 and pool is not None:
+            futures = {}
+            try:
+                for item in missing:
+                    future = pool.submit(item[1], self.pno, self.width, self.height, image_format)
+                    futures[future] = item
+                    with self._lock:
+                        if generation != self.generation:
+                            future.cancel()
+                            break
+                        self._pool_futures.append(future)
+                for future in as_completed(futures):
+                    if generation != self.generation or future.cancelled():
+                        break
+                    self._done(generation, futures[future], future.result(), post)
+                    missing = [item for item in missing if item is not futures[future]]
+            except BrokenExecutor:
+                logger.warning("The render worker processes stopped, rendering the thumbnails in this process")
+            finally:
+                for future in futures:
+                    future.cancel()
+            if generation != self.generation:
+                return
+
+        for item in missing:
+            if generation != self.generation:
+                return
+            self._done(generation, item, render_page_data(item[1], self.pno, self.width, self.height, image_format),
+                       post)
+
+    def _done(self, generation: int, item: tuple, data: bytes, post: bool) -> None:
+        tile, filename, cache_key, archive_key = item
+        store_page_image(cache_key, archive_key, data)
+        self.rendered += 1
+        if post and generation == self.generation:
+            self.window.write_event_value("-THUMB-", (generation, tile, data))
+
+    def stats(self) -> dict:
+        """
+        :return: Dict with the counters of cached and rendered thumbnails
+        """
+        return {"cached": self.cached, "rendered": self.rendered}
+
+    def shutdown(self) -> None:
+        """
+        Stop rendering, dropping the thumbnails that are still queued.
+
+        :return: None
+        """
+
+        self._next_generation()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def sample_status(sample_name: str, gate_name: str) -> str:
+    """
+    :return: Short review status of the sample at the gate, shown under its thumbnail
+    """
+    store = get_correction_store()
+    if store.is_discarded(sample_name):
+        return "DISCARD"
+    descriptors = store.sample_gates(sample_name).get(gate_name)
+    if descriptors:
+        return ", ".join(sorted(descriptors))
+    if get_review_log().is_reviewed(sample_name, gate_name):
+        return "approved"
+    return ""
+
+
+def bulk_review(sample_names: list, gate_name: str, review: str, descriptor: str = None) -> None:
+    """
+    Review several samples at once, as the main window does for a single one: approve them, set them to NA, discard
+    them, or replace their corrections at the gate with a descriptor. Each is one write to the correction store and
+    one to the review log.
+
+    :param sample_names: Names of the samples
+    :param gate_name: Name of the gate being QC'd
+    :param review: One of BULK_REVIEWS
+    :param descriptor: Descriptor given to the samples, for "Apply descriptor"
+    :return: None
+    """
+
+    if review == "NA":
+        add_many_to_output_yaml(gate_name, ["NA"], sample_names)
+    elif review == "DISCARD":
+        add_many_to_output_yaml("DISCARD", ["DISCARD"], sample_names)
+    elif review == "Apply descriptor":
+        replace_many_in_yaml(gate_name, [descriptor], sample_names)
+    elif review != "Approve":
+        raise ValueError("Unknown review: " + str(review))
+    record_reviews(sample_names, gate_name, BULK_REVIEWS[review])
+
+
+def contact_sheet_layout(rows: int, columns: int, size: tuple, descriptors: list) -> list:
+    """
+    :param rows: Rows of thumbnails
+    :param columns: Columns of thumbnails
+    :param size: (width, height) of the thumbnails
+    :param descriptors: Descriptors that can be given to the ticked samples
+    :return: Layout of the contact sheet window. The elements of each tile are keyed by (name, tile number)
+    """
+    tiles = []
+    for row in range(rows):
+        tiles.append([sg.Column([[sg.Image(key=("-TILE-", tile), size=size, enable_events=True)],
+                                 [sg.Checkbox("", key=("-SELECT-", tile), size=(size[0] // 9, 1))],
+                                 [sg.Text("", key=("-STATUS-", tile), size=(size[0] // 8, 1))]])
+                      for tile in range(row * columns, (row + 1) * columns)])
+    return [
+        [
+            sg.Button("Previous page"), sg.Button("Next page"), sg.Text("", size=(40, 1), key="-SHEETPAGE-"),
+            sg.Button("Select all"), sg.Button("Select none"),
+        ],
+        *tiles,
+        [
+            sg.Button("Approve"), sg.Button("Cannot answer / NA", key="NA"),
+            sg.Button("SAMPLES ARE BAD", key="DISCARD"),
+            sg.Combo(descriptors, key="-DESCRIPTOR-", readonly=True, size=(30, 1)), sg.Button("Apply descriptor"),
+            sg.Button("Close"),
+        ],
+    ]
+
+
+def create_contact_sheet_window(file_list: list, image_index: int, page_no, gate_name: str,
+                                event_descriptor_dict: dict, grid: tuple = DEFAULT_CONTACT_SHEET_GRID) -> None:
+    """
+    Creates the contact sheet window, starting at the page with the sample on screen in the main window. The samples
+    skipped by the navigation index (by default, the discarded ones) are left out.
+
+    :param file_list: list of all PDF files to process
+    :param image_index: index of the sample on screen in the main window
+    :param page_no: page number(s) from the layout
+    :param gate_name: Name of the gate being QC'd
+    :param event_descriptor_dict: Maps the event/button names to the descriptors. Taken from the layout file.
+    :param grid: (rows, columns) of thumbnails on a page of the sheet
+    :return: None
+    """
+
+    navigation = get_navigation_index(file_list)
+    indices = [index for index in range(len(file_list)) if navigation.is_visible(index)]
+    if not indices:
+        sg.popup("There are no samples to show")
+        return
+    rows, columns = grid
+    tiles = rows * columns
+    pages = (len(indices) + tiles - 1) // tiles
+    sheet_page = min(bisect.bisect_left(indices, image_index) // tiles, pages - 1)
+    width, height = thumbnail_size(page_no)
+    blank = blank_thumbnail(width, height)
+    descriptors = sorted({descriptor for descriptor in event_descriptor_dict.values()
+                          if not descriptor.startswith("CUSTOM")})
+
+    window = sg.Window("Contact sheet: " + gate_name, contact_sheet_layout(rows, columns, (width, height), descriptors),
+                       return_keyboard_events=True, use_default_focus=False, finalize=True)
+    renderer = ThumbnailRenderer(window, contact_sheet_page(page_no), width, height)
+
+    def page_indices(page: int) -> list:
+        return indices[page * tiles:(page + 1) * tiles]
+
+    def show_page() -> None:
+        shown = page_indices(sheet_page)
+        window["-SHEETPAGE-"].update(f"Page {sheet_page + 1}/{pages}, samples {sheet_page * tiles + 1}-"
+                                     f"{sheet_page * tiles + len(shown)} of {len(indices)}")
+        for tile in range(tiles):
+            window[("-TILE-", tile)].update(data=blank)
+            sample_name = collect_name_of_pdf_at_index(file_list, shown[tile]) if tile < len(shown) else ""
+            window[("-SELECT-", tile)].update(text=sample_name, value=False, disabled=tile >= len(shown))
+            window[("-STATUS-", tile)].update(sample_status(sample_name, gate_name) if sample_name else "")
+        next_filenames = [file_list[index] for index in page_indices(sheet_page + 1)]
+        for tile, data in renderer.show([file_list[index] for index in shown], next_filenames):
+            window[("-TILE-", tile)].update(data=data)
+
+    show_page()
+    while True:
+        metrics.end_event()
+        event, values = window.read()
+        if event in (sg.WIN_CLOSED, "Close", "Escape:27"):
+            break
+        metrics.begin_event("Contact sheet: " + str(event))
+        shown = page_indices(sheet_page)
+        if event == "-THUMB-":  # A thumbnail was rendered
+            generation, tile, data = values[event]
+            if generation == renderer.generation:
+                window[("-TILE-", tile)].update(data=data)
+        elif isinstance(event, tuple) and event[0] == "-TILE-":  # Clicking a thumbnail ticks or unticks its sample
+            if event[1] < len(shown):
+                window[("-SELECT-", event[1])].update(value=not values[("-SELECT-", event[1])])
+        elif event in ("Select all", "Select none"):
+            for tile in range(len(shown)):
+                window[("-SELECT-", tile)].update(value=event == "Select all")
+        elif event in NEXT_PAGE_EVENTS or event in PREVIOUS_PAGE_EVENTS:
+            new_page = min(max(sheet_page + (1 if event in NEXT_PAGE_EVENTS else -1), 0), pages - 1)
+            if new_page != sheet_page:
+                sheet_page = new_page
+                show_page()
+        elif event in BULK_REVIEWS:
+            selected = [tile for tile in range(len(shown)) if values[("-SELECT-", tile)]]
+            if not selected:
+                sg.popup("No samples are ticked")
+                continue
+            if event == "Apply descriptor" and not values["-DESCRIPTOR-"]:
+                sg.popup("Select a descriptor to apply")
+                continue
+            if event == "DISCARD" and not create_discard_are_you_sure_popup(len(selected)):
+                continue
+            sample_names = [collect_name_of_pdf_at_index(file_list, shown[tile]) for tile in selected]
+            bulk_review(sample_names, gate_name, event, descriptor=values["-DESCRIPTOR-"])
+            for tile, sample_name in zip(selected, sample_names):
+                navigation.refresh(shown[tile])
+                window[("-SELECT-", tile)].update(value=False)
+                window[("-STATUS-", tile)].update(sample_status(sample_name, gate_name))
+
+    metrics.end_event()
+    logger.info("Contact sheet thumbnails: %s", renderer.stats())
+    renderer.shutdown()
+    window.close()
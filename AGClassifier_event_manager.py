@@ -1,48 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
 import sys
-from glob import glob
+import threading
 import PySimpleGUI as sg
 
 from AGClassifier_utilities import create_invalid_select_window, create_pdf_window, update_image, add_to_output_yaml, \
-    collect_name_of_pdf_at_index, check_if_discarded, create_complete_window, check_if_in_yaml, remove_from_yaml, \
+    collect_name_of_pdf_at_index, create_complete_window, check_if_in_yaml, remove_from_yaml, \
     create_discard_are_you_sure_popup, create_yaml_string, post_window_warning, update_event_descriptor_dict, \
-    bind_arrows, unbind_arrows, create_clear_sample_corrections_are_you_sure_popup
-
-
-def check_event_categories(in_event_list, event_descriptor_dict) -> bool:
+    bind_arrows, unbind_arrows, create_clear_sample_corrections_are_you_sure_popup, RenderPrefetcher, \
+    set_render_prefetcher, NavigationIndex, set_navigation_index, get_navigation_index, SampleCatalog, \
+    get_correction_store, get_review_log, record_review, save_session_cursor, load_session_cursor, \
+    set_correction_yaml_global, set_page_archive, PageArchive, ensure_fitz_loaded, RenderPool, set_render_pool, \
+    ppm_size, get_image_size, ProgressiveRenderer, set_progressive_renderer, \
+    get_progressive_renderer, get_render_prefetcher, ResizeDebouncer, fit_image_size, set_image_size
+from AGClassifier_layouts import build_category_table
+from AGClassifier_contact_sheet import create_contact_sheet_window, DEFAULT_CONTACT_SHEET_GRID
+from AGClassifier_metrics import logger, metrics
+
+
+def check_event_categories(in_event_list, event_descriptor_dict, category_table=None) -> bool:
     """
     Check that only one event of each category is present.
     Custom_ events are an exception to this rule because Custom_ events can be selected multiple times.
     This function will check that the number of event categories is equal to the number of events.
 
     :param in_event_list: List of all "limit events" (i.e. events that are not context events) that were clicked.
-    :param event_descriptor_dict: Maps the event/button names to the descriptors. Taken from the .pickle file.
+    :param event_descriptor_dict: Maps the event/button names to the descriptors. Taken from the layout file.
+    :param category_table: Maps the events to their categories, as precomputed by build_category_table when the
+    layout is loaded. Computed from event_descriptor_dict if not given.
     :return: True if the number of event categories is equal to the number of events. False otherwise.
     """
-    event_list = in_event_list.copy()
-    print("event_list: ", event_list)
-    # Remove all custom events
-    for event in event_list:
-        if event.startswith("Custom"):  # Uses button name to check if it is a custom event
-            event_list.remove(event)
+    if category_table is None:
+        category_table = build_category_table(event_descriptor_dict)
+    logger.debug("event_list: %s", in_event_list)
+    # Custom events are not in the table
+    event_list = [event for event in in_event_list if not event.startswith("Custom")]
 
     # Collect the event categories of the remaining events
-    event_categories = []
-    for event in event_list:
-        if '_' in event_descriptor_dict[event]:
-            event_category = event_descriptor_dict[event].split("_")[0]
-        elif ' ' in event_descriptor_dict[event]:
-            event_category = event_descriptor_dict[event].split(" ")[0]
-            sys.stderr.write("WARNING: Event descriptor does not contain underscores. Splitting by space instead.")
-        else:
-            event_category = event_descriptor_dict[event]
-            sys.stderr.write("WARNING: Event descriptor does not contain underscores or spaces. Full descriptor will be"
-                             " used as event category.")
-        if event_category not in event_categories:
-            event_categories.append(event_category)
-    event_categories = set(event_categories)
-    print("event_categories: ", event_categories)
+    event_categories = set(category_table[event] for event in event_list)
+    logger.debug("event_categories: %s", event_categories)
 
     # Check that the number of event categories is equal to the number of events
     if len(event_categories) != len(event_list):
@@ -60,8 +57,8 @@ def limit_event_handler(event_list: list, event_descriptor_dict: dict, gate_name
     Checks if event exists in the button_descriptor_dict. If not, raises an error.
 
     :param event_list: List of all "limit events" (i.e. events that are not context events) that were clicked.
-    :param event_descriptor_dict: Maps the event/button names to the descriptors. Taken from the .pickle file.
-    :param gate_name: Name of the gate. Taken from the .pickle file.
+    :param event_descriptor_dict: Maps the event/button names to the descriptors. Taken from the layout file.
+    :param gate_name: Name of the gate. Taken from the layout file.
     :param sample_name: Name of the current sample. Taken from the PDF file name.
     :return: None
     """
@@ -81,8 +78,8 @@ def limit_event_handler(event_list: list, event_descriptor_dict: dict, gate_name
 def start_analysis(window_ref, image_index=0, file_list=[], page_no=0):
     """
     Start the analysis from the defined image index. Default is 0.
-    If the specified sample is discarded or already analysed, skip it and go to the next one.
-    If the specified sample is NOT discarded or analysed, display it and return the index.
+    If the specified sample is skipped by the navigation index (e.g. discarded), go to the next one instead.
+    Otherwise, display it and return the index.
 
     :param window_ref:
     :param image_index:
@@ -93,8 +90,8 @@ def start_analysis(window_ref, image_index=0, file_list=[], page_no=0):
 
     if not isinstance(file_list, list) or not file_list:
         raise ValueError("No file list provided")
-    if check_if_discarded(image_index, file_list=file_list):  # If the first sample is discarded, go to the next one
-        image_index = next_sample(window_ref=window_ref, image_index=image_index, file_list=file_list, page_no=page_no)
+    if not get_navigation_index(file_list).is_visible(image_index):  # If the first sample is skipped, go to the next
+        return next_sample(window_ref=window_ref, image_index=image_index, file_list=file_list, page_no=page_no)
 
     yaml_update_string = create_yaml_string(image_index=image_index, file_list=file_list)
     update_image(window_ref=window_ref, image_index=image_index, file_list=file_list, page_no=page_no,
@@ -103,10 +100,30 @@ def start_analysis(window_ref, image_index=0, file_list=[], page_no=0):
     return image_index
 
 
+def resume_index(file_list: list, gate_name: str) -> int:
+    """
+    Index of the sample START resumes at: the first sample that has not been reviewed at the gate yet. If every sample
+    has been reviewed, the sample the user was at in the last session, or else the first sample.
+
+    :param file_list: SampleCatalog of the input folder
+    :param gate_name: Name of the gate being QC'd
+    :return: Index in the file list
+    """
+
+    image_index = get_navigation_index(file_list).first_unreviewed()
+    if image_index is not None:
+        return image_index
+    cursor = load_session_cursor(gate_name)
+    for i in range(len(file_list)):
+        if collect_name_of_pdf_at_index(file_list, i) == cursor:
+            return i
+    return 0
+
+
 def next_sample(window_ref, image_index: int, file_list: list, page_no: int):
     """
-    Go to the next sample. If the next sample is discarded, skip it and go to the next one instead. If the index is out
-    of bounds, it means we have reached the last sample and we are done.
+    Go to the next sample that is not skipped by the navigation index (by default, the next non-discarded sample).
+    If there is none, it means we have reached the last sample and we are done.
 
     :param window_ref:
     :param image_index:
@@ -115,14 +132,10 @@ def next_sample(window_ref, image_index: int, file_list: list, page_no: int):
     :return: int if a valid sample is found, False if there are no more samples
     """
 
-    image_index = image_index + 1
-
-    # Validate image_index, if invalid, try next image until valid or end of list
-    while check_if_discarded(image_index, file_list=file_list):  # Skip discarded samples
-        image_index += 1
+    image_index = get_navigation_index(file_list).next(image_index)
 
-    # Check if new_index is out of scope. If so return False to finish
-    if image_index >= len(file_list):
+    # If there is no next sample, finish
+    if image_index is None:
         create_complete_window()  # All samples have been analysed
         sys.exit(0)
 
@@ -134,21 +147,14 @@ def next_sample(window_ref, image_index: int, file_list: list, page_no: int):
 
 
 def previous_sample(window_ref, image_index, file_list, page_no):
-    # Get the previous sample
-    # If there is no previous sample, do nothing
-    # If the previous sample is discarded, skip it and go to the previous one
-    # Until a non-discarded sample is found or there are no more samples, in which case do nothing
+    # Get the previous sample that is not skipped by the navigation index (by default, the previous non-discarded one)
+    # If there is no such sample, do nothing
 
-    if image_index == 0:
+    previous_index = get_navigation_index(file_list).previous(image_index)
+    if previous_index is None:
         sg.popup("This is the first sample")
         return image_index
-    else:
-        image_index = image_index - 1
-
-    while check_if_discarded(image_index, file_list=file_list):  # Skip discarded samples
-        image_index -= 1
-        if image_index == 0:
-            break
+    image_index = previous_index
 
     yaml_update_string = create_yaml_string(image_index=image_index, file_list=file_list)
     update_image(window_ref=window_ref, image_index=image_index, file_list=file_list, page_no=page_no,
@@ -157,6 +163,33 @@ def previous_sample(window_ref, image_index, file_list, page_no):
     return image_index
 
 
+def resize_images(window_ref, image_index, file_list, page_no, old_window_size, new_window_size) -> None:
+    """
+    Render the images at the size the resized window has room for, and show the sample on screen again at that size.
+    Prefetched samples rendered at the old size are dropped.
+
+    :param window_ref: reference to the main window
+    :param image_index: index of the sample on screen
+    :param file_list: list of all PDF files to process
+    :param page_no: page number(s) from the layout
+    :param old_window_size: (width, height) of the window the images were rendered for
+    :param new_window_size: (width, height) of the window now
+    :return: None
+    """
+
+    image_size = fit_image_size(page_no, old_window_size, new_window_size)
+    if image_size == get_image_size(page_no):
+        return
+    logger.debug("Window resized from %s to %s, rendering at %s", old_window_size, new_window_size, image_size)
+    set_image_size(image_size)
+    if get_render_prefetcher() is not None:
+        get_render_prefetcher().clear()
+    if window_ref["-COUNT-"].get():  # A sample is on screen
+        yaml_update_string = create_yaml_string(image_index=image_index, file_list=file_list)
+        update_image(window_ref=window_ref, image_index=image_index, file_list=file_list, page_no=page_no,
+                     sample_in_yaml_string=yaml_update_string)
+
+
 def is_context_event(event) -> bool:
     """
     Check if the event is a context event. Context events are the general elements of the GUI, not related to sample
@@ -167,13 +200,139 @@ def is_context_event(event) -> bool:
     """
 
     if event in ["START", "DONE, next image", "Previous image", "Exit", "WIN_CLOSED",
-                 "Open pdf", "NA", "DISCARD", "-SAMPLENO-", "-BINDARROWS-", "-CLEARFROMYAML-"]:
+                 "Open pdf", "NA", "DISCARD", "-SAMPLENO-", "-BINDARROWS-", "-CLEARFROMYAML-", "-NAVMODE-",
+                 "-CONTACTSHEET-"]:
         return True
     else:
         return False
 
 
-def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name) -> None:
+def pick_up_new_samples(window_ref, file_list: SampleCatalog, image_index: int, navigation: NavigationIndex):
+    """
+    Rescan the input folder. If PDFs were added or removed, the navigation index is rebuilt and the image index is
+    moved to where the current sample is now.
+
+    :param window_ref: reference to the main window
+    :param file_list: SampleCatalog of the input folder
+    :param image_index: index of the current sample
+    :param navigation: NavigationIndex of the file list
+    :return: (image_index, navigation), updated if the file list changed
+    """
+
+    current_path = file_list[image_index] if image_index < len(file_list) else None
+    if not file_list.rescan():
+        return image_index, navigation
+    if len(file_list) == 0:
+        raise ValueError("No pdf files left in input folder")
+    image_index = file_list.index_of(current_path, min(image_index, len(file_list) - 1))
+    navigation = NavigationIndex(file_list, navigation.gate_name, mode=navigation.mode)
+    set_navigation_index(navigation)
+    if window_ref["-COUNT-"].get():  # Only once a sample is shown
+        window_ref["-COUNT-"].update(str(image_index + 1) + "/" + str(len(file_list)))
+    logger.info("Input folder changed, %d samples", len(file_list))
+    return image_index, navigation
+
+
+def load_session(input_folder: str, gate_name: str, yaml_file: str = None, recursive: bool = False,
+                 navigation_mode: str = "Skip discarded", render_cache_dir: str = None, progress=None) -> tuple:
+    """
+    Load what the session needs before the first sample can be shown: the correction store, the page archive, the
+    sample list, the review log and the navigation index. This is the slow part of startup on a network share with
+    many PDFs, so the GUI runs it on a background thread, see start_session_loader.
+
+    :param input_folder: The input folder where the PDF files are located.
+    :param gate_name: Name of the gate being QC'd.
+    :param yaml_file: The output yaml file where the results are stored. None keeps the current correction store.
+    :param recursive: If True, PDFs in subfolders of the input folder are included.
+    :param navigation_mode: Initial navigation mode, one of NAVIGATION_MODES.
+    :param render_cache_dir: Folder of the page archive shared with other sessions. None to not use one.
+    :param progress: Function called with a short message as each stage starts, or None
+    :return: (file_list, navigation)
+    """
+
+    def report(message):
+        logger.info(message)
+        if progress is not None:
+            progress(message)
+
+    if yaml_file is not None:
+        report("Loading corrections...")
+        set_correction_yaml_global(yaml_file)
+    if render_cache_dir is not None:
+        report("Opening the render cache...")
+        set_page_archive(PageArchive(render_cache_dir))
+    report("Scanning the input folder...")
+    file_list = SampleCatalog(input_folder, recursive=recursive)
+    if len(file_list) == 0:
+        raise ValueError("No pdf files found in input folder")
+    report(f"Reading reviews of {len(file_list)} samples...")
+    get_correction_store()
+    get_review_log()
+    report(f"Indexing {len(file_list)} samples...")
+    navigation = NavigationIndex(file_list, gate_name, mode=navigation_mode)
+    set_navigation_index(navigation)
+    report("Loading the PDF renderer...")
+    ensure_fitz_loaded()  # Import of fitz was deferred, so that the first sample shown does not wait for it
+    return file_list, navigation
+
+
+def start_session_loader(window, input_folder: str, gate_name: str, **kwargs) -> threading.Thread:
+    """
+    Run load_session on a background thread, while the main window is already shown. Progress is posted to the window
+    as "-LOADING-" events, the result as a "-LOADED-" event with (file_list, navigation), and an error as a
+    "-LOADFAILED-" event with the exception. event_loop waits for these.
+
+    :param window: PySimpleGUI window
+    :param input_folder: The input folder where the PDF files are located.
+    :param gate_name: Name of the gate being QC'd.
+    :param kwargs: Other arguments of load_session
+    :return: The loader thread
+    """
+
+    def run():
+        try:
+            session = load_session(input_folder, gate_name,
+                                   progress=lambda message: window.write_event_value("-LOADING-", message), **kwargs)
+        except Exception as error:
+            logger.exception("Loading the session failed")
+            window.write_event_value("-LOADFAILED-", error)
+        else:
+            window.write_event_value("-LOADED-", session)
+
+    thread = threading.Thread(target=run, name="session-loader", daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for_session(window):
+    """
+    Handle the events of the main window until the session loader is done. Only the progress is shown and closing the
+    window is handled; the other buttons do nothing until START is enabled.
+
+    :param window: PySimpleGUI window
+    :return: (file_list, navigation), or None if the window was closed or loading failed
+    """
+
+    while True:
+        event, values = window.read()
+        if event == "-LOADING-":
+            window["-LOADING-"].update(value=values[event])
+        elif event == "-LOADED-":
+            return values[event]
+        elif event == "-LOADFAILED-":
+            window["-LOADING-"].update(value="Loading failed")
+            sg.popup_error(f"Loading the samples failed:\n{values[event]}", title="Loading failed")
+            return None
+        elif event in ("Exit", sg.WIN_CLOSED):
+            return None
+        else:
+            logger.debug("Ignoring event %s while loading", event)
+
+
+def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name, prefetch_depth=2,
+               navigation_mode="Skip discarded", recursive=False, rescan_interval=10, category_table=None,
+               session_loader=None, render_processes=None, preview=True,
+               contact_sheet_grid=DEFAULT_CONTACT_SHEET_GRID) -> None:
     """
     The event loop. This is the main function of the program.
     TODO handle image_index events
@@ -181,29 +340,93 @@ def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name)
 
     :param window: PySimpleGUI window
     :param input_folder: The input folder where the PDF files are located. Defined by user on startup.
-    :param event_descriptor_dict: Maps the event/button names to the descriptors. Taken from the .pickle file.
+    :param event_descriptor_dict: Maps the event/button names to the descriptors. Taken from the layout file.
     :param page_no: The page number of the PDF file that will be displayed.
-    :param gate_name: Name of the gate being QC'd. Taken from the .pickle file.
+    :param gate_name: Name of the gate being QC'd. Taken from the layout file.
     :param yaml_file: The output yaml file where the results will be stored.
+    :param prefetch_depth: Number of upcoming samples rendered in the background. 0 turns prefetching off.
+    :param navigation_mode: Initial navigation mode, one of NAVIGATION_MODES. Can be changed in the GUI.
+    :param recursive: If True, PDFs in subfolders of the input folder are included.
+    :param rescan_interval: Seconds between checks of the input folder for new PDFs while idle. 0 turns it off.
+    :param category_table: Maps the events to their categories, see build_category_table. Computed from
+    event_descriptor_dict if not given.
+    :param session_loader: Thread started by start_session_loader; the loop waits for it before START is enabled. If
+    None, the session is loaded here, before the loop starts.
+    :param render_processes: Number of worker processes rendering the pages of a sample in parallel. Default is one
+    per page for layouts with more than one image, leaving a core to the GUI, and none if that makes fewer than 2.
+    0 renders the pages one by one in this process.
+    :param preview: If True, pages that are not rendered yet are shown as a low resolution preview first.
+    :param contact_sheet_grid: (rows, columns) of thumbnails on a page of the contact sheet.
     :return: None
     """
 
+    if category_table is None:
+        category_table = build_category_table(event_descriptor_dict)
+    if render_processes is None:
+        # Workers sharing the GUI's core only slow it down, and a single worker does not render in parallel
+        render_processes = 0 if isinstance(page_no, int) else min(len(page_no), (os.cpu_count() or 1) - 1)
+        if render_processes < 2:
+            render_processes = 0
+    if render_processes > 0:  # Started before waiting for the session, so the workers start up while it loads
+        set_render_pool(RenderPool(render_processes, slot_bytes=ppm_size(*get_image_size(page_no))))
     image_index = 0
-    file_list = glob(input_folder + "/*.pdf")  # initialise_parameters(event_descriptor_dict)
-    if len(file_list) == 0 or file_list is None:
-        raise ValueError("No pdf files found in input folder")
+    if session_loader is not None:
+        session = wait_for_session(window)
+        if session is None:
+            return
+        file_list, navigation = session
+    else:
+        file_list, navigation = load_session(input_folder, gate_name, recursive=recursive,
+                                             navigation_mode=navigation_mode)
+    window["-LOADING-"].update(value=f"{len(file_list)} samples")
+    window["START"].update(disabled=False)
+    if prefetch_depth > 0:
+        set_render_prefetcher(RenderPrefetcher(page_no, depth=prefetch_depth))
+    if preview:
+        set_progressive_renderer(ProgressiveRenderer(window))
+    window.bind("<Configure>", "-CONFIGURE-")
+    resize = ResizeDebouncer(window.size)
 
     # Initialise the event list with no elements
     event_list = []
+    resume = True  # START resumes at the first unreviewed sample, unless a sample number was entered
+    cursor_index = None  # Index of the sample last saved as the session cursor
     bOk = True
     while bOk:
 
-        event, values = window.read()
-        print("EVENT: ", event)
-        print("VALUES: ", values)
+        # Time the handling of each event, not the time spent waiting for it
+        metrics.end_event()
+        timeout = int(rescan_interval * 1000) if rescan_interval > 0 else None
+        if resize.timeout() is not None:  # Wake up when the window has kept its new size long enough
+            timeout = resize.timeout() if timeout is None else min(timeout, resize.timeout())
+        event, values = window.read(timeout=timeout)
+        if event == "-CONFIGURE-":  # The window was moved or resized, or grew to fit its content
+            resize.on_configure(window.size)
+            continue
+        if event == sg.TIMEOUT_KEY and resize.timeout() is not None:
+            resized = resize.settled()
+            if resized is not None:
+                metrics.begin_event("-RESIZE-")
+                resize_images(window, image_index, file_list, page_no, *resized)
+                resize.rebase(window.size)
+            continue
+        if event == sg.TIMEOUT_KEY:  # Idle: pick up PDFs written to the input folder since the last check
+            image_index, navigation = pick_up_new_samples(window, file_list, image_index, navigation)
+            # Corrections and reviews saved by other annotators working on the folder
+            if get_correction_store().refresh() | get_review_log().refresh():
+                navigation = NavigationIndex(file_list, gate_name, mode=navigation.mode)
+                set_navigation_index(navigation)
+            continue
+        metrics.begin_event(event)
+        if event == "-REFINED-":  # Full resolution page of the sample on screen, replacing its preview
+            if get_progressive_renderer() is not None:
+                get_progressive_renderer().show_refined(window, values[event], page_no)
+            continue
+        logger.debug("EVENT: %s", event)
+        logger.debug("VALUES: %s", values)
         sample_name = collect_name_of_pdf_at_index(file_list, image_index)
         sample_in_yaml = check_if_in_yaml(sample_name, gate_name)  # Flag used to 'correct' if new limits
-        if sample_in_yaml:
+        if sample_in_yaml or get_review_log().is_reviewed(sample_name, gate_name):
             post_window_warning(window, f"SAMPLE {sample_name} HAS ALREADY BEEN ANALYSED!")
         else:
             post_window_warning(window, "")
@@ -229,6 +452,15 @@ def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name)
                         # Out of bounds, use old value
                         image_index = old_image_index
                         values["-SAMPLENO-"] = image_index
+                    else:
+                        resume = False
+            elif event == "-CONTACTSHEET-":  # Review many samples at once, from a grid of thumbnails
+                create_contact_sheet_window(file_list, image_index, page_no, gate_name, event_descriptor_dict,
+                                            grid=contact_sheet_grid)
+                if window["-COUNT-"].get():  # The sample on screen may have been reviewed on the sheet
+                    window["-INDEX-"].update(create_yaml_string(image_index=image_index, file_list=file_list))
+            elif event == "-NAVMODE-":  # Change which samples next/previous skip
+                navigation.set_mode(values["-NAVMODE-"])
             elif event == "-BINDARROWS-":  # Bind/unbind the arrow keys to the buttons, depending on the checkbox
                 if not values["-BINDARROWS-"]:  # If the checkbox is not checked, unbind the arrows
                     unbind_arrows(window)
@@ -240,6 +472,8 @@ def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name)
                     pass
                 else:
                     remove_from_yaml(sample_name, gate_name)
+                    record_review(sample_name, gate_name, "cleared")
+                    navigation.refresh(image_index)
             elif event == "Exit" or event == "WIN_CLOSED":
                 sys.exit(0)
             else:
@@ -252,11 +486,14 @@ def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name)
                             add_to_output_yaml(gate_name="DISCARD",
                                                descriptors=['DISCARD'],
                                                sample_id=collect_name_of_pdf_at_index(file_list, image_index))
+                            record_review(sample_name, gate_name, "DISCARD")
                     elif event == "NA":
                         # Add the sample to the yaml file under the NA entry for that gate
                         add_to_output_yaml(gate_name=gate_name, descriptors=['NA'],
                                            sample_id=collect_name_of_pdf_at_index(file_list, image_index))
+                        record_review(sample_name, gate_name, "NA")
                     event_list = []
+                    navigation.refresh(image_index)
                     image_index = next_sample(window_ref=window, image_index=image_index,
                                               file_list=file_list, page_no=page_no)
                 elif event in ["Previous image"]:
@@ -266,20 +503,24 @@ def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name)
                 elif event == "START":
                     event_list = []
                     window["-CORRECTIONS-"].update(value=' '.join(event_list))  # Display the event list in the GUI
-                    # Trigger update_image at sample X or from the beginning
+                    # Trigger update_image at the sample entered, or where the last session left off
+                    if resume:
+                        image_index = resume_index(file_list, gate_name)
                     image_index = start_analysis(window_ref=window, image_index=image_index,
                                                  file_list=file_list, page_no=page_no)
                 elif event == "DONE, next image":
                     # Update 'event_descriptor_dict' with the new custom descriptors
                     new_descriptors = [values["-CUSTOM1-"], values["-CUSTOM2-"], values["-CUSTOM3-"]]
                     event_descriptor_dict = update_event_descriptor_dict(event_descriptor_dict, new_descriptors)
-                    print("event_descriptor_dict:", event_descriptor_dict)
+                    logger.debug("event_descriptor_dict: %s", event_descriptor_dict)
                     # Check that the event list is valid. This spawns an invalid selection window if not
-                    if check_event_categories(event_list, event_descriptor_dict):
+                    if check_event_categories(event_list, event_descriptor_dict, category_table):
                         if sample_in_yaml and event_list:  # If sample was already in the yaml and new limits were given
                             remove_from_yaml(sample_name, gate_name)
                         # If so, run the limit event handler
                         limit_event_handler(event_list, event_descriptor_dict, gate_name, sample_name)
+                        record_review(sample_name, gate_name, "corrected" if event_list else "approved")
+                        navigation.refresh(image_index)
                         # then clear the event list and go to the next sample
                         event_list = []
                         window["-CORRECTIONS-"].update(value=' '.join(event_list))  # Display the event list in the GUI
@@ -298,10 +539,14 @@ def event_loop(window, input_folder, event_descriptor_dict, page_no, gate_name)
 
         # Recheck sample and post warning if needed
         sample_name = collect_name_of_pdf_at_index(file_list, image_index)
+        if window["-COUNT-"].get() and image_index != cursor_index:  # Once a sample is shown, remember where we are
+            save_session_cursor(gate_name, sample_name)
+            cursor_index = image_index
         sample_in_yaml = check_if_in_yaml(sample_name, gate_name)
-        if sample_in_yaml:
+        if sample_in_yaml or get_review_log().is_reviewed(sample_name, gate_name):
             post_window_warning(window, f"SAMPLE {sample_name} HAS ALREADY BEEN ANALYSED!")
         else:
             post_window_warning(window, "")
+        resize.rebase(window.size)  # The window may have grown to fit a new sample, which is not a resize
 
     return
@@ -2,96 +2,122 @@
 # -*- coding: utf-8 -*-
 
 import PySimpleGUI as sg
+import json
 import pickle
 import sys
 import os
 
-# **************** Image viewer layouts ****************
-
-iv_column_1_image = [
-
-    [sg.Text("Image Viewer"), sg.Text(size=(120, 1), key="-WARNING-")],
-
-    [sg.Text(size=(80, 1), key="-TOUT-"), sg.Text(size=(40, 1), key="-COUNT-")],
-
-    [sg.Text("Sample ID exists in these indicies:")],
-
-    [sg.Text(size=(120, 1), key="-INDEX-")],
+from AGClassifier_metrics import logger
+from AGClassifier_utilities import NAVIGATION_MODES, validate_page_no, yaml, yaml_loader
 
-    [sg.Image(key="-IMAGE-", size=(320, 280))],
+# File name endings of declarative layout specs, see load_layout_spec
+LAYOUT_SPEC_SUFFIXES = (".layout.yaml", ".layout.yml", ".layout.json")
 
-]
+# Events of the fixed parts of the layout, which the buttons of a layout spec must not reuse
+RESERVED_EVENTS = ("START", "-SAMPLENO-", "DONE, next image", "Previous image", "-BINDARROWS-", "-NAVMODE-",
+                   "-CLEARFROMYAML-", "Open pdf", "DISCARD", "NA", "-CONTACTSHEET-")
 
-iv_column_2_images = [
+# Size of the buttons of a layout spec that do not give one
+DEFAULT_BUTTON_SIZE = (12, 4)
+# Size of the custom buttons that do not give one, as in the template scripts
+DEFAULT_CUSTOM_BUTTON_SIZE = (16, 4)
 
-    [sg.Text("Image Viewer"), sg.Text(size=(120, 1), key="-WARNING-")],
+# Custom buttons of a layout spec that does not list any, as in the template scripts
+DEFAULT_CUSTOM_BUTTONS = [{"label": "Custom 1", "descriptor": "CUSTOM_my_first_button"},
+                          {"label": "Custom 2", "descriptor": "CUSTOM_my_second_button"},
+                          {"label": "Custom 3", "descriptor": "CUSTOM_my_third_button"}]
 
-    [sg.Text(size=(80, 1), key="-TOUT-"), sg.Text(size=(40, 1), key="-COUNT-")],
+# **************** Image viewer layouts ****************
+# The fixed parts of the layout are made by functions, as PySimpleGUI elements can only be used in one window
 
-    [sg.Text("Sample ID exists in these indicies:")],
 
-    [sg.Text(size=(120, 1), key="-INDEX-")],
+def image_viewer_column(number_of_images: int) -> list:
+    """
+    :param number_of_images: 1, 2 or 3
+    :return: Image viewer column of the layout, with "-IMAGE-", "-IMAGE2-" and "-IMAGE3-" as needed
+    """
+    column = [
 
-    [sg.Image(key="-IMAGE-", size=(160, 140))],
+        [sg.Text("Image Viewer"), sg.Text(size=(120, 1), key="-WARNING-")],
 
-    [sg.Image(key="-IMAGE2-", size=(160, 140))],
+        [sg.Text(size=(80, 1), key="-TOUT-"), sg.Text(size=(40, 1), key="-COUNT-")],
 
-]
+        [sg.Text("Sample ID exists in these indicies:")],
 
-iv_column_3_images = [
+        [sg.Text(size=(120, 1), key="-INDEX-")],
 
-    [sg.Text("Image Viewer"), sg.Text(size=(120, 1), key="-WARNING-")],
+    ]
+    if number_of_images == 1:
+        column.append([sg.Image(key="-IMAGE-", size=(320, 280))])
+    elif number_of_images == 2:
+        column.append([sg.Image(key="-IMAGE-", size=(160, 140))])
+        column.append([sg.Image(key="-IMAGE2-", size=(160, 140))])
+    elif number_of_images == 3:
+        column.append([sg.Image(key="-IMAGE-", size=(160, 140))])
+        column.append([sg.Image(key="-IMAGE2-", size=(160, 140)), sg.Image(key="-IMAGE3-", size=(160, 140))])
+    else:
+        raise ValueError('Corrupted layout, number of images in the image viewer columns must be 1, 2 or 3')
+    return column
+# *****************  ***********************
 
-    [sg.Text(size=(80, 1), key="-TOUT-"), sg.Text(size=(40, 1), key="-COUNT-")],
 
-    [sg.Text("Sample ID exists in these indicies:")],
+# ***************** extra buttons ***********************
+def extra_buttons_column() -> list:
+    return [
 
-    [sg.Text(size=(120, 1), key="-INDEX-")],
+        [
+            sg.Button('Open pdf', pad=(0, 35), size=(16, 4)),
+        ],
+        [
+            sg.Button("SAMPLE IS BAD", key='DISCARD', pad=(0, 35), size=(16, 4)),
+        ],
+        [
+            sg.Button('Cannot answer / NA', key='NA', pad=(0, 35), size=(16, 4)),
+        ],
+        [
+            sg.Button('Contact sheet', key='-CONTACTSHEET-', pad=(0, 35), size=(16, 4)),
+        ],
+    ]
 
-    [sg.Image(key="-IMAGE-", size=(160, 140))],
 
-    [sg.Image(key="-IMAGE2-", size=(160, 140)), sg.Image(key="-IMAGE3-", size=(160, 140))],
+def top_layout() -> list:
+    """
+    :return: Static top part of the layout
+    """
+    return [
+        [
+            sg.Button('START', pad=(0, 25), size=(60, 4), disabled=True), sg.Text("Sample No:"),
+            sg.In(size=(5, 1), enable_events=True, key="-SAMPLENO-", pad=(0, 5))
+        ],
+        [
+            sg.Text("Loading...", size=(60, 1), key="-LOADING-"),  # START is enabled once the samples are loaded
+        ]
+    ]
 
-]
-# *****************  ***********************
 
-# ***************** extra buttons ***********************
-extra_buttons_column = [
-
-    [
-        sg.Button('Open pdf', pad=(0, 35), size=(16, 4)),
-    ],
-    [
-        sg.Button("SAMPLE IS BAD", key='DISCARD', pad=(0, 35), size=(16, 4)),
-    ],
-    [
-        sg.Button('Cannot answer / NA', key='NA', pad=(0, 35), size=(16, 4)),
-    ],
-]
-
-# Static top part of the layout
-top_layout = [
-    [
-        sg.Button('START', pad=(0, 25), size=(60, 4)), sg.Text("Sample No:"),
-        sg.In(size=(5, 1), enable_events=True, key="-SAMPLENO-", pad=(0, 5))
-    ]
-]
-
-# Static bottom part of the layout
-bottom_layout = [
-    [
-        sg.Button('DONE, next image', size=(60, 4)),
-    ],
-    [
-        sg.Button('Previous image', size=(60, 4)),
-    ],
-    [
-        sg.Checkbox("Bind arrow keys to navigation", key="-BINDARROWS-", default=False, enable_events=True),
-    ],
-    [
-        sg.Button('Remove stored corrections', key="-CLEARFROMYAML-", size=(16, 4)),
+def bottom_layout() -> list:
+    """
+    :return: Static bottom part of the layout
+    """
+    return [
+        [
+            sg.Button('DONE, next image', size=(60, 4)),
+        ],
+        [
+            sg.Button('Previous image', size=(60, 4)),
+        ],
+        [
+            sg.Checkbox("Bind arrow keys to navigation", key="-BINDARROWS-", default=False, enable_events=True),
+        ],
+        [
+            sg.Text("Navigation:"),
+            sg.Combo(NAVIGATION_MODES, default_value=NAVIGATION_MODES[0], key="-NAVMODE-", readonly=True,
+                     enable_events=True),
+        ],
+        [
+            sg.Button('Remove stored corrections', key="-CLEARFROMYAML-", size=(16, 4)),
+        ]
     ]
-]
 
 
 # ***********************************************************
@@ -115,7 +141,7 @@ def layout_compositor(variable_layout, image_viewer_layout):
 
             sg.VSeperator(),
 
-            sg.Column(extra_buttons_column),
+            sg.Column(extra_buttons_column()),
 
         ]
 
@@ -123,70 +149,392 @@ def layout_compositor(variable_layout, image_viewer_layout):
     return layout
 
 
-def layout_selector(images_dir=None):
+# ***************** Event categories ***********************
+
+def descriptor_category(descriptor: str) -> str:
     """
-    GUI interface to select the layout. (With an image preview of the various layouts ?)
-    The variable parts of the layouts are stored as pickle files, which are added to the fixed parts of the layout by
-    the compositor. If a images_dir is given, the function will try to find a pickle file in the parent directory.
-    Otherwise, the user will need to select the pickle file manually.
-    :param images_dir: The directory where the images are. The expectation is that the pickle file is in the parent dir.
-    If a single .pickle file is found in the parent dir, it is automatically selected. If there are none, or more than
-    one, the user will need select the pickle file (from any directory).
-    :return: layout, event_descriptor_dict, page_no, gate_name
-    """
-    # Check if there is a pickle file in the parent directory
-    if images_dir is not None:
-        potential_pickle_dir = os.path.dirname(images_dir)  # parent directory
-        picke_files = [file for file in os.listdir(potential_pickle_dir) if file.endswith(".pickle")]
-        if len(picke_files) == 1:  # If there is a single pickle in parent dir, choose that one
-            sg.popup(f"Automatically detected pickle file: '{picke_files[0]}'.\nIf that is the right file, you don't"
-                     f" need to select a pickle file manually. Press OK to continue :)",
-                     title="Found pickle file!")
-            layout_pickle_file = os.path.join(potential_pickle_dir, picke_files[0])
+    Category of an event descriptor: the part before the first underscore, or before the first space if there is no
+    underscore, or the whole descriptor. Only one event of each category can be selected for a sample.
+
+    :param descriptor: Event descriptor, e.g. "PBMC-FSC_70k"
+    :return: Category, e.g. "PBMC-FSC"
+    """
+    if '_' in descriptor:
+        return descriptor.split("_")[0]
+    elif ' ' in descriptor:
+        return descriptor.split(" ")[0]
+    return descriptor
+
+
+def build_category_table(event_descriptor_dict: dict) -> dict:
+    """
+    Precompute the category of every event of a layout, for check_event_categories. Custom events are left out, as
+    they can be selected together. Descriptors without underscores are reported here, once, instead of on every click.
+
+    :param event_descriptor_dict: Maps the event/button names to the descriptors
+    :return: Dict of event -> category
+    """
+    category_table = {}
+    for event, descriptor in event_descriptor_dict.items():
+        if event.startswith("Custom"):  # Uses button name to check if it is a custom event
+            continue
+        if '_' not in descriptor:
+            if ' ' in descriptor:
+                logger.warning("Event descriptor '%s' does not contain underscores. Splitting by space instead.",
+                               descriptor)
+            else:
+                logger.warning("Event descriptor '%s' does not contain underscores or spaces. Full descriptor will be "
+                               "used as event category.", descriptor)
+        category_table[event] = descriptor_category(descriptor)
+    return category_table
+
+
+# ***************** Layout specs ***********************
+
+# Validated layout specs by path, with the modification time and size of the file they were read from
+_layout_spec_cache = {}
+
+
+def is_layout_spec(path: str) -> bool:
+    return path.lower().endswith(LAYOUT_SPEC_SUFFIXES)
+
+
+def _button_size(value, where: str, default: tuple) -> tuple:
+    if value is None:
+        return default
+    if not (isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(v, int) for v in value)):
+        raise ValueError(f"Invalid layout spec: size of {where} must be [width, height], found {value!r}")
+    return tuple(value)
+
+
+def _validate_button(button, where: str, default_size: tuple = DEFAULT_BUTTON_SIZE) -> dict:
+    if not isinstance(button, dict) or not isinstance(button.get("label"), str) or not button["label"]:
+        raise ValueError(f"Invalid layout spec: {where} must have a 'label', found {button!r}")
+    unknown = set(button) - {"label", "descriptor", "size", "key"}
+    if unknown:
+        raise ValueError(f"Invalid layout spec: unknown field(s) {sorted(unknown)} in {where}")
+    descriptor = button.get("descriptor")
+    if not isinstance(descriptor, str) or not descriptor.strip():
+        raise ValueError(f"Invalid layout spec: button '{button['label']}' has no descriptor")
+    key = button.get("key")
+    if key is not None and not isinstance(key, str):
+        raise ValueError(f"Invalid layout spec: key of button '{button['label']}' must be a string")
+    return {"label": button["label"], "descriptor": descriptor,
+            "size": _button_size(button.get("size"), where, default_size), "key": key}
+
+
+def validate_layout_spec(spec: dict) -> dict:
+    """
+    Check a layout spec and fill in its defaults. The event names, descriptors, page indicies and number of images are
+    all checked here, so that a broken layout fails when it is loaded, not when a button is clicked.
+
+    :param spec: Layout spec, as read from the file
+    :return: Validated spec, with "gate_name", "page_indicies" (int or tuple), "number_of_images", "button_rows",
+    "custom_buttons", "event_descriptor_dict" and "category_table"
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Invalid layout spec: expected a mapping at the top level")
+    unknown = set(spec) - {"gate_name", "page_indicies", "number_of_images", "button_rows", "custom_buttons"}
+    if unknown:
+        raise ValueError(f"Invalid layout spec: unknown field(s) {sorted(unknown)}")
+
+    gate_name = spec.get("gate_name")
+    if not isinstance(gate_name, str) or not gate_name.strip():
+        raise ValueError("Invalid layout spec: 'gate_name' must be a non-empty string")
+    if gate_name == "DISCARD":
+        raise ValueError("Invalid layout spec: 'DISCARD' is reserved and cannot be a gate name")
+
+    # page_no is an integer for 1 image, a tuple of integers for 2 or 3 images
+    page_indicies = spec.get("page_indicies")
+    if isinstance(page_indicies, list):
+        page_indicies = tuple(page_indicies)
+        if len(page_indicies) == 1:
+            page_indicies = page_indicies[0]
+    try:
+        validate_page_no(page_indicies)
+    except TypeError:
+        raise ValueError(f"Invalid layout spec: 'page_indicies' must be an integer or a list of 2 or 3 integers, "
+                         f"found {spec.get('page_indicies')!r}")
+    pages = (page_indicies,) if isinstance(page_indicies, int) else page_indicies
+    if any(pno < 0 for pno in pages):
+        raise ValueError("Invalid layout spec: 'page_indicies' must not be negative")
+    number_of_images = spec.get("number_of_images", len(pages))
+    if number_of_images not in (1, 2, 3):
+        raise ValueError('Corrupted layout, number of images in the image viewer columns must be 1, 2 or 3')
+    if number_of_images != len(pages):
+        raise ValueError(f"Invalid layout spec: 'number_of_images' is {number_of_images}, but {len(pages)} page "
+                         f"indicies are given")
+
+    button_rows = spec.get("button_rows") or []
+    if not isinstance(button_rows, list) or not all(isinstance(row, list) for row in button_rows):
+        raise ValueError("Invalid layout spec: 'button_rows' must be a list of rows, each a list of buttons")
+    button_rows = [[_validate_button(button, f"button {column + 1} of row {row_number + 1}")
+                    for column, button in enumerate(row)] for row_number, row in enumerate(button_rows)]
+    custom_buttons = spec.get("custom_buttons", DEFAULT_CUSTOM_BUTTONS)
+    if not isinstance(custom_buttons, list) or len(custom_buttons) != 3:
+        raise ValueError("Invalid layout spec: 'custom_buttons' must list the 3 custom buttons")
+    custom_buttons = [_validate_button(button, f"custom button {number + 1}", DEFAULT_CUSTOM_BUTTON_SIZE)
+                      for number, button in enumerate(custom_buttons)]
+
+    event_descriptor_dict = {}
+    for button in [button for row in button_rows for button in row]:
+        event = button["key"] or button["label"]
+        if event.startswith("Custom"):
+            raise ValueError(f"Invalid layout spec: button '{event}' starts with 'Custom', which is reserved for the "
+                             f"custom buttons")
+        if event in RESERVED_EVENTS:
+            raise ValueError(f"Invalid layout spec: event '{event}' is used by the fixed part of the layout")
+        if event in event_descriptor_dict:
+            raise ValueError(f"Invalid layout spec: event '{event}' is used more than once")
+        if button["descriptor"].startswith("CUSTOM"):
+            raise ValueError(f"Invalid layout spec: descriptor '{button['descriptor']}' of button '{event}' starts "
+                             f"with 'CUSTOM', which is reserved for the custom buttons")
+        event_descriptor_dict[event] = button["descriptor"]
+    for number, button in enumerate(custom_buttons, start=1):
+        if button["key"] not in (None, f"Custom {number}") or button["label"] != f"Custom {number}":
+            raise ValueError(f"Invalid layout spec: custom button {number} must be labelled 'Custom {number}'")
+        if not button["descriptor"].startswith("CUSTOM"):
+            raise ValueError(f"Invalid layout spec: descriptor of custom button {number} must start with 'CUSTOM'")
+        event_descriptor_dict[button["label"]] = button["descriptor"]
+
+    # Two buttons with the same descriptor would be indistinguishable in the output file
+    descriptors = list(event_descriptor_dict.values())
+    duplicates = sorted(set(descriptor for descriptor in descriptors if descriptors.count(descriptor) > 1))
+    if duplicates:
+        raise ValueError(f"Invalid layout spec: descriptor(s) {duplicates} are used by more than one button")
+
+    return {"gate_name": gate_name,
+            "page_indicies": page_indicies,
+            "number_of_images": number_of_images,
+            "button_rows": button_rows,
+            "custom_buttons": custom_buttons,
+            "event_descriptor_dict": event_descriptor_dict,
+            "category_table": build_category_table(event_descriptor_dict)}
+
+
+def load_layout_spec(path: str) -> dict:
+    """
+    Read and validate a declarative layout spec, a .layout.yaml or .layout.json file. The validated spec is cached
+    until the file changes, so opening another window with the same layout does not read it again.
+
+    The spec has the gate name, the page indicies shown (an integer, or a list of 2 or 3 integers), optionally the
+    number of images (checked against the page indicies), the rows of correction buttons and optionally the 3 custom
+    buttons. Every button has a label, the descriptor written to the output file and optionally a size and an event
+    key (the label by default). Example:
+
+        gate_name: singlet & pbmc
+        page_indicies: [0, 1, 2]
+        button_rows:
+          - - {label: "PBMC-FSC 70k", descriptor: PBMC-FSC_70k}
+            - {label: "PBMC-FSC 80k", descriptor: PBMC-FSC_80k}
+        custom_buttons:
+          - {label: Custom 1, descriptor: CUSTOM_Xlim}
+          - {label: Custom 2, descriptor: CUSTOM_Ylim}
+          - {label: Custom 3, descriptor: CUSTOM_other}
+
+    :param path: Path of the layout spec
+    :return: Validated spec, see validate_layout_spec
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _layout_spec_cache.get(os.path.abspath(path))
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, "rb") as in_file:
+        if path.lower().endswith(".json"):
+            spec = json.load(in_file)
         else:
-            # Select pickle file
-            layout_pickle_file = sg.popup_get_file(message="Please select the layout 'pickle' file:",
-                                                   title="Select layout pickle file",
-                                                   default_path=potential_pickle_dir,
-                                                   file_types=(("Pickled layout files", "*.pickle"),))
-    else:
-        # Select pickle file when no path is given
-        layout_pickle_file = sg.popup_get_file(message="Please select the layout 'pickle' file:",
-                                               title="Select layout pickle file",
-                                               file_types=(("Pickled layout files", "*.pickle"),))
-    #while layout_pickle_file is None or layout_pickle_file == "":
-    #    sg.popup("Please select a valid layout pickle file")
-    #    layout_pickle_file = sg.popup_get_file("Select layout pickle file",
-    #                                           file_types=(("Pickled layout files", "*.pickle"),))
-    # Read the pickle file
-    with open(layout_pickle_file, 'rb') as f:
+            spec = yaml.load(in_file, Loader=yaml_loader())
+    try:
+        spec = validate_layout_spec(spec)
+    except ValueError as error:
+        raise ValueError(f"{path}: {error}") from None
+    _layout_spec_cache[os.path.abspath(path)] = (signature, spec)
+    return spec
 
+
+def compile_layout_spec(spec: dict) -> list:
+    """
+    Build the variable part of the layout from a validated layout spec, with new elements on every call.
+
+    :param spec: Validated layout spec
+    :return: variable_layout, as in the layout pickle files
+    """
+    variable_layout = [
+        [
+            sg.Text("Currently selected corrections are: "),
+            sg.Text("", key="-CORRECTIONS-"),
+        ],
+    ]
+    for row in spec["button_rows"]:
+        variable_layout.append([sg.Button(button["label"], key=button["key"], size=button["size"]) for button in row])
+    custom_inputs = []
+    for number in range(1, len(spec["custom_buttons"]) + 1):
+        custom_inputs.append(sg.Text(f"Custom {number}:", justification='right'))
+        custom_inputs.append(sg.In(size=(15, 1), enable_events=False, default_text=0, key=f"-CUSTOM{number}-"))
+    variable_layout.append(custom_inputs)
+    variable_layout.append([sg.Button(button["label"], key=button["key"], size=button["size"], pad=(35, 0))
+                            for button in spec["custom_buttons"]])
+    return variable_layout
+
+
+def read_layout_pickle(layout_pickle_file):
+    """
+    Read a layout pickle file, as made by the scripts in layout_template_script.
+    :param layout_pickle_file: Path to the pickle file
+    :return: Dict with the "variable_layout", "number_of_images", "event_descriptor_dict", "page_indicies" and
+    "gate_name" of the layout
+    """
+    with open(layout_pickle_file, 'rb') as f:
         variable_layout_dict = pickle.load(f)
+    return variable_layout_dict
 
-        variable_layout = variable_layout_dict["variable_layout"]
 
-        composite_variable_layout = top_layout + variable_layout + bottom_layout
+def read_layout_file(layout_file: str) -> dict:
+    """
+    Read a layout, either a layout spec or a layout pickle file.
+    :param layout_file: Path to the .layout.yaml, .layout.json or .pickle file
+    :return: Dict with at least the "number_of_images", "event_descriptor_dict", "page_indicies" and "gate_name" of the
+    layout
+    """
+    if is_layout_spec(layout_file):
+        return load_layout_spec(layout_file)
+    return read_layout_pickle(layout_file)
+
+
+def convert_layout_pickle(layout_pickle_file: str, out_file: str = None) -> dict:
+    """
+    Convert a layout pickle file to a layout spec. The correction buttons are taken from the rows of the pickled
+    variable layout, the custom buttons from the row of 'Custom N' buttons, and the descriptors from the pickled
+    event_descriptor_dict. The spec is validated before it is written.
+
+    :param layout_pickle_file: Path to the pickle file
+    :param out_file: Path of the spec to write, .layout.yaml or .layout.json. Default is the pickle's path with
+    .layout.yaml instead of .pickle
+    :return: The spec
+    """
+    variable_layout_dict = read_layout_pickle(layout_pickle_file)
+    event_descriptor_dict = variable_layout_dict["event_descriptor_dict"]
+
+    button_rows = []
+    custom_buttons = []
+    for row in variable_layout_dict["variable_layout"]:
+        spec_row = []
+        for element in row:
+            if not isinstance(element, sg.Button):
+                continue  # The corrections text and the custom inputs are part of every layout
+            label = element.ButtonText
+            event = element.Key if element.Key is not None else label
+            if event not in event_descriptor_dict:
+                raise ValueError(f"{layout_pickle_file}: button '{event}' has no descriptor")
+            button = {"label": label, "descriptor": event_descriptor_dict[event]}
+            if event != label:
+                button["key"] = event
+            default_size = DEFAULT_CUSTOM_BUTTON_SIZE if event.startswith("Custom") else DEFAULT_BUTTON_SIZE
+            if element.Size is not None and tuple(element.Size) not in ((None, None), default_size):
+                button["size"] = list(element.Size)
+            if event.startswith("Custom"):
+                custom_buttons.append(button)
+            else:
+                spec_row.append(button)
+        if spec_row:
+            button_rows.append(spec_row)
+
+    page_indicies = variable_layout_dict["page_indicies"]
+    spec = {"gate_name": variable_layout_dict["gate_name"],
+            "number_of_images": variable_layout_dict["number_of_images"],
+            "page_indicies": page_indicies if isinstance(page_indicies, int) else list(page_indicies),
+            "button_rows": button_rows,
+            "custom_buttons": custom_buttons}
+    validate_layout_spec(spec)
+
+    if out_file is None:
+        out_file = os.path.splitext(layout_pickle_file)[0] + ".layout.yaml"
+    with open(out_file, "w") as f:
+        if out_file.lower().endswith(".json"):
+            json.dump(spec, f, indent=2)
+            f.write("\n")
+        else:
+            yaml.safe_dump(spec, f, sort_keys=False, allow_unicode=True)
+    sys.stderr.write(f"Layout spec written to {out_file}\n")
+    return spec
 
-        number_of_images = variable_layout_dict["number_of_images"]
-        event_descriptor_dict = variable_layout_dict["event_descriptor_dict"]
 
-        # page_no can be a tuple or a integer depending on 1 or 2+ number_of_images
-        page_no = variable_layout_dict["page_indicies"]
+def find_layout_file(directory: str):
+    """
+    :param directory: Directory to look in
+    :return: The layout file of the directory: its only layout spec, or its only .pickle file if it has no spec. None
+    if there is no such file.
+    """
+    files = sorted(os.listdir(directory))
+    spec_files = [file for file in files if is_layout_spec(file)]
+    pickle_files = [file for file in files if file.endswith(".pickle")]
+    if len(spec_files) == 1:
+        return os.path.join(directory, spec_files[0])
+    if not spec_files and len(pickle_files) == 1:
+        return os.path.join(directory, pickle_files[0])
+    return None
 
-        gate_name = variable_layout_dict["gate_name"]
 
-        if number_of_images == 1:
-            sys.stderr.write("1 image layout selected\n")
-            image_viewer_layout = iv_column_1_image
-        elif number_of_images == 2:
-            sys.stderr.write("2 image layout selected\n")
-            image_viewer_layout = iv_column_2_images
-        elif number_of_images == 3:
-            sys.stderr.write("3 image layout selected\n")
-            image_viewer_layout = iv_column_3_images
+def layout_selector(images_dir=None):
+    """
+    GUI interface to select the layout. (With an image preview of the various layouts ?)
+    The variable parts of the layouts are stored as layout specs (or as pickle files, made by the older template
+    scripts), which are added to the fixed parts of the layout by the compositor. If a images_dir is given, the
+    function will try to find a layout file in the parent directory. Otherwise, the user will need to select the layout
+    file manually.
+    :param images_dir: The directory where the images are. The expectation is that the layout file is in the parent
+    dir. If a single layout spec (or, without specs, a single .pickle file) is found in the parent dir, it is
+    automatically selected. Otherwise the user will need select the layout file (from any directory).
+    :return: layout, event_descriptor_dict, page_no, gate_name, category_table
+    """
+    file_types = (("Layout files", " ".join("*" + suffix for suffix in LAYOUT_SPEC_SUFFIXES) + " *.pickle"),)
+    # Check if there is a layout file in the parent directory
+    if images_dir is not None:
+        potential_layout_dir = os.path.dirname(images_dir)  # parent directory
+        layout_file = find_layout_file(potential_layout_dir)
+        if layout_file is not None:  # If there is a single layout file in parent dir, choose that one
+            sg.popup(f"Automatically detected layout file: '{os.path.basename(layout_file)}'.\nIf that is the right "
+                     f"file, you don't need to select a layout file manually. Press OK to continue :)",
+                     title="Found layout file!")
         else:
-            raise ValueError('Corrupted layout, number of images in the image viewer columns must be 1, 2 or 3')
+            # Select layout file
+            layout_file = sg.popup_get_file(message="Please select the layout file:",
+                                            title="Select layout file",
+                                            default_path=potential_layout_dir,
+                                            file_types=file_types)
+    else:
+        # Select layout file when no path is given
+        layout_file = sg.popup_get_file(message="Please select the layout file:",
+                                        title="Select layout file",
+                                        file_types=file_types)
+    if not layout_file:
+        raise ValueError("No layout file selected")
+
+    if is_layout_spec(layout_file):
+        spec = load_layout_spec(layout_file)
+        variable_layout = compile_layout_spec(spec)
+        category_table = spec["category_table"]
+    else:
+        logger.warning("Pickled layouts are deprecated, convert it with: AGClassifier.py convert-layout %s",
+                       layout_file)
+        spec = read_layout_pickle(layout_file)
+        variable_layout = spec["variable_layout"]
+        category_table = build_category_table(spec["event_descriptor_dict"])
+
+    composite_variable_layout = top_layout() + variable_layout + bottom_layout()
+
+    number_of_images = spec["number_of_images"]
+    event_descriptor_dict = spec["event_descriptor_dict"]
+
+    # page_no can be a tuple or a integer depending on 1 or 2+ number_of_images
+    page_no = spec["page_indicies"]
+
+    gate_name = spec["gate_name"]
+
+    sys.stderr.write(f"{number_of_images} image layout selected\n")
+    image_viewer_layout = image_viewer_column(number_of_images)
 
     layout = layout_compositor(composite_variable_layout, image_viewer_layout)
 
-    return layout, event_descriptor_dict, page_no, gate_name
+    return layout, event_descriptor_dict, page_no, gate_name, category_table
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Logger of the whole program. Debug output (events, rendered pages, ...) is only shown with --log-level DEBUG
+logger = logging.getLogger("AGClassifier")
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with fixed, roughly logarithmic buckets in milliseconds, plus the count, sum and maximum.
+    """
+
+    BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)  # The last bucket has everything above the last bound
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, latency_ms: float) -> None:
+        bucket = 0
+        while bucket < len(self.BOUNDS_MS) and latency_ms > self.BOUNDS_MS[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: Percentile, between 0 and 100
+        :return: Upper bound of the bucket the percentile falls in, at most the maximum latency
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count > 0:
+                return min(self.BOUNDS_MS[bucket], self.max_ms) if bucket < len(self.BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        bucket_names = ["<=" + str(bound) for bound in self.BOUNDS_MS] + [">" + str(self.BOUNDS_MS[-1])]
+        return {"count": self.count,
+                "mean_ms": self.total_ms / self.count if self.count else 0.0,
+                "p50_ms": self.percentile(50),
+                "p95_ms": self.percentile(95),
+                "max_ms": self.max_ms,
+                "buckets_ms": {name: count for name, count in zip(bucket_names, self.counts) if count}}
+
+
+class SessionMetrics:
+    """
+    Latency histograms of a GUI session: one per event type ("DONE, next image", "Previous image", ...) for the whole
+    handling of the event, and one per stage (render, encode, yaml read/write, window refresh), both overall and per
+    event type. Stages timed outside the GUI thread, e.g. by the prefetcher, are counted under the "background" event.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = {}  # event type -> LatencyHistogram
+        self.stages = {}  # stage -> LatencyHistogram
+        self.event_stages = {}  # event type -> stage -> LatencyHistogram
+        self.current_event = None
+        self.event_count = 0  # Number of GUI events so far, used to select the events to profile
+        self._event_start = None
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def record_stage(self, stage: str, latency_ms: float) -> None:
+        if threading.current_thread() is threading.main_thread():
+            event = self.current_event if self.current_event is not None else "idle"
+        else:
+            event = "background"
+        with self._lock:
+            self.stages.setdefault(stage, LatencyHistogram()).add(latency_ms)
+            self.event_stages.setdefault(event, {}).setdefault(stage, LatencyHistogram()).add(latency_ms)
+
+    def begin_event(self, event) -> None:
+        """
+        Start timing the handling of a GUI event. An event still being timed is ended first.
+        """
+        self.end_event()
+        self.event_count += 1
+        if session_profiler is not None:
+            session_profiler.on_event(self.event_count)
+        self.current_event = "WIN_CLOSED" if event is None else str(event)
+        self._event_start = time.perf_counter()
+
+    def end_event(self) -> None:
+        """
+        Stop timing the current GUI event, if any, and add it to the histogram of its type.
+        """
+        if self.current_event is None:
+            return
+        latency_ms = (time.perf_counter() - self._event_start) * 1000
+        with self._lock:
+            self.events.setdefault(self.current_event, LatencyHistogram()).add(latency_ms)
+        self.current_event = None
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"started": self.started,
+                    "ended": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "events": {event: histogram.to_dict() for event, histogram in self.events.items()},
+                    "stages": {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                    "event_stages": {event: {stage: histogram.to_dict() for stage, histogram in stages.items()}
+                                     for event, stages in self.event_stages.items()}}
+
+
+class SessionProfiler:
+    """
+    cProfile of an annotation session, either the whole session or a window of GUI events (numbered from 1 in the
+    order they are handled). At exit, the profile is dumped next to correction.yaml together with a text summary of the
+    top functions of AGClassifier_utilities and AGClassifier_event_manager.
+    """
+
+    # Modules the text summary is restricted to
+    SUMMARY_MODULES = r"AGClassifier_(utilities|event_manager)"
+
+    def __init__(self, first_event: int = None, last_event: int = None):
+        """
+        :param first_event: First event to profile. None profiles from the start of the session.
+        :param last_event: Last event to profile. None profiles until the end of the session.
+        """
+        self.first_event = first_event
+        self.last_event = last_event
+        self.output_folder = None  # Set once the output folder is known; the current directory until then
+        self._profile = cProfile.Profile()
+        self._enabled = False
+        self._used = False
+
+    def _enable(self) -> None:
+        if not self._enabled:
+            self._profile.enable()
+            self._enabled = self._used = True
+
+    def _disable(self) -> None:
+        if self._enabled:
+            self._profile.disable()
+            self._enabled = False
+
+    def start(self) -> None:
+        """
+        Start profiling, if the whole session is profiled.
+        """
+        if self.first_event is None:
+            self._enable()
+
+    def on_event(self, event_number: int) -> None:
+        """
+        Turn profiling on or off before handling GUI event number 'event_number'.
+        """
+        if self.last_event is not None and event_number > self.last_event:
+            self._disable()
+        elif self.first_event is not None and event_number >= self.first_event:
+            self._enable()
+
+    def write(self) -> None:
+        """
+        Stop profiling and write profile_<date>-<time>.prof (for pstats, snakeviz, ...) and a .txt summary.
+        """
+        self._disable()
+        if not self._used:
+            logger.warning("No events were profiled, the session ended before event %s", self.first_event)
+            return
+        prefix = os.path.join(self.output_folder or os.getcwd(), "profile_" + time.strftime("%Y%m%d-%H%M%S"))
+        self._profile.dump_stats(prefix + ".prof")
+
+        summary = io.StringIO()
+        if self.first_event is None and self.last_event is None:
+            summary.write("Profile of the whole session\n")
+        else:
+            summary.write(f"Profile of events {self.first_event or 1} to {self.last_event or 'the end'}\n")
+        stats = pstats.Stats(self._profile, stream=summary)
+        stats.strip_dirs()
+        for sort_key, title in (("cumulative", "cumulative time"), ("tottime", "time spent in the function itself")):
+            summary.write(f"\nTop functions by {title}\n")
+            stats.sort_stats(sort_key).print_stats(self.SUMMARY_MODULES, 30)
+        with open(prefix + ".txt", "w") as out_file:
+            out_file.write(summary.getvalue())
+        logger.warning("Profile written to %s.prof and %s.txt", prefix, prefix)
+
+
+def parse_profile_events(spec: str) -> tuple:
+    """
+    Parse the events to profile, as given to --profile or in the AGCLASSIFIER_PROFILE environment variable.
+
+    :param spec: "all" (or "1") for the whole session, "FIRST:LAST" for a window of events; either side may be empty
+    :return: (first_event, last_event), None meaning open-ended
+    """
+    if spec.lower() in ("all", "1", "true", "yes"):
+        return None, None
+    first, separator, last = spec.partition(":")
+    if not separator:
+        raise ValueError("Expected 'all' or FIRST:LAST, found: " + spec)
+    first_event = int(first) if first else None
+    last_event = int(last) if last else None
+    if first_event is not None and last_event is not None and last_event < first_event:
+        raise ValueError("The last event to profile comes before the first one: " + spec)
+    return first_event, last_event
+
+
+# Metrics of this session
+metrics = SessionMetrics()
+
+# Profiler of this session, None when not profiling
+global session_profiler
+session_profiler = None
+
+# File the metrics are written to at exit, None to not write them. Set by AGClassifier once the output folder is known
+global metrics_file
+metrics_file = None
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Time the enclosed block as a stage of the current event.
+
+    :param stage: Name of the stage, e.g. "render"
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_stage(stage, (time.perf_counter() - start) * 1000)
+
+
+def set_metrics_file(path) -> None:
+    """
+    Set the file the session metrics are written to at exit.
+
+    :param path: Path of the JSON file, or None to not write the metrics
+    :return: None
+    """
+
+    global metrics_file
+    metrics_file = path
+
+
+def set_session_profiler(profiler) -> None:
+    """
+    Set the profiler of the session and start it. It is written at exit.
+
+    :param profiler: SessionProfiler, or None to not profile
+    :return: None
+    """
+
+    global session_profiler
+    session_profiler = profiler
+    if profiler is not None:
+        profiler.start()
+
+
+def write_profile() -> None:
+    """
+    Write the session profile, if profiling. Called on exit.
+
+    :return: None
+    """
+
+    if session_profiler is not None:
+        session_profiler.write()
+
+
+def write_metrics() -> None:
+    """
+    Write the session metrics to the metrics file, if one is set and anything was measured. Called on exit.
+
+    :return: None
+    """
+
+    metrics.end_event()
+    if metrics_file is None or not (metrics.events or metrics.stages):
+        return
+    with open(metrics_file, "w") as out_file:
+        json.dump(metrics.to_dict(), out_file, indent=2)
+    logger.info("Session metrics written to %s", metrics_file)
+
+
+atexit.register(write_metrics)
+atexit.register(write_profile)  # Runs first, so the other exit handlers are not profiled
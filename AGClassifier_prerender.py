@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from AGClassifier_layouts import read_layout_file
+from AGClassifier_utilities import get_image_size, get_page, page_archive_key, validate_page_no, PageArchive, \
+    SampleCatalog, fitz
+
+# Name of the folder, inside the output folder, where the page archive is stored
+RENDER_CACHE_FOLDER = "render_cache"
+
+
+def get_render_cache_dir(input_folder: str) -> str:
+    """
+    Path of the page archive folder of an input folder.
+
+    :param input_folder: The input folder where the PDF files are located.
+    :return: Path of the cache folder
+    """
+
+    return os.path.join(input_folder, "output", RENDER_CACHE_FOLDER)
+
+
+# Page archive of each worker process, by folder, opened by the worker's first sample
+_worker_archives = {}
+
+
+def prerender_sample(filename: str, page_no, cache_dir: str, image_format: str) -> tuple:
+    """
+    Render the pages of a sample that are not in the page archive yet, at the size used in the main window. Runs in a
+    worker process, which is the only one hashing the PDF for the archive keys; the pages are sent back to the main
+    process, which is the only one writing to the page archive.
+
+    :param filename: path of the sample PDF
+    :param page_no: page number(s) from the layout
+    :param cache_dir: Folder of the page archive
+    :param image_format: format of the image data, the one the GUI will use
+    :return: (number of pages already in the archive, list of (page archive key, image data))
+    """
+
+    archive = _worker_archives.get(cache_dir)
+    if archive is None:
+        archive = _worker_archives[cache_dir] = PageArchive(cache_dir)
+    width, height = get_image_size(page_no)
+    pages = [page_no] if isinstance(page_no, int) else list(page_no)
+    keys = [(pno, page_archive_key(filename, pno, width, height, image_format)) for pno in pages]
+    missing = [(pno, key) for pno, key in keys if key not in archive]
+    rendered = []
+    if missing:
+        doc = fitz.open(filename)
+        dlist_tab = [None] * len(doc)
+        for pno, key in missing:
+            pixmap = get_page(pno, dlist_tab, doc, width=width, height=height)
+            rendered.append((key, pixmap.tobytes(image_format)))
+        doc.close()
+    return len(keys) - len(missing), rendered
+
+
+def prerender(input_folder: str, layout_file: str, workers: int = None, image_format: str = "ppm",
+              recursive: bool = False) -> None:
+    """
+    Render the layout's pages of every PDF in the input folder, on all cores, into the page archive that the GUI reads
+    at startup. Pages that are already in the archive are skipped, so an interrupted run can simply be started again.
+
+    :param input_folder: The input folder where the PDF files are located.
+    :param layout_file: Layout file of the gate (layout spec or pickle), for its page_indicies.
+    :param workers: Number of worker processes. Default is the number of cores.
+    :param image_format: format of the image data, must be the image transfer format the GUI is started with.
+    :param recursive: If True, PDFs in subfolders of the input folder are included too.
+    :return: None
+    """
+
+    page_no = read_layout_file(layout_file)["page_indicies"]
+    validate_page_no(page_no)
+    file_list = SampleCatalog(input_folder, recursive=recursive)
+    if len(file_list) == 0:
+        raise ValueError("No pdf files found in input folder")
+
+    cache_dir = get_render_cache_dir(input_folder)
+    archive = PageArchive(cache_dir)
+
+    # Resume: the workers skip the pages that are already in the archive
+    rendered_pages = skipped_pages = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(prerender_sample, filename, page_no, cache_dir, image_format)
+                   for filename in file_list]
+        for i, future in enumerate(as_completed(futures)):
+            skipped, rendered = future.result()
+            if rendered:
+                archive.put_many(rendered)
+            rendered_pages += len(rendered)
+            skipped_pages += skipped
+            if (i + 1) % 100 == 0 or i + 1 == len(futures):
+                elapsed = time.perf_counter() - start
+                sys.stderr.write(f"{i + 1}/{len(futures)} samples, {rendered_pages} pages rendered, {skipped_pages} "
+                                 f"already prerendered, {rendered_pages / elapsed:.1f} pages/s\n")
+    archive.close()
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(f"Prerendered {rendered_pages} pages in {elapsed:.1f} s ({rendered_pages / elapsed:.1f} pages/s)"
+                     f" into {cache_dir}, {skipped_pages} pages were already there\n")
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Report over the correction files of many AGClassifier runs: per-gate and per-descriptor counts, the discard rate of
+each run and of the whole batch, and a merged table of every sample's corrections.
+
+The folders given are searched for output/correction.yaml files, which are parsed in parallel, as a stream of YAML
+events (with the libyaml C parser when PyYAML has it), so no file is ever loaded as a whole.
+
+Usage:
+    python AGClassifier_report.py <folder> [<folder> ...] --output batch_report --format csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from AGClassifier_utilities import yaml_loader
+
+CORRECTION_FILE = "correction.yaml"
+REPORT_FORMATS = ("csv", "json")
+
+
+def find_correction_files(folders: list) -> list:
+    """
+    :param folders: Folders to search, recursively
+    :return: Sorted list of the paths of the correction files in the folders
+    """
+
+    paths = set()
+    for folder in folders:
+        if os.path.isfile(folder):
+            paths.add(os.path.abspath(folder))
+            continue
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames[:] = [name for name in dirnames if name != "render_cache"]
+            if CORRECTION_FILE in filenames:
+                paths.add(os.path.abspath(os.path.join(dirpath, CORRECTION_FILE)))
+    return sorted(paths)
+
+
+def iter_corrections(path: str):
+    """
+    Stream the entries of a correction file, without loading it.
+
+    :param path: Path of a correction yaml file, gate -> descriptor -> list of sample IDs
+    :return: Generator of (gate, descriptor, sample_id)
+    """
+
+    import yaml
+    with open(path, "rb") as in_file:
+        events = yaml.parse(in_file, Loader=yaml_loader())
+        for event in events:
+            if isinstance(event, yaml.MappingStartEvent):
+                break
+        else:
+            return  # Empty file
+        for gate_event in events:
+            if isinstance(gate_event, yaml.MappingEndEvent):
+                return
+            if not isinstance(next(events), yaml.MappingStartEvent):
+                continue  # Gate without descriptors
+            for descriptor_event in events:
+                if isinstance(descriptor_event, yaml.MappingEndEvent):
+                    break
+                if not isinstance(next(events), yaml.SequenceStartEvent):
+                    continue  # Descriptor without samples
+                for sample_event in events:
+                    if isinstance(sample_event, yaml.SequenceEndEvent):
+                        break
+                    yield gate_event.value, descriptor_event.value, sample_event.value
+
+
+def count_pdfs(folder: str):
+    """
+    :return: Number of PDF files in the folder, or None if it does not exist
+    """
+    try:
+        with os.scandir(folder) as entries:
+            return sum(1 for entry in entries if entry.name.endswith(".pdf"))
+    except FileNotFoundError:
+        return None
+
+
+def summarize_run(path: str, report_format: str = "csv") -> dict:
+    """
+    Aggregate one correction file. Runs in a worker process. The rows of the merged sample table are formatted here
+    too, so that the main process only has to append them to the file.
+
+    :param path: Path of the correction yaml file
+    :param report_format: One of REPORT_FORMATS, the format of the sample rows
+    :return: Dict with the run's counts, discard rate and sample rows
+    """
+
+    descriptor_counts = {}  # (gate, descriptor) -> number of samples
+    gate_samples = {}  # gate -> set of samples, excluding DISCARD
+    sample_corrections = {}  # sample ID -> list of (gate, descriptor)
+    discarded = set()
+    entries = 0
+    for gate, descriptor, sample_id in iter_corrections(path):
+        entries += 1
+        key = (gate, descriptor)
+        descriptor_counts[key] = descriptor_counts.get(key, 0) + 1
+        if gate == "DISCARD":
+            discarded.add(sample_id)
+        else:
+            gate_samples.setdefault(gate, set()).add(sample_id)
+            sample_corrections.setdefault(sample_id, []).append(key)
+    for sample_id in discarded:
+        sample_corrections.setdefault(sample_id, [])
+
+    # Samples approved without corrections are not in the file, so count the PDFs of the run when they are there
+    output_folder = os.path.dirname(path)
+    samples = count_pdfs(os.path.dirname(output_folder))
+    samples_source = "pdfs"
+    if not samples:
+        samples, samples_source = len(sample_corrections), "corrections"
+    run = os.path.dirname(output_folder) if os.path.basename(output_folder) == "output" else output_folder
+
+    sample_rows = io.StringIO()
+    if report_format == "csv":
+        writer = csv.writer(sample_rows)
+        for sample_id in sorted(sample_corrections):
+            writer.writerow([run, sample_id, int(sample_id in discarded),
+                             format_corrections(sample_corrections[sample_id])])
+    else:
+        for sample_id in sorted(sample_corrections):
+            sample_rows.write(json.dumps({"run": run, "sample_id": sample_id, "discarded": sample_id in discarded,
+                                          "corrections": sample_corrections[sample_id]}) + "\n")
+    return {"run": run,
+            "path": path,
+            "entries": entries,
+            "samples": samples,
+            "samples_source": samples_source,
+            "discarded": len(discarded),
+            "discard_rate": len(discarded) / samples if samples else 0.0,
+            "gate_counts": {gate: len(sample_ids) for gate, sample_ids in gate_samples.items()},
+            "descriptor_counts": [[gate, descriptor, count] for (gate, descriptor), count in descriptor_counts.items()],
+            "sample_rows": sample_rows.getvalue()}
+
+
+def format_corrections(corrections: list) -> str:
+    """
+    :param corrections: List of (gate, descriptor)
+    :return: "gate: descriptor, descriptor; gate: descriptor"
+    """
+    by_gate = {}
+    for gate, descriptor in corrections:
+        by_gate.setdefault(gate, []).append(descriptor)
+    return "; ".join(gate + ": " + ", ".join(sorted(by_gate[gate])) for gate in sorted(by_gate))
+
+
+class ReportWriter:
+    """
+    Writes the report tables as the runs come in, so the merged sample table is never held in memory:
+    <prefix>_runs, <prefix>_counts and <prefix>_samples, as CSV files or as JSON (JSON Lines for the samples).
+    """
+
+    def __init__(self, prefix: str, report_format: str = "csv"):
+        if report_format not in REPORT_FORMATS:
+            raise ValueError("Unknown report format: " + str(report_format))
+        self.prefix = prefix
+        self.report_format = report_format
+        self.runs = []
+        self.gate_counts = {}
+        self.descriptor_counts = {}
+        if report_format == "csv":
+            self._samples_file = open(prefix + "_samples.csv", "w", newline="")
+            csv.writer(self._samples_file).writerow(["run", "sample_id", "discarded", "corrections"])
+        else:
+            self._samples_file = open(prefix + "_samples.jsonl", "w")
+
+    def add_run(self, summary: dict) -> None:
+        for gate, count in summary["gate_counts"].items():
+            self.gate_counts[gate] = self.gate_counts.get(gate, 0) + count
+        for gate, descriptor, count in summary["descriptor_counts"]:
+            self.descriptor_counts[(gate, descriptor)] = self.descriptor_counts.get((gate, descriptor), 0) + count
+        self._samples_file.write(summary["sample_rows"])
+        self.runs.append({key: summary[key] for key in ("run", "path", "entries", "samples", "samples_source",
+                                                        "discarded", "discard_rate")})
+
+    def totals(self) -> dict:
+        samples = sum(run["samples"] for run in self.runs)
+        discarded = sum(run["discarded"] for run in self.runs)
+        return {"runs": len(self.runs),
+                "entries": sum(run["entries"] for run in self.runs),
+                "samples": samples,
+                "discarded": discarded,
+                "discard_rate": discarded / samples if samples else 0.0}
+
+    def close(self) -> None:
+        self._samples_file.close()
+        descriptor_rows = [[gate, descriptor, count]
+                           for (gate, descriptor), count in sorted(self.descriptor_counts.items())]
+        if self.report_format == "csv":
+            with open(self.prefix + "_runs.csv", "w", newline="") as out_file:
+                writer = csv.DictWriter(out_file, fieldnames=list(self.runs[0]) if self.runs else ["run"])
+                writer.writeheader()
+                writer.writerows(self.runs)
+            with open(self.prefix + "_counts.csv", "w", newline="") as out_file:
+                writer = csv.writer(out_file)
+                writer.writerow(["gate", "descriptor", "samples"])
+                for gate in sorted(self.gate_counts):
+                    writer.writerow([gate, "", self.gate_counts[gate]])
+                writer.writerows(descriptor_rows)
+        else:
+            with open(self.prefix + "_runs.json", "w") as out_file:
+                json.dump({"totals": self.totals(), "runs": self.runs}, out_file, indent=2)
+            with open(self.prefix + "_counts.json", "w") as out_file:
+                json.dump({"gates": dict(sorted(self.gate_counts.items())),
+                           "descriptors": [{"gate": gate, "descriptor": descriptor, "samples": count}
+                                           for gate, descriptor, count in descriptor_rows]}, out_file, indent=2)
+
+
+def report(folders: list, prefix: str, report_format: str = "csv", workers: int = None) -> dict:
+    """
+    Aggregate the correction files found in the folders and write the report tables.
+
+    :param folders: Folders to search for output/correction.yaml files
+    :param prefix: Path prefix of the report files
+    :param report_format: One of REPORT_FORMATS
+    :param workers: Number of worker processes. Default is the number of cores.
+    :return: Totals over all runs
+    """
+
+    start = time.perf_counter()
+    paths = find_correction_files(folders)
+    if not paths:
+        raise ValueError("No " + CORRECTION_FILE + " files found")
+    writer = ReportWriter(prefix, report_format)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for summary in executor.map(summarize_run, paths, [report_format] * len(paths),
+                                    chunksize=max(1, len(paths) // 64)):
+            writer.add_run(summary)
+    writer.close()
+    totals = writer.totals()
+    sys.stderr.write(f"{totals['runs']} runs, {totals['entries']} entries, {totals['samples']} samples, "
+                     f"{totals['discarded']} discarded ({totals['discard_rate']:.1%}) in "
+                     f"{time.perf_counter() - start:.1f} s. Report written to {prefix}_*\n")
+    return totals
+
+
+def add_report_arguments(parser) -> None:
+    """
+    Add the arguments of the report tool to an argparse parser.
+    """
+    parser.add_argument("folders", nargs="+", help="Folders to search for output/correction.yaml files")
+    parser.add_argument("--output", default="correction_report", help="Path prefix of the report files")
+    parser.add_argument("--format", choices=REPORT_FORMATS, default="csv", dest="report_format",
+                        help="csv, or json (JSON Lines for the sample table)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes, default is the number of cores")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report over the correction files of many AGClassifier runs")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    report(args.folders, args.output, report_format=args.report_format, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
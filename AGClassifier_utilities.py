@@ -1,28 +1,727 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import fitz
+import atexit
+import bisect
+import getpass
+import hashlib
+import importlib.util
+import json
+import mmap
+import multiprocessing
 import os
+import re
+import socket
+import sqlite3
+import struct
 import sys
-import yaml
+import threading
+import time
 import PySimpleGUI as sg
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor, Future, InvalidStateError, \
+    as_completed
+from contextlib import contextmanager
+from glob import glob, escape as glob_escape
+from multiprocessing import shared_memory
+
+from AGClassifier_metrics import logger, metrics, timed
+
+
+def lazy_import(name: str):
+    """
+    Import a module on first use instead of now: the module is only executed when one of its attributes is accessed.
+    Used for the heavy imports (fitz, yaml), so the main window is shown without waiting for them.
+
+    :param name: Name of the module
+    :return: The module
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named " + repr(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+fitz = lazy_import("fitz")
+yaml = lazy_import("yaml")
+
+
+def ensure_fitz_loaded() -> None:
+    """
+    Execute the deferred import of fitz now, on the calling thread, instead of on its first use.
+
+    :return: None
+    """
+    getattr(fitz, "__name__")  # Any attribute access executes a module imported with lazy_import
+
+
+def yaml_loader():
+    """
+    :return: Fastest available yaml loader: the libyaml bindings, if PyYAML was built with them
+    """
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 # Global variable correction_yaml_file, gets set by AGClassifier on selecting output folder
 # All functions that need this filepath/global variable are in AGClassifier_utilities.py
 global correction_yaml_file
 correction_yaml_file = "correction.yaml"
 
+# In-memory view of correction_yaml_file, created by set_correction_yaml_global (or lazily on first use)
+global correction_store
+correction_store = None
+
+
+class CorrectionStoreBase:
+    """
+    Interface of the correction storage backends: the rest of the program only uses these methods, through
+    get_correction_store(). 'path' is the correction yaml file the backend reads from or exports to.
+    """
+
+    path = None
+
+    def sample_gates(self, sample_name: str) -> dict:
+        """
+        :return: Dict gate -> set of descriptors of every gate the sample appears in.
+        """
+        raise NotImplementedError
+
+    def contains(self, sample_name: str, gate_name: str) -> bool:
+        """
+        :return: True if the sample appears under any descriptor of the gate, False otherwise.
+        """
+        return gate_name in self.sample_gates(sample_name)
+
+    def is_discarded(self, sample_name: str) -> bool:
+        """
+        :return: True if the sample is listed under DISCARD, False otherwise.
+        """
+        return "DISCARD" in self.sample_gates(sample_name).get("DISCARD", ())
+
+    def summary_string(self, sample_name: str) -> str:
+        """
+        Text shown in the "-INDEX-" element: the discard status and one line per gate the sample appears in.
+
+        :param sample_name: Name of the sample.
+        :return: String with one descriptor line per gate.
+        """
+
+        descriptors = ""
+        if self.is_discarded(sample_name):
+            descriptors += "Discard\n"
+        sample_gates = self.sample_gates(sample_name)
+        for gate_name in sorted(sample_gates):
+            descriptors += gate_name + ": " + ", ".join(sorted(sample_gates[gate_name])) + "\n"
+        return descriptors
+
+    def add(self, gate_name: str, descriptors: list, sample_id: str) -> None:
+        """
+        Add the sample under each of the descriptors of the gate. Entries on each descriptor are unique.
+        """
+        raise NotImplementedError
+
+    def remove(self, sample_name: str, gate_name: str) -> None:
+        """
+        Remove all appearances of the sample at the gate. Descriptors left without samples are kept.
+        """
+        raise NotImplementedError
+
+    def add_many(self, gate_name: str, descriptors: list, sample_ids: list) -> None:
+        """
+        Add each of the samples under each of the descriptors of the gate, in one write.
+        """
+        for sample_id in sample_ids:
+            self.add(gate_name, descriptors, sample_id)
+
+    def remove_many(self, sample_names: list, gate_name: str) -> None:
+        """
+        Remove all appearances of each of the samples at the gate, in one write.
+        """
+        for sample_name in sample_names:
+            self.remove(sample_name, gate_name)
+
+    def replace_many(self, gate_name: str, descriptors: list, sample_ids: list) -> None:
+        """
+        Replace the corrections of each of the samples at the gate with the descriptors, in one write.
+        """
+        self.remove_many(sample_ids, gate_name)
+        self.add_many(gate_name, descriptors, sample_ids)
+
+    def to_dict(self) -> dict:
+        """
+        :return: The store in the correction yaml layout, gate -> descriptor -> sorted list of sample IDs.
+        """
+        raise NotImplementedError
+
+    def refresh(self) -> bool:
+        """
+        Pick up corrections saved by other sessions.
+
+        :return: True if anything changed
+        """
+        raise NotImplementedError
+
+    def compact(self) -> None:
+        """
+        Bring the correction yaml file up to date with the store.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Write everything to disk and release the store's files.
+        """
+        raise NotImplementedError
+
+
+class CorrectionStore(CorrectionStoreBase):
+    """
+    Default storage backend, an in-memory copy of the correction yaml file. The file is parsed once and kept as two
+    indexes: gate -> descriptor -> set of sample IDs (the layout of the yaml file) and the reverse
+    sample ID -> gate -> set of descriptors, so that lookups for a single sample do not depend on the size of the file.
+
+    Changes are not written to the yaml file straight away. Each add/remove is appended as one line to this session's
+    own journal next to the yaml file (correction.journal.<host>-<pid>.jsonl) and fsync'd. The journal is compacted
+    into the yaml file every 'compact_every' operations, when the store is closed (on exit) or on demand with
+    compact(). Descriptor lists are sorted when the store is written back to disk.
+
+    Several sessions, on the same or different machines, can work on the same folder. Compaction takes a lock on
+    correction.lock, re-reads the yaml file if another session changed it, applies this session's journal on top, and
+    writes the result to a temporary file that is renamed over the yaml file. The lock is only held for that read and
+    write, and reading never takes it. Each session holds a lock on its journal while it runs, so a journal that can be
+    locked by someone else belongs to a session that crashed: it is merged into the yaml file by the next session that
+    loads the folder.
+    """
+
+    def __init__(self, path: str, compact_every: int = 200, session_id: str = None):
+        """
+        :param path: Path of the correction yaml file
+        :param compact_every: Number of operations after which the journal is compacted into the yaml file
+        :param session_id: Name of this session's journal, default is <host>-<pid>
+        """
+        self.path = path
+        self.session_id = session_id or socket.gethostname() + "-" + str(os.getpid())
+        self.journal_path = os.path.splitext(path)[0] + ".journal." + self.session_id + ".jsonl"
+        self.lock_path = os.path.splitext(path)[0] + ".lock"
+        self.compact_every = compact_every
+        self._gates = {}  # gate -> descriptor -> set of sample IDs
+        self._samples = {}  # sample ID -> gate -> set of descriptors
+        self._journal = None  # Open (and locked) handle of the journal, opened on the first write
+        self._ops = []  # Operations in the journal that are not in the yaml file yet
+        self._yaml_signature = None  # (mtime, size, inode) of the yaml file when it was last read
+        self.load()
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the lock shared by all sessions working on the yaml file.
+        """
+        with open(self.lock_path, "a+") as lock:
+            lock_file(lock)
+            try:
+                yield
+            finally:
+                unlock_file(lock)
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _read_yaml(self) -> None:
+        """
+        Replace the in-memory store with the contents of the yaml file. A missing or empty file gives an empty store.
+        """
+        self._gates = {}
+        self._samples = {}
+        self._yaml_signature = self._file_signature()
+        yaml_full_dict = None
+        if self._yaml_signature is not None:
+            with timed("yaml read"), open(self.path, "r") as in_file:
+                yaml_full_dict = yaml.load(in_file, Loader=yaml_loader())  # Dict of lists
+        for gate_name, gate_dict in (yaml_full_dict or {}).items():
+            self._gates.setdefault(gate_name, {})
+            for descriptor, sample_ids in (gate_dict or {}).items():
+                self._add_entries(gate_name, descriptor, sample_ids or [])
+
+    def load(self) -> None:
+        """
+        (Re)load the store from the yaml file and apply this session's operations that are not in it yet.
+        Journals left behind by sessions that crashed are merged into the yaml file first.
+
+        :return: None
+        """
+
+        with self._locked():
+            merged = self._recover_orphan_journals()
+        if not merged:
+            self._read_yaml()
+        for entry in self._ops:
+            self._apply(entry)
+
+    def refresh(self) -> bool:
+        """
+        Pick up corrections written to the yaml file by other sessions since it was last read. Does not lock.
+
+        :return: True if the yaml file had changed and was reloaded
+        """
+
+        if self._file_signature() == self._yaml_signature:
+            return False
+        self._read_yaml()
+        for entry in self._ops:
+            self._apply(entry)
+        return True
+
+    def _recover_orphan_journals(self) -> int:
+        """
+        Merge the journals of sessions that are not running anymore into the yaml file, and delete them.
+        Must be called with the lock held.
+
+        :return: Number of journals merged. If any, the store has been reloaded from the yaml file.
+        """
+
+        orphans = []
+        for journal_path in sorted(glob(glob_escape(os.path.splitext(self.path)[0]) + ".journal*.jsonl")):
+            if journal_path == self.journal_path and self._journal is not None:
+                continue
+            journal = open(journal_path, "a+")
+            if try_lock_file(journal):
+                orphans.append(journal)
+            else:  # The session is still running
+                journal.close()
+        if not orphans:
+            return 0
+
+        self._read_yaml()
+        if sum(self._replay_journal(journal.name) for journal in orphans) > 0:
+            self._write_yaml()
+        for journal in orphans:
+            unlock_file(journal)
+            journal.close()
+            os.remove(journal.name)
+        return len(orphans)
+
+    def _replay_journal(self, journal_path: str) -> int:
+        """
+        Apply the operations in a journal to the in-memory store. Replaying is idempotent, so a journal that was
+        already (partly) compacted into the yaml file gives the same result.
+
+        :return: Number of operations replayed
+        """
+
+        replayed = 0
+        with open(journal_path, "r") as in_file:
+            for line in in_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be incomplete, if the program was killed while writing it
+                    sys.stderr.write("WARNING: Ignoring incomplete line at the end of " + journal_path + "\n")
+                    break
+                self._apply(entry)
+                replayed += 1
+        return replayed
+
+    def _apply(self, entry: dict) -> None:
+        # Bulk operations list their samples under "samples", the others have a single "sample"
+        sample_ids = entry["samples"] if "samples" in entry else [entry["sample"]]
+        if entry["op"] == "replace":
+            self._apply({"op": "remove", "gate": entry["gate"], "samples": sample_ids})
+            self._apply({"op": "add", "gate": entry["gate"], "descriptors": entry["descriptors"],
+                         "samples": sample_ids})
+        elif entry["op"] == "add":
+            self._gates.setdefault(entry["gate"], {})
+            for descriptor in entry["descriptors"]:
+                self._add_entries(entry["gate"], descriptor, sample_ids)
+        elif entry["op"] == "remove":
+            for sample_id in sample_ids:
+                sample_gates = self._samples.get(sample_id, {})
+                for descriptor in sample_gates.pop(entry["gate"], ()):
+                    self._gates[entry["gate"]][descriptor].discard(sample_id)
+                if not sample_gates:
+                    self._samples.pop(sample_id, None)
+        else:
+            raise ValueError("Unknown operation in correction journal: " + str(entry["op"]))
+
+    def _record(self, entry: dict) -> None:
+        """
+        Apply an operation to the store and append it to the journal.
+        """
+
+        self._apply(entry)
+        with timed("journal write"):
+            if self._journal is None:
+                # Created under the shared lock, so no other session can take it for an orphan before it is locked
+                with self._locked():
+                    self._journal = open(self.journal_path, "a")
+                    lock_file(self._journal)
+            self._journal.write(json.dumps(entry) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        self._ops.append(entry)
+        if len(self._ops) >= self.compact_every:
+            self.compact()
+
+    def _add_entries(self, gate_name: str, descriptor: str, sample_ids) -> None:
+        descriptor_set = self._gates.setdefault(gate_name, {}).setdefault(descriptor, set())
+        for sample_id in sample_ids:
+            descriptor_set.add(sample_id)
+            self._samples.setdefault(sample_id, {}).setdefault(gate_name, set()).add(descriptor)
+
+    def sample_gates(self, sample_name: str) -> dict:
+        return self._samples.get(sample_name, {})
+
+    def add(self, gate_name: str, descriptors: list, sample_id: str) -> None:
+        """
+        Add the sample under each of the descriptors of the gate. Entries on each descriptor are unique.
+
+        :param gate_name: Name of the gate the corrections apply to.
+        :param descriptors: List of descriptors to be added/expanded upon.
+        :param sample_id: ID of the sample the corrections apply to.
+        :return: None
+        """
+
+        self._record({"op": "add", "gate": gate_name, "descriptors": list(descriptors), "sample": sample_id})
+
+    def remove(self, sample_name: str, gate_name: str) -> None:
+        """
+        Remove all appearances of the sample at the gate.
+        Descriptors left without samples are kept, as an empty list, in the same way as before.
+
+        :param sample_name: Name of the sample to be removed.
+        :param gate_name: Name of the gate the corrections apply to.
+        :return: None
+        """
+
+        self._record({"op": "remove", "gate": gate_name, "sample": sample_name})
+
+    def add_many(self, gate_name: str, descriptors: list, sample_ids: list) -> None:
+        """
+        Add each of the samples under each of the descriptors of the gate, as a single journal entry.
+
+        :param gate_name: Name of the gate the corrections apply to.
+        :param descriptors: List of descriptors to be added/expanded upon.
+        :param sample_ids: IDs of the samples the corrections apply to.
+        :return: None
+        """
+
+        self._record({"op": "add", "gate": gate_name, "descriptors": list(descriptors), "samples": list(sample_ids)})
+
+    def remove_many(self, sample_names: list, gate_name: str) -> None:
+        """
+        Remove all appearances of each of the samples at the gate, as a single journal entry.
+
+        :param sample_names: Names of the samples to be removed.
+        :param gate_name: Name of the gate the corrections apply to.
+        :return: None
+        """
+
+        self._record({"op": "remove", "gate": gate_name, "samples": list(sample_names)})
+
+    def replace_many(self, gate_name: str, descriptors: list, sample_ids: list) -> None:
+        """
+        Replace the corrections of each of the samples at the gate with the descriptors, as a single journal entry, so
+        that a crash never leaves the samples with their old corrections removed but the new ones not added.
+
+        :param gate_name: Name of the gate the corrections apply to.
+        :param descriptors: List of descriptors the samples get at the gate.
+        :param sample_ids: IDs of the samples the corrections apply to.
+        :return: None
+        """
+
+        self._record({"op": "replace", "gate": gate_name, "descriptors": list(descriptors),
+                      "samples": list(sample_ids)})
+
+    def to_dict(self) -> dict:
+        """
+        :return: The store in the correction yaml layout, gate -> descriptor -> sorted list of sample IDs.
+        """
+        return {gate_name: {descriptor: sorted(sample_ids) for descriptor, sample_ids in gate_dict.items()}
+                for gate_name, gate_dict in self._gates.items()}
+
+    def _write_yaml(self) -> None:
+        """
+        Write the full store to the yaml file. The yaml file is written to a temporary file and then renamed over the
+        old one, so a crash during the write never leaves a truncated correction file behind, and sessions reading the
+        file see either the old or the new version. Must be called with the lock held.
+        """
+        tmp_path = self.path + ".tmp"
+        with timed("yaml write"):
+            with open(tmp_path, "w") as out_file:
+                yaml.safe_dump(self.to_dict(), out_file)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.replace(tmp_path, self.path)
+        self._yaml_signature = self._file_signature()
+
+    def compact(self) -> None:
+        """
+        Merge this session's journal into the yaml file and empty the journal. If another session changed the yaml
+        file since it was read, its changes are read first, so they are kept, and are now in the store as well.
+
+        :return: None
+        """
+
+        with self._locked():
+            if self._file_signature() != self._yaml_signature:
+                self._read_yaml()
+                for entry in self._ops:
+                    self._apply(entry)
+            self._write_yaml()
+
+            # Everything in the journal is now in the yaml file
+            if self._journal is not None:
+                self._journal.seek(0)
+                self._journal.truncate()
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+        self._ops = []
+
+    def close(self) -> None:
+        """
+        Compact any pending operations into the yaml file, and close and delete the journal.
+
+        :return: None
+        """
+
+        if self._ops:
+            self.compact()
+        if self._journal is not None:
+            with self._locked():
+                unlock_file(self._journal)
+                self._journal.close()
+                self._journal = None
+                os.remove(self.journal_path)
+
+
+class SQLiteCorrectionStore(CorrectionStoreBase):
+    """
+    Storage backend keeping the corrections in an SQLite database next to the yaml file (correction.sqlite), as one
+    row per (gate, descriptor, sample_id) with indexes on (sample_id, gate) and gate, so that it can be queried and
+    scales to large cohorts. Every add/remove is one transaction. Descriptors and gates without samples are kept in
+    their own tables, so that the export is the same as the yaml backend would write.
+
+    AliGater reads correction.yaml, which is exported from the database when the store is closed (on exit), on demand
+    with compact() or with "AGClassifier.py export". A database that does not exist yet is created from the yaml file.
+
+    The store is created by the session loader thread and used by the GUI thread, so the connection is shared between
+    threads, and every use of it holds the store's lock.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS gates (gate TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS descriptors (gate TEXT NOT NULL, descriptor TEXT NOT NULL,
+                                                PRIMARY KEY (gate, descriptor));
+        CREATE TABLE IF NOT EXISTS corrections (gate TEXT NOT NULL, descriptor TEXT NOT NULL,
+                                                sample_id TEXT NOT NULL, UNIQUE (gate, descriptor, sample_id));
+        CREATE INDEX IF NOT EXISTS corrections_sample_id ON corrections (sample_id, gate);
+        CREATE INDEX IF NOT EXISTS corrections_gate ON corrections (gate);
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the correction yaml file. The database is the same path with a .sqlite extension.
+        """
+        self.path = path
+        self.db_path = os.path.splitext(path)[0] + ".sqlite"
+        is_new = not os.path.exists(self.db_path)
+        self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock, self._db:
+            self._db.executescript(self.SCHEMA)
+        if is_new and os.path.exists(path):
+            yaml_store = CorrectionStore(path)  # Also merges any journals of the yaml backend
+            self._import(yaml_store.to_dict())
+            yaml_store.close()
+        self._data_version = self._get_data_version()
+
+    def _import(self, correction_dict: dict) -> None:
+        with self._lock, self._db:
+            for gate_name, gate_dict in correction_dict.items():
+                self._db.execute("INSERT OR IGNORE INTO gates VALUES (?)", (gate_name,))
+                for descriptor, sample_ids in gate_dict.items():
+                    self._db.execute("INSERT OR IGNORE INTO descriptors VALUES (?, ?)", (gate_name, descriptor))
+                    self._db.executemany("INSERT OR IGNORE INTO corrections VALUES (?, ?, ?)",
+                                         [(gate_name, descriptor, sample_id) for sample_id in sample_ids])
+
+    def _get_data_version(self) -> int:
+        with self._lock:
+            return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def sample_gates(self, sample_name: str) -> dict:
+        sample_gates = {}
+        with self._lock:
+            rows = self._db.execute("SELECT gate, descriptor FROM corrections WHERE sample_id = ?",
+                                    (sample_name,)).fetchall()
+        for gate_name, descriptor in rows:
+            sample_gates.setdefault(gate_name, set()).add(descriptor)
+        return sample_gates
+
+    def contains(self, sample_name: str, gate_name: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM corrections WHERE sample_id = ? AND gate = ? LIMIT 1",
+                                    (sample_name, gate_name)).fetchone() is not None
+
+    def add(self, gate_name: str, descriptors: list, sample_id: str) -> None:
+        with timed("database write"), self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO gates VALUES (?)", (gate_name,))
+            for descriptor in descriptors:
+                self._db.execute("INSERT OR IGNORE INTO descriptors VALUES (?, ?)", (gate_name, descriptor))
+                self._db.execute("INSERT OR IGNORE INTO corrections VALUES (?, ?, ?)",
+                                 (gate_name, descriptor, sample_id))
+
+    def remove(self, sample_name: str, gate_name: str) -> None:
+        with timed("database write"), self._lock, self._db:
+            self._db.execute("DELETE FROM corrections WHERE sample_id = ? AND gate = ?", (sample_name, gate_name))
+
+    def add_many(self, gate_name: str, descriptors: list, sample_ids: list) -> None:
+        with timed("database write"), self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO gates VALUES (?)", (gate_name,))
+            for descriptor in descriptors:
+                self._db.execute("INSERT OR IGNORE INTO descriptors VALUES (?, ?)", (gate_name, descriptor))
+                self._db.executemany("INSERT OR IGNORE INTO corrections VALUES (?, ?, ?)",
+                                     [(gate_name, descriptor, sample_id) for sample_id in sample_ids])
+
+    def remove_many(self, sample_names: list, gate_name: str) -> None:
+        with timed("database write"), self._lock, self._db:
+            self._db.executemany("DELETE FROM corrections WHERE sample_id = ? AND gate = ?",
+                                 [(sample_name, gate_name) for sample_name in sample_names])
+
+    def replace_many(self, gate_name: str, descriptors: list, sample_ids: list) -> None:
+        with timed("database write"), self._lock, self._db:
+            self._db.executemany("DELETE FROM corrections WHERE sample_id = ? AND gate = ?",
+                                 [(sample_id, gate_name) for sample_id in sample_ids])
+            self._db.execute("INSERT OR IGNORE INTO gates VALUES (?)", (gate_name,))
+            for descriptor in descriptors:
+                self._db.execute("INSERT OR IGNORE INTO descriptors VALUES (?, ?)", (gate_name, descriptor))
+                self._db.executemany("INSERT OR IGNORE INTO corrections VALUES (?, ?, ?)",
+                                     [(gate_name, descriptor, sample_id) for sample_id in sample_ids])
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            correction_dict = {gate_name: {} for gate_name, in self._db.execute("SELECT gate FROM gates")}
+            for gate_name, descriptor in self._db.execute("SELECT gate, descriptor FROM descriptors"):
+                correction_dict[gate_name][descriptor] = []
+            for gate_name, descriptor, sample_id in self._db.execute(
+                    "SELECT gate, descriptor, sample_id FROM corrections ORDER BY sample_id"):
+                correction_dict[gate_name][descriptor].append(sample_id)
+        return correction_dict
+
+    def refresh(self) -> bool:
+        """
+        Queries always see the latest data; this only tells whether another session changed the database since the
+        last call, so that views built from it can be updated.
+
+        :return: True if another session wrote to the database
+        """
+        data_version = self._get_data_version()
+        changed = data_version != self._data_version
+        self._data_version = data_version
+        return changed
+
+    def compact(self) -> None:
+        """
+        Export the database to the correction yaml file, written to a temporary file and renamed over the old one.
+
+        :return: None
+        """
+
+        tmp_path = self.path + ".tmp"
+        with timed("yaml write"):
+            with open(tmp_path, "w") as out_file:
+                yaml.safe_dump(self.to_dict(), out_file)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        """
+        Export the database to the correction yaml file and close it.
+
+        :return: None
+        """
+
+        with self._lock:
+            if self._db is not None:
+                self.compact()
+                self._db.close()
+                self._db = None
+
+
+# Storage backends, by the name used on the command line
+CORRECTION_BACKENDS = {"yaml": CorrectionStore, "sqlite": SQLiteCorrectionStore}
+
+# Storage backend of the correction store, set by AGClassifier from the command line
+global correction_backend
+correction_backend = "yaml"
+
+
+def set_correction_backend(backend: str) -> None:
+    """
+    Set the storage backend used for the correction stores created from now on.
+
+    :param backend: One of CORRECTION_BACKENDS
+    :return: None
+    """
+
+    global correction_backend
+    if backend not in CORRECTION_BACKENDS:
+        raise ValueError("Unknown correction storage backend: " + str(backend))
+    correction_backend = backend
+
 
 def set_correction_yaml_global(path):
     """
-    Set the global variable for the correction yaml file to the path specified.
+    Set the global variable for the correction yaml file to the path specified, and load it into the correction store.
 
     :param path: Path to the correction yaml file
     :return:
     """
 
     global correction_yaml_file
+    global correction_store
+    if correction_store is not None:
+        correction_store.close()
     correction_yaml_file = path
+    correction_store = CORRECTION_BACKENDS[correction_backend](path)
+
+
+def get_correction_store() -> CorrectionStoreBase:
+    """
+    Get the correction store for the current correction yaml file, loading it if it has not been loaded yet.
+
+    :return: CorrectionStore, or the store of the backend set with set_correction_backend
+    """
+
+    global correction_store
+    if correction_store is None or correction_store.path != correction_yaml_file:
+        correction_store = CORRECTION_BACKENDS[correction_backend](correction_yaml_file)
+    return correction_store
+
+
+def compact_correction_yaml() -> None:
+    """
+    Write all journaled corrections (or the database) to the correction yaml file. Called on exit, may also be called
+    on demand.
+
+    :return: None
+    """
+
+    if correction_store is not None:
+        correction_store.close()
+
+
+atexit.register(compact_correction_yaml)
 
 
 # Wrong selection window
@@ -51,10 +750,1395 @@ def create_invalid_select_window():
     return
 
 
+# Element keys of the image viewer, in the order of the pages in page_no
+IMAGE_ELEMENT_KEYS = ("-IMAGE-", "-IMAGE2-", "-IMAGE3-")
+
+# Formats rendered pages can be handed to the image elements in. Tk reads both directly. PPM is uncompressed, which
+# saves a zlib compression when rendering and a decompression in Tk for every page shown, at the cost of more memory
+IMAGE_TRANSFER_FORMATS = ("ppm", "png")
+
+# Format used for the image elements, see set_image_transfer_format
+global image_transfer_format
+image_transfer_format = "ppm"
+
+# PyMuPDF is not thread safe, every call into fitz has to hold this lock
+fitz_lock = threading.RLock()
+
+# Background renderer of upcoming samples, set by the event loop. None means everything is rendered on demand
+global render_prefetcher
+render_prefetcher = None
+
+
+def set_image_transfer_format(image_format: str) -> None:
+    """
+    Set the format rendered pages are handed to the image elements in.
+
+    :param image_format: One of IMAGE_TRANSFER_FORMATS
+    :return: None
+    """
+
+    global image_transfer_format
+    if image_format not in IMAGE_TRANSFER_FORMATS:
+        raise ValueError("Unknown image transfer format: " + str(image_format))
+    image_transfer_format = image_format
+
+
+def get_image_transfer_format() -> str:
+    """
+    :return: The format set with set_image_transfer_format
+    """
+    return image_transfer_format
+
+
+def validate_page_no(page_no) -> None:
+    """
+    Check that page_no is an integer or a tuple of integers, raise a TypeError otherwise.
+
+    :param page_no: page number(s) from the layout
+    :return: None
+    """
+
+    if not isinstance(page_no, int):
+        if isinstance(page_no, tuple):
+            for elem in page_no:
+                if not isinstance(elem, int):
+                    raise TypeError("page_no must be an integer or a tuple of integers.")
+        else:
+            raise TypeError("page_no must be an integer or a tuple of integers.")
+
+
+def default_image_size(page_no) -> tuple:
+    """
+    Size the pages are rendered at in the main window before it is resized.
+    Page no can either be single int, if a single image is shown, but tuple of ints if 2 or 3 images are shown.
+    Resolution is halved when more than one image is shown.
+
+    :param page_no: page number(s) from the layout
+    :return: (width, height)
+    """
+
+    window_x_size = 960
+    window_y_size = 840
+    if not isinstance(page_no, int):
+        window_x_size = window_x_size / 2
+        window_y_size = window_y_size / 2
+    return window_x_size, window_y_size
+
+
+# Size of the image elements of the main window, set when the window is resized. None means the default size
+global image_size
+image_size = None
+
+# Sizes the images are resized to are rounded to a multiple of this, so that a resize by a few pixels does not render
+# the pages again, and resizing back to an earlier size finds its pages in the render cache
+IMAGE_SIZE_STEP = 16
+
+# Smallest width the images are resized to
+MIN_IMAGE_WIDTH = 160
+
+# Columns and rows of the image grid of the image viewer, by number of images
+IMAGE_GRID = {1: (1, 1), 2: (1, 2), 3: (2, 2)}
+
+
+def get_image_size(page_no) -> tuple:
+    """
+    Size the pages are rendered at in the main window: the size set with set_image_size once the window was resized,
+    otherwise default_image_size.
+
+    :param page_no: page number(s) from the layout
+    :return: (width, height)
+    """
+
+    if image_size is not None:
+        return image_size
+    return default_image_size(page_no)
+
+
+def set_image_size(size) -> None:
+    """
+    Set the size the pages are rendered at in the main window.
+
+    :param size: (width, height), or None for the default size
+    :return: None
+    """
+
+    global image_size
+    image_size = size
+
+
+def fit_image_size(page_no, old_window_size: tuple, new_window_size: tuple) -> tuple:
+    """
+    Size of the images of the main window after it was resized: the change in window size is shared between the
+    images side by side (and those stacked), keeping the aspect ratio of the default size.
+
+    :param page_no: page number(s) from the layout
+    :param old_window_size: (width, height) of the window when the images were last rendered
+    :param new_window_size: (width, height) of the window now
+    :return: (width, height), the width rounded to IMAGE_SIZE_STEP
+    """
+
+    images = 1 if isinstance(page_no, int) else min(len(page_no), len(IMAGE_ELEMENT_KEYS))
+    columns, rows = IMAGE_GRID[images]
+    width, height = get_image_size(page_no)
+    default_width, default_height = default_image_size(page_no)
+    scale = min((width + (new_window_size[0] - old_window_size[0]) / columns) / default_width,
+                (height + (new_window_size[1] - old_window_size[1]) / rows) / default_height)
+    new_width = max(MIN_IMAGE_WIDTH, round_image_length(default_width * scale))
+    return new_width, int(round(new_width * default_height / default_width))
+
+
+def round_image_length(length: float) -> int:
+    """
+    :return: The width or height rounded to a multiple of IMAGE_SIZE_STEP
+    """
+    return int(round(length / IMAGE_SIZE_STEP) * IMAGE_SIZE_STEP)
+
+
+class ResizeDebouncer:
+    """
+    Turns the stream of <Configure> events of a resizable window into a single resize, once the window has kept the
+    same size for 'delay' seconds, so that dragging the window's border does not render the pages for every step.
+    Changes in size caused by the program itself, such as the window growing to fit a larger image, are taken in with
+    rebase() and are not reported as resizes.
+    """
+
+    def __init__(self, window_size: tuple, delay: float = 0.3):
+        """
+        :param window_size: Current (width, height) of the window
+        :param delay: Seconds the window has to keep its size before the resize is reported
+        """
+        self.size = tuple(window_size)
+        self.delay = delay
+        self._pending = None  # Size the window was last seen at, if it differs from self.size
+        self._changed_at = 0.0
+
+    def on_configure(self, window_size: tuple) -> None:
+        """
+        Take in the window size at a <Configure> event.
+        """
+        window_size = tuple(window_size)
+        if window_size == self.size:
+            self._pending = None
+        elif window_size != self._pending:
+            self._pending = window_size
+            self._changed_at = time.monotonic()
+
+    def rebase(self, window_size: tuple) -> None:
+        """
+        Take the window size as the size the images are rendered for, unless a resize by the user is pending.
+        """
+        if self._pending is None:
+            self.size = tuple(window_size)
+
+    def timeout(self):
+        """
+        :return: Milliseconds until a pending resize is due, or None if there is none
+        """
+        if self._pending is None:
+            return None
+        return max(0, int((self._changed_at + self.delay - time.monotonic()) * 1000))
+
+    def settled(self):
+        """
+        :return: (old size, new size) if the window has been resized and has kept its new size for 'delay' seconds,
+        None otherwise
+        """
+        if self._pending is None or time.monotonic() - self._changed_at < self.delay:
+            return None
+        old_size, self.size, self._pending = self.size, self._pending, None
+        return old_size, self.size
+
+
+class RenderCache:
+    """
+    LRU cache of rendered page images, bounded by the total size of the image data rather than the number of entries.
+    Keys are built with render_cache_key, so an entry is not reused if the PDF is modified or a different size is
+    requested. Shared by the main window, the prefetcher and the "Open pdf" window.
+    """
+
+    def __init__(self, max_mb: float = 256):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()  # key -> image data, least recently used first
+        self._lock = threading.Lock()  # The prefetcher fills the cache from its own thread
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        :return: Cached image data for the key, or None if it is not in the cache
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data: bytes) -> None:
+        """
+        Store image data, evicting the least recently used entries until the cache is within its budget.
+        Data larger than the whole budget is not stored.
+        """
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old_data = self._entries.pop(key, None)
+            if old_data is not None:
+                self.resident_bytes -= len(old_data)
+            self._entries[key] = data
+            self.resident_bytes += len(data)
+            while self.resident_bytes > self.max_bytes:
+                _, evicted_data = self._entries.popitem(last=False)
+                self.resident_bytes -= len(evicted_data)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        :return: Dict with the hit, miss and eviction counters, the number of entries and the resident bytes
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "resident_bytes": self.resident_bytes,
+                    "max_bytes": self.max_bytes}
+
+
+# Rendered page images, used by update_image and create_pdf_window
+global render_cache
+render_cache = RenderCache()
+
+
+def set_render_cache_budget(max_mb: float) -> None:
+    """
+    Replace the render cache with an empty one with a memory budget of 'max_mb' megabytes.
+
+    :param max_mb: Memory budget of the cache in MB
+    :return: None
+    """
+
+    global render_cache
+    render_cache = RenderCache(max_mb)
+
+
+def render_cache_key(filename: str, pno: int, width, height, image_format: str = "png") -> tuple:
+    """
+    Key of a rendered page in the render cache: (path, mtime, page, width, height, render options).
+
+    :param filename: path of the PDF
+    :param pno: page number
+    :param width: width the page is rendered at
+    :param height: height the page is rendered at
+    :param image_format: format of the image data
+    :return: Cache key
+    """
+
+    try:
+        mtime = os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError("File not found: " + filename)
+    return os.path.abspath(filename), mtime, pno, int(width), int(height), (image_format,)
+
+
+class DocumentPool:
+    """
+    LRU pool of open fitz documents and their display list tables, shared by the main window, the prefetcher and the
+    "Open pdf" window. A document is closed when it is evicted, when the PDF changes on disk, or by close_all().
+    The pool must only be used while holding fitz_lock, and documents must not be kept after releasing it, since
+    they can be closed by the next call.
+    """
+
+    def __init__(self, max_documents: int = 8):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()  # abspath -> (mtime, doc, dlist_tab), least recently used first
+        self.opened = 0
+        self.closed = 0
+
+    def get(self, filename: str):
+        """
+        Get an open document, opening it if it is not in the pool.
+
+        :param filename: path of the PDF
+        :return: (doc, dlist_tab)
+        """
+
+        path = os.path.abspath(filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found: " + filename)
+
+        entry = self._documents.get(path)
+        if entry is not None and entry[0] == mtime:
+            self._documents.move_to_end(path)
+            return entry[1], entry[2]
+        if entry is not None:  # Modified since it was opened
+            self._close(path)
+
+        try:
+            doc = fitz.open(path)
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found: " + filename)
+        self.opened += 1
+        dlist_tab = [None] * len(doc)
+        self._documents[path] = (mtime, doc, dlist_tab)
+        while len(self._documents) > self.max_documents:
+            self._close(next(iter(self._documents)))
+        return doc, dlist_tab
+
+    def _close(self, path: str) -> None:
+        _, doc, dlist_tab = self._documents.pop(path)
+        dlist_tab.clear()  # Drop the display lists before the document they were made from
+        doc.close()
+        self.closed += 1
+
+    def close_all(self) -> None:
+        """
+        Close every document in the pool.
+
+        :return: None
+        """
+
+        for path in list(self._documents):
+            self._close(path)
+
+    def __len__(self):
+        return len(self._documents)
+
+
+# Open documents, used through get_page_image
+global document_pool
+document_pool = DocumentPool()
+
+
+def close_document_pool() -> None:
+    """
+    Close all pooled documents. Called on exit.
+
+    :return: None
+    """
+
+    with fitz_lock:
+        document_pool.close_all()
+
+
+atexit.register(close_document_pool)
+
+
+def lock_file(file_obj) -> None:
+    """
+    Take an exclusive lock on an open file, blocking until it is available. The lock is shared between processes.
+
+    :param file_obj: File opened for writing
+    :return: None
+    """
+
+    if os.name == "nt":
+        import msvcrt
+        file_obj.seek(0)
+        msvcrt.locking(file_obj.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file_obj.fileno(), fcntl.LOCK_EX)
+
+
+def try_lock_file(file_obj) -> bool:
+    """
+    Take an exclusive lock on an open file if no one else holds it, without blocking.
+
+    :param file_obj: File opened for writing
+    :return: True if the lock was taken
+    """
+
+    try:
+        if os.name == "nt":
+            import msvcrt
+            file_obj.seek(0)
+            msvcrt.locking(file_obj.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file_obj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def unlock_file(file_obj) -> None:
+    """
+    Release a lock taken with lock_file.
+
+    :param file_obj: File opened for writing
+    :return: None
+    """
+
+    if os.name == "nt":
+        import msvcrt
+        file_obj.seek(0)
+        msvcrt.locking(file_obj.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file_obj.fileno(), fcntl.LOCK_UN)
+
+
+class PageArchive:
+    """
+    On-disk cache of rendered pages shared by GUI sessions and "AGClassifier.py prerender", stored as two append-only
+    files in a folder: pages.pack with the image data back to back, and pages.index with one fixed-size record
+    (key, offset, length) per page. Keys are content hashes, see page_archive_key.
+
+    Readers memory-map the pack file and never lock; they re-read the end of the index when a key is not found.
+    Writers serialize on pages.lock and always write the image data before its index record, so readers only see
+    complete pages. Data written by a writer that died before adding its index record is never referenced.
+    The GUI adds pages with put_later, which writes them from a background thread; get finds them in the meantime.
+    """
+
+    RECORD = struct.Struct("<20sQI")  # sha1 key, offset in the pack file, length
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.pack_path = os.path.join(folder, "pages.pack")
+        self.index_path = os.path.join(folder, "pages.index")
+        self.lock_path = os.path.join(folder, "pages.lock")
+        os.makedirs(folder, exist_ok=True)
+        for path in (self.pack_path, self.index_path):
+            open(path, "ab").close()
+        self._index = {}  # key -> (offset, length)
+        self._index_bytes = 0  # Bytes of the index file read so far
+        self._pack = None
+        self._mmap = None
+        self._lock = threading.Lock()  # The prefetcher reads from its own thread
+        self._pending = {}  # key -> image data of the pages queued by put_later
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AGClassifier-archive")
+        self._read_index()
+
+    def _read_index(self) -> None:
+        size = os.path.getsize(self.index_path)
+        size -= size % self.RECORD.size  # A record being written right now is read next time
+        if size <= self._index_bytes:
+            return
+        with open(self.index_path, "rb") as index_file:
+            index_file.seek(self._index_bytes)
+            records = index_file.read(size - self._index_bytes)
+        for key, offset, length in self.RECORD.iter_unpack(records):
+            self._index[key] = (offset, length)
+        self._index_bytes = size
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self._mmap is None or offset + length > len(self._mmap):
+            # The pack file grew since it was mapped
+            if self._mmap is not None:
+                self._mmap.close()
+            if self._pack is None:
+                self._pack = open(self.pack_path, "rb")
+            self._mmap = mmap.mmap(self._pack.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[offset:offset + length]
+
+    def get(self, key: bytes):
+        """
+        :param key: Key from page_archive_key
+        :return: Image data of the page, or None if it is not in the archive
+        """
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            entry = self._index.get(key)
+            if entry is None:
+                self._read_index()
+                entry = self._index.get(key)
+                if entry is None:
+                    return None
+            return self._read(*entry)
+
+    def __contains__(self, key: bytes) -> bool:
+        with self._lock:
+            if key in self._pending:
+                return True
+            if key not in self._index:
+                self._read_index()
+            return key in self._index
+
+    def put_many(self, items) -> None:
+        """
+        Append pages to the archive. Pages that are already in it are skipped.
+
+        :param items: Iterable of (key, image data)
+        :return: None
+        """
+
+        # Only the cross-process lock is held while waiting for other writers and writing, so that get() on the GUI
+        # thread never waits for them
+        with open(self.lock_path, "a+b") as archive_lock:
+            lock_file(archive_lock)
+            try:
+                with self._lock:
+                    self._read_index()
+                    index_bytes = self._index_bytes
+                    items = [(key, data) for key, data in items if key not in self._index]
+                records = []
+                added = set()
+                with open(self.pack_path, "ab") as pack_file:
+                    for key, data in items:
+                        if key in added:
+                            continue
+                        added.add(key)
+                        records.append(self.RECORD.pack(key, pack_file.tell(), len(data)))
+                        pack_file.write(data)
+                    pack_file.flush()
+                    os.fsync(pack_file.fileno())
+                if records:
+                    with open(self.index_path, "r+b") as index_file:
+                        # Drop the partial record of a writer that died half way, before appending
+                        index_file.truncate(index_bytes)
+                        index_file.seek(index_bytes)
+                        index_file.write(b"".join(records))
+                        index_file.flush()
+                        os.fsync(index_file.fileno())
+                    with self._lock:
+                        self._read_index()
+            finally:
+                unlock_file(archive_lock)
+
+    def put(self, key: bytes, data: bytes) -> None:
+        """
+        Append a single page to the archive, see put_many.
+        """
+        self.put_many([(key, data)])
+
+    def put_later(self, key, data: bytes) -> None:
+        """
+        Queue a page to be appended to the archive by a background thread, so that the caller does not wait for the
+        lock and the fsyncs of put_many. Pages queued while a write is going on are written together by the next one.
+
+        :param key: Key from page_archive_key, or a function returning it, which is then called on the background
+        thread
+        :param data: Image data of the page
+        :return: None
+        """
+        if not callable(key):
+            with self._lock:
+                self._pending[key] = data
+        self._writer.submit(self._write_pending, key, data)
+
+    def _write_pending(self, key, data: bytes) -> None:
+        if callable(key):
+            try:
+                key = key()
+            except OSError as e:
+                logger.warning("Could not add a page to %s: %s", self.folder, e)
+                return
+            with self._lock:
+                self._pending[key] = data
+        with self._lock:
+            items = list(self._pending.items())
+        if not items:
+            return  # Written together with an earlier page
+        try:
+            self.put_many(items)
+        except OSError as e:
+            logger.warning("Could not add pages to %s: %s", self.folder, e)
+        with self._lock:
+            for written, _ in items:
+                self._pending.pop(written, None)
+
+    def close(self) -> None:
+        """
+        Write the pages queued by put_later and close the pack file.
+
+        :return: None
+        """
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._pack is not None:
+                self._pack.close()
+                self._pack = None
+
+    def __len__(self):
+        return len(self._index)
+
+
+# Content hashes of PDFs, by (path, size, mtime), so each file is only hashed once per session
+_content_hashes = {}
+# Hashes being computed in the background, by the same key, see file_content_hash
+_hashes_in_progress = {}
+_hash_lock = threading.Lock()
+_hash_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AGClassifier-hash")
+
+
+def _hash_file(filename: str, memo_key: tuple) -> str:
+    content_hash = hashlib.sha1()
+    with open(filename, "rb") as in_file:
+        for chunk in iter(lambda: in_file.read(1024 * 1024), b""):
+            content_hash.update(chunk)
+    digest = content_hash.hexdigest()
+    with _hash_lock:
+        _content_hashes[memo_key] = digest
+        _hashes_in_progress.pop(memo_key, None)
+    return digest
+
+
+def file_content_hash(filename: str, wait: bool = True):
+    """
+    :param filename: path of the PDF
+    :param wait: False to not hash the file in the calling thread: if its hash is not known yet, it is computed in
+    the background and None is returned
+    :return: sha1 hex digest of the contents of the file, or None
+    """
+
+    stat = os.stat(filename)
+    memo_key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        digest = _content_hashes.get(memo_key)
+        future = _hashes_in_progress.get(memo_key)
+        if digest is None and future is None and not wait:
+            future = _hashes_in_progress[memo_key] = _hash_executor.submit(_hash_file, filename, memo_key)
+    if digest is not None:
+        return digest
+    if not wait:
+        return None
+    if future is not None:
+        return future.result()
+    return _hash_file(filename, memo_key)
+
+
+def page_archive_key(filename: str, pno: int, width, height, image_format: str = "png", wait: bool = True):
+    """
+    Key of a rendered page in the page archive: a hash of the PDF contents, the page and the render size and format.
+    Identical PDFs share their pages, whatever their path, and a modified PDF does not reuse old pages.
+
+    :param filename: path of the PDF
+    :param pno: Page number
+    :param width: width the page is rendered at
+    :param height: height the page is rendered at
+    :param image_format: format of the image data
+    :param wait: False to return None instead of hashing the PDF in the calling thread, see file_content_hash
+    :return: 20 byte key, or None
+    """
+
+    digest = file_content_hash(filename, wait)
+    if digest is None:
+        return None
+    key = "|".join(str(part) for part in (digest, pno, int(width), int(height), image_format))
+    return hashlib.sha1(key.encode("utf-8")).digest()
+
+
+# Rendered pages shared between sessions, in output/render_cache. None if not used
+global page_archive
+page_archive = None
+
+
+def set_page_archive(archive) -> None:
+    """
+    Set the page archive get_page_image looks in before rendering, and adds newly rendered pages to.
+
+    :param archive: PageArchive, or None to not use one
+    :return: None
+    """
+
+    global page_archive
+    if page_archive is not None:
+        page_archive.close()
+    page_archive = archive
+
+
+atexit.register(set_page_archive, None)
+
+
+def lookup_page_image(filename: str, pno: int, width, height, image_format: str) -> tuple:
+    """
+    Look for the image data of a page in the render cache, then in the page archive.
+
+    :param filename: path of the PDF
+    :param pno: Page number
+    :param width: width the page is rendered at
+    :param height: height the page is rendered at
+    :param image_format: One of IMAGE_TRANSFER_FORMATS
+    :return: (data, cache_key, archive_key), data is None if the page has to be rendered. The keys are for
+    store_page_image. archive_key is a function returning the key while the PDF is being hashed.
+    """
+
+    cache_key = render_cache_key(filename, pno, width, height, image_format)
+    data = render_cache.get(cache_key)
+    if data is not None:
+        return data, cache_key, None
+    archive_key = None
+    if page_archive is not None:
+        # The GUI thread does not wait for a PDF to be hashed. Until it is, the page is not looked for in the archive,
+        # and the page archive's writer computes its key when the rendered page is added
+        wait = threading.current_thread() is not threading.main_thread()
+        archive_key = page_archive_key(filename, pno, width, height, image_format, wait=wait)
+        if archive_key is None:
+            archive_key = lambda: page_archive_key(filename, pno, width, height, image_format)
+        else:
+            data = page_archive.get(archive_key)
+            if data is not None:
+                render_cache.put(cache_key, data)
+    return data, cache_key, archive_key
+
+
+def store_page_image(cache_key, archive_key, data: bytes) -> None:
+    """
+    Add a newly rendered page to the render cache, and queue it to be added to the page archive.
+
+    :param cache_key: Render cache key, from lookup_page_image
+    :param archive_key: Page archive key, from lookup_page_image. None if there is no page archive
+    :param data: Image data of the page
+    :return: None
+    """
+
+    render_cache.put(cache_key, data)
+    if page_archive is not None and archive_key is not None:
+        page_archive.put_later(archive_key, data)
+
+
+def render_page_data(filename: str, pno: int, width, height, image_format: str) -> bytes:
+    """
+    Render a page from the pooled document, without looking in or adding to the caches. Also the task of the render
+    pool's worker processes, where it uses the worker's own document pool.
+
+    :return: Image data of the page
+    """
+
+    with fitz_lock:
+        doc, dlist_tab = document_pool.get(filename)
+        with timed("render"):
+            pixmap = get_page(pno, dlist_tab, doc, width=width, height=height)
+        with timed("encode"):
+            return pixmap.tobytes(image_format)
+
+
+def get_page_image(filename: str, pno: int, width, height, image_format: str = None) -> bytes:
+    """
+    Get the image data of a page, from the render cache or the page archive if it is there, otherwise rendered with
+    get_page from the pooled document. Newly rendered pages are added to the page archive.
+
+    :param filename: path of the PDF
+    :param pno: Page number
+    :param width: width to render the page at
+    :param height: height to render the page at
+    :param image_format: One of IMAGE_TRANSFER_FORMATS, default is the format set with set_image_transfer_format
+    :return: Image data of the page
+    """
+
+    if image_format is None:
+        image_format = image_transfer_format
+    data, cache_key, archive_key = lookup_page_image(filename, pno, width, height, image_format)
+    if data is None:
+        data = render_page_data(filename, pno, width, height, image_format)
+        store_page_image(cache_key, archive_key, data)
+    return data
+
+
+def _start_render_worker() -> int:
+    """
+    First task of every render pool worker: load fitz, so that the first sample does not wait for it.
+
+    :return: Process ID of the worker
+    """
+
+    ensure_fitz_loaded()
+    return os.getpid()
+
+
+def ppm_size(width, height) -> int:
+    """
+    :return: Size in bytes of an RGB PPM image of width x height, with its header
+    """
+    return len(b"P6\n%d %d\n255\n" % (int(width), int(height))) + int(width) * int(height) * 3
+
+
+class SharedPageRing:
+    """
+    Ring of fixed-size slots in a shared memory block, which the render pool's workers write rendered pages into, so
+    that only the length of the image data goes back through the process pool's pipe instead of the data itself.
+    A slot is taken for every page sent to the workers and given back as soon as the GUI process has copied the page
+    out of it: the render cache keeps the pages as bytes, and Tk only takes bytes, so that one copy is needed anyway.
+    """
+
+    def __init__(self, slots: int, slot_bytes: int):
+        """
+        :param slots: Number of slots, the number of pages that can be rendered at the same time
+        :param slot_bytes: Size of each slot, the size of the largest page image, see ppm_size
+        """
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.name = self.shm.name
+        self._free = list(range(slots))
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def acquire(self) -> int:
+        """
+        Take a free slot, waiting for one to be given back if they are all in use.
+
+        :return: Slot number
+        """
+        with self._condition:
+            while not self._free:
+                self._condition.wait()
+            return self._free.pop()
+
+    def release(self, slot: int) -> None:
+        with self._condition:
+            self._free.append(slot)
+            self._condition.notify()
+
+    def free_slots(self) -> int:
+        """
+        :return: Number of slots that are not in use
+        """
+        with self._condition:
+            return len(self._free)
+
+    def offset(self, slot: int) -> int:
+        return slot * self.slot_bytes
+
+    def read(self, slot: int, length: int) -> bytes:
+        """
+        :return: Copy of the first 'length' bytes of the slot
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The shared page ring is closed")
+            offset = self.offset(slot)
+            return bytes(self.shm.buf[offset:offset + length])
+
+    def close(self) -> None:
+        """
+        Free the shared memory. Workers still writing to it keep their mapping until they exit.
+
+        :return: None
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self.shm.close()
+            self.shm.unlink()
+
+
+# Shared page rings a render pool worker has attached to, by name
+_attached_page_rings = {}
+
+
+def _render_page_to_slot(ring_name: str, offset: int, slot_bytes: int, filename: str, pno: int, width, height,
+                         image_format: str):
+    """
+    Task of the render pool's workers when the pool has a shared page ring: render a page straight into a slot of the
+    ring. PPM pages are written as a header and the pixmap's samples, without making a bytes object of the image.
+
+    :param ring_name: Name of the shared memory block of the ring
+    :param offset: Offset of the slot in the block
+    :param slot_bytes: Size of the slot
+    :return: Length of the image data written to the slot, or the image data itself if it does not fit in the slot
+    """
+
+    ring = _attached_page_rings.get(ring_name)
+    if ring is None:
+        ring = _attached_page_rings[ring_name] = shared_memory.SharedMemory(name=ring_name)
+    with fitz_lock:
+        doc, dlist_tab = document_pool.get(filename)
+        pixmap = get_page(pno, dlist_tab, doc, width=width, height=height)
+        if image_format == "ppm" and pixmap.n == 3 and not pixmap.alpha:
+            header = b"P6\n%d %d\n255\n" % (pixmap.width, pixmap.height)
+            length = len(header) + len(pixmap.samples_mv)
+            if length <= slot_bytes:
+                ring.buf[offset:offset + len(header)] = header
+                ring.buf[offset + len(header):offset + length] = pixmap.samples_mv
+                return length
+        data = pixmap.tobytes(image_format)
+    if len(data) <= slot_bytes:
+        ring.buf[offset:offset + len(data)] = data
+        return len(data)
+    return data
+
+
+class RenderPool:
+    """
+    Worker processes that render the pages of one sample in parallel, for the layouts with 2 or 3 images. Each worker
+    keeps its own pool of open documents, so rendering is held back by neither the GIL nor fitz_lock. Only pages that
+    are not in the render cache or the page archive are sent to the workers, and their image data is added to both in
+    the GUI process. With a slot size, the workers hand the pages back through a SharedPageRing.
+    """
+
+    def __init__(self, processes: int, slot_bytes: int = None):
+        """
+        :param processes: Number of worker processes. They are started right away, in the background.
+        :param slot_bytes: Size of the largest page image, see ppm_size. None sends the pages back through the pipe.
+        """
+        self.processes = processes
+        # Workers are spawned, not forked, as a fork would copy the locks held by the GUI process's threads
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        # Enough slots for the pages of the sample on screen and of the one being prefetched
+        self.ring = SharedPageRing(2 * len(IMAGE_ELEMENT_KEYS), slot_bytes) if slot_bytes else None
+        for _ in range(processes):
+            self._executor.submit(_start_render_worker)
+
+    def submit(self, filename: str, pno: int, width, height, image_format: str):
+        """
+        :return: Future with the image data of the page. Cancelling it cancels the render if it has not started, and
+        drops the page if it has; either way its slot is given back.
+        """
+        if self.ring is None:
+            return self._executor.submit(render_page_data, filename, pno, width, height, image_format)
+
+        slot = self.ring.acquire()
+        result = Future()
+
+        def copy_out(future):
+            try:
+                if future.cancelled():
+                    result.cancel()
+                elif not result.cancelled():  # Nobody waits for a cancelled page, so it is not copied out
+                    data = future.result()
+                    result.set_result(data if isinstance(data, bytes) else self.ring.read(slot, data))
+            except InvalidStateError:
+                pass  # The result was cancelled while the page was copied out
+            except Exception as e:
+                try:
+                    result.set_exception(e)
+                except InvalidStateError:
+                    pass
+            finally:
+                self.ring.release(slot)
+
+        try:
+            future = self._executor.submit(_render_page_to_slot, self.ring.name, self.ring.offset(slot),
+                                           self.ring.slot_bytes, filename, pno, width, height, image_format)
+        except Exception:
+            self.ring.release(slot)
+            raise
+        future.add_done_callback(copy_out)
+
+        def forward_cancel(done):
+            if done.cancelled():
+                future.cancel()
+                done.set_running_or_notify_cancel()  # Wakes up as_completed and wait, which only see notified futures
+
+        result.add_done_callback(forward_cancel)
+        return result
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes, dropping any pages that are still queued, and free the shared page ring.
+
+        :return: None
+        """
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.ring is not None:
+            self.ring.close()
+
+
+# Worker processes rendering the pages of a sample in parallel, set by the event loop. None renders them one by one
+global render_pool
+render_pool = None
+
+
+def set_render_pool(pool) -> None:
+    """
+    Set the render pool used by iter_sample_pages. Passing None stops the current pool.
+
+    :param pool: RenderPool or None
+    :return: None
+    """
+
+    global render_pool
+    if render_pool is not None:
+        render_pool.shutdown()
+    render_pool = pool
+
+
+def get_render_pool():
+    """
+    :return: The render pool set with set_render_pool, or None
+    """
+    return render_pool
+
+
+atexit.register(set_render_pool, None)
+
+
+def get_page_count(filename: str) -> int:
+    """
+    :param filename: path of the PDF
+    :return: Number of pages in the PDF
+    """
+
+    with fitz_lock:
+        doc, _ = document_pool.get(filename)
+        return len(doc)
+
+
+def iter_sample_pages(filename: str, page_no):
+    """
+    Get the image data of the pages shown in the main window for a single sample, as each becomes available: pages in
+    the render cache or the page archive first, then the rendered ones. With a render pool, the pages to render are
+    rendered in parallel and come out in the order they finish.
+
+    :param filename: path of the sample PDF
+    :param page_no: page number of the PDF to render. This can be a tuple of page numbers.
+    :return: Generator of (position, data), position being the index of the page's element in IMAGE_ELEMENT_KEYS
+    """
+
+    pages = [page_no] if isinstance(page_no, int) else list(page_no[:len(IMAGE_ELEMENT_KEYS)])
+    width, height = get_image_size(page_no)
+    image_format = image_transfer_format
+
+    missing = []  # (position, page, cache_key, archive_key) of the pages to render
+    for position, pno in enumerate(pages):
+        data, cache_key, archive_key = lookup_page_image(filename, pno, width, height, image_format)
+        if data is not None:
+            yield position, data
+        else:
+            missing.append((position, pno, cache_key, archive_key))
+
+    pool = render_pool
+    if len(missing) > 1 and pool is not None:
+        start = time.perf_counter()
+        try:
+            futures = {pool.submit(filename, pno, width, height, image_format): (position, pno, cache_key, archive_key)
+                       for position, pno, cache_key, archive_key in missing}
+            for future in as_completed(futures):
+                position, pno, cache_key, archive_key = futures[future]
+                data = future.result()
+                metrics.record_stage("parallel render", (time.perf_counter() - start) * 1000)
+                store_page_image(cache_key, archive_key, data)
+                missing.remove((position, pno, cache_key, archive_key))
+                yield position, data
+        except BrokenExecutor:
+            logger.warning("The render worker processes stopped, rendering in this process from now on")
+            if render_pool is pool:
+                set_render_pool(None)
+
+    for position, pno, cache_key, archive_key in missing:
+        data = render_page_data(filename, pno, width, height, image_format)
+        store_page_image(cache_key, archive_key, data)
+        yield position, data
+
+
+def render_sample_pages(filename: str, page_no) -> list:
+    """
+    Render the pages shown in the main window for a single sample. Pages found in the render cache are not rendered
+    again.
+
+    :param filename: path of the sample PDF
+    :param page_no: page number of the PDF to render. This can be a tuple of page numbers.
+    :return: List with the image data of each page, in the order of IMAGE_ELEMENT_KEYS
+    """
+
+    pages = 1 if isinstance(page_no, int) else len(page_no[:len(IMAGE_ELEMENT_KEYS)])
+    image_data = [None] * pages
+    for position, data in iter_sample_pages(filename, page_no):
+        image_data[position] = data
+    return image_data
+
+
+class RenderPrefetcher:
+    """
+    Renders the pages of the samples around the one on screen on a background thread, so that going to the next or
+    previous sample only has to swap in finished image data.
+    After each navigation, schedule() queues the next 'depth' samples and the previous one that the navigation index
+    would go to; get() hands out the result for a sample if it was prefetched.
+    Rendering still holds fitz_lock, so at most one page is rendered at a time.
+    """
+
+    def __init__(self, page_no, depth: int = 2):
+        self.page_no = page_no
+        self.depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AGClassifier-prefetch")
+        self._futures = {}  # filename -> Future with the list of image data
+        self.hits = 0  # Requested sample was already rendered
+        self.waits = 0  # Requested sample was being rendered, waited for it to finish
+        self.misses = 0  # Requested sample was not prefetched
+
+    def _targets(self, image_index: int, file_list: list) -> list:
+        navigation = get_navigation_index(file_list)
+        targets = []
+        index = navigation.next(image_index)
+        while len(targets) < self.depth and index is not None:
+            targets.append(file_list[index])
+            index = navigation.next(index)
+        index = navigation.previous(image_index)
+        if index is not None:
+            targets.append(file_list[index])
+        return targets
+
+    def schedule(self, image_index: int, file_list: list) -> None:
+        """
+        Queue rendering of the samples around image_index, and drop those that are no longer around it. The pages of
+        the current sample are kept, since it becomes the previous sample once the user moves on.
+
+        :param image_index: index of the sample currently on screen
+        :param file_list: list of all PDF files to process
+        :return: None
+        """
+
+        targets = self._targets(image_index, file_list)
+        keep = set(targets)
+        keep.add(file_list[image_index])
+        for filename in list(self._futures):
+            if filename not in keep:
+                self._futures.pop(filename).cancel()
+        for filename in targets:
+            if filename not in self._futures:
+                self._futures[filename] = self._executor.submit(render_sample_pages, filename, self.page_no)
+
+    def get(self, filename: str):
+        """
+        Get the prefetched image data of a sample.
+
+        :param filename: path of the sample PDF
+        :return: List with the image data of each page, or None if the sample has to be rendered by the caller
+        """
+
+        future = self._futures.get(filename)
+        if future is None or future.cancelled() or not (future.done() or future.running()):
+            if future is not None:
+                self._futures.pop(filename).cancel()
+            self.misses += 1
+            return None
+        if future.done():
+            self.hits += 1
+        else:
+            self.waits += 1
+        try:
+            return future.result()
+        except Exception as e:
+            # Let the caller render it again, and raise the error in the GUI thread if it still happens
+            sys.stderr.write("WARNING: prefetching " + filename + " failed: " + str(e) + "\n")
+            self._futures.pop(filename, None)
+            return None
+
+    def clear(self) -> None:
+        """
+        Drop every prefetched sample, e.g. after the pages are rendered at a new size.
+
+        :return: None
+        """
+
+        for future in self._futures.values():
+            future.cancel()
+        self._futures = {}
+
+    def stats(self) -> dict:
+        """
+        :return: Dict with the hit, wait and miss counters
+        """
+        return {"depth": self.depth, "hits": self.hits, "waits": self.waits, "misses": self.misses}
+
+    def shutdown(self) -> None:
+        """
+        Stop the background thread, dropping any samples that are still queued.
+
+        :return: None
+        """
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._futures = {}
+
+
+def set_render_prefetcher(prefetcher) -> None:
+    """
+    Set the prefetcher used by update_image. Passing None turns prefetching off.
+
+    :param prefetcher: RenderPrefetcher or None
+    :return: None
+    """
+
+    global render_prefetcher
+    if render_prefetcher is not None:
+        render_prefetcher.shutdown()
+    render_prefetcher = prefetcher
+
+
+def get_render_prefetcher():
+    """
+    :return: The prefetcher set with set_render_prefetcher, or None
+    """
+    return render_prefetcher
+
+
+def shutdown_render_prefetcher() -> None:
+    """
+    Report the prefetch counters and stop the prefetcher. Called on exit.
+
+    :return: None
+    """
+
+    if render_prefetcher is not None:
+        logger.info("Prefetch stats: %s", render_prefetcher.stats())
+        set_render_prefetcher(None)
+
+
+atexit.register(shutdown_render_prefetcher)
+
+
+def report_render_cache() -> None:
+    """
+    Log the render cache counters. Called on exit.
+
+    :return: None
+    """
+
+    if render_cache.hits or render_cache.misses:
+        logger.info("Render cache stats: %s", render_cache.stats())
+
+
+atexit.register(report_render_cache)
+
+
+class ProgressiveRenderer:
+    """
+    Two-phase rendering of the pages of a sample that are not in the render cache or the page archive. A preview at
+    1/PREVIEW_ZOOM of the resolution is rendered and shown right away, scaled up by Tk, and the pages are rendered at
+    full resolution on a background thread and posted to the window as "-REFINED-" events, for show_refined. A
+    refinement is dropped, before it is rendered and before it is shown, once another sample has been shown.
+    """
+
+    PREVIEW_ZOOM = 2
+
+    def __init__(self, window):
+        """
+        :param window: The main window, which the full-resolution pages are posted to
+        """
+        self.window = window
+        self.generation = 0  # Number of samples shown so far, identifies the sample on screen
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AGClassifier-refine")
+        self.previews = 0
+        self.refined = 0
+        self.skipped = 0
+
+    def pages(self, filename: str, page_no):
+        """
+        Get the image data of the pages of the sample being shown, as for iter_sample_pages, but with previews of the
+        pages that have to be rendered. Their refinement is queued once the previews are out.
+
+        :param filename: path of the sample PDF
+        :param page_no: page number of the PDF to render. This can be a tuple of page numbers.
+        :return: Generator of (position, data, zoom), zoom being the factor the image has to be scaled up by
+        """
+
+        self.generation += 1
+        generation = self.generation
+        pages = [page_no] if isinstance(page_no, int) else list(page_no[:len(IMAGE_ELEMENT_KEYS)])
+        width, height = get_image_size(page_no)
+        image_format = image_transfer_format
+
+        missing = []
+        for position, pno in enumerate(pages):
+            data, _, _ = lookup_page_image(filename, pno, width, height, image_format)
+            if data is not None:
+                yield position, data, 1
+            else:
+                missing.append(position)
+        for position in missing:
+            with timed("preview render"):
+                data = render_page_data(filename, pages[position], width // self.PREVIEW_ZOOM,
+                                        height // self.PREVIEW_ZOOM, image_format)
+            self.previews += 1
+            yield position, data, self.PREVIEW_ZOOM
+        if missing:
+            self._executor.submit(self._refine, generation, filename, page_no, missing)
+
+    def _refine(self, generation: int, filename: str, page_no, positions: list) -> None:
+        if generation != self.generation:
+            self.skipped += len(positions)
+            return
+        for position, data in iter_sample_pages(filename, page_no):
+            if generation != self.generation:  # The user has moved on, the rest is left to the prefetcher
+                self.skipped += len(positions)
+                return
+            if position in positions:
+                positions.remove(position)
+                self.window.write_event_value("-REFINED-", (generation, position, data))
+
+    def show_refined(self, window_ref, refined, page_no) -> bool:
+        """
+        Replace a preview with the full-resolution page, if its sample is still the one shown.
+
+        :param window_ref: reference to the main window
+        :param refined: Value of the "-REFINED-" event
+        :param page_no: page number(s) from the layout
+        :return: True if the page was shown
+        """
+
+        generation, position, data = refined
+        if generation != self.generation:
+            self.skipped += 1
+            return False
+        window_x_size, window_y_size = get_image_size(page_no)
+        with timed("window refresh"):
+            window_ref[IMAGE_ELEMENT_KEYS[position]].update(data=data, size=(int(window_x_size), int(window_y_size)),
+                                                            zoom=1)
+            window_ref.refresh()
+        self.refined += 1
+        return True
+
+    def stats(self) -> dict:
+        """
+        :return: Dict with the number of previews shown, and of refinements shown and skipped
+        """
+        return {"previews": self.previews, "refined": self.refined, "skipped": self.skipped}
+
+    def shutdown(self) -> None:
+        """
+        Stop the background thread, dropping any refinements that are still queued.
+
+        :return: None
+        """
+
+        self.generation += 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Renderer of previews of the pages that are not rendered yet, set by the event loop. None shows the pages only once
+# they are rendered at full resolution
+global progressive_renderer
+progressive_renderer = None
+
+
+def set_progressive_renderer(renderer) -> None:
+    """
+    Set the progressive renderer used by update_image. Passing None turns previews off.
+
+    :param renderer: ProgressiveRenderer or None
+    :return: None
+    """
+
+    global progressive_renderer
+    if progressive_renderer is not None:
+        logger.info("Progressive render stats: %s", progressive_renderer.stats())
+        progressive_renderer.shutdown()
+    progressive_renderer = renderer
+
+
+def get_progressive_renderer():
+    """
+    :return: The progressive renderer set with set_progressive_renderer, or None
+    """
+    return progressive_renderer
+
+
+atexit.register(set_progressive_renderer, None)
+
+
 def update_image(window_ref, image_index, file_list, page_no=0, sample_in_yaml_string=""):
     """
     Update the image being shown in the PySimpleGUI window. Replace the current image with the image at the page
     'page_no' of the file specified in 'file_list'['image_index'].
+    If a prefetcher is set, its rendered pages are used when available, and the samples around the new one are
+    queued for prefetching.
 
     :param window_ref: reference to the main window
     :param image_index: index of the PDF file name we want to jump to in the file list
@@ -65,13 +2149,7 @@ def update_image(window_ref, image_index, file_list, page_no=0, sample_in_yaml_s
     """
 
     # Validate page_no format
-    if not isinstance(page_no, int):
-        if isinstance(page_no, tuple):
-            for elem in page_no:
-                if not isinstance(elem, int):
-                    raise TypeError("page_no must be an integer or a tuple of integers.")
-        else:
-            raise TypeError("page_no must be an integer or a tuple of integers.")
+    validate_page_no(page_no)
 
     # Load found valid image
     filename = file_list[image_index]
@@ -81,49 +2159,32 @@ def update_image(window_ref, image_index, file_list, page_no=0, sample_in_yaml_s
     countStr = str(image_index + 1) + "/" + str(len(file_list))
     window_ref["-COUNT-"].update(countStr)
 
-    # Open image X from pdf
-    try:
-        doc = fitz.open(filename)
-    except FileNotFoundError:
-        raise FileNotFoundError("File not found: " + filename)
+    # Show list of which gates this sample has been classified as in the yaml
+    window_ref["-INDEX-"].update(sample_in_yaml_string)
 
-    page_count = len(doc)
-    dlist_tab = [None] * page_count
-    # Page no can either be single int, if a single image is shown
-    # but tuple of ints if 2 images are shown
-    # Resolution should be different
-    window_x_size = 960
-    window_y_size = 840
-    if isinstance(page_no, int):
-        cur_page = page_no
+    image_data = None
+    if render_prefetcher is not None:
+        image_data = render_prefetcher.get(filename)
+    # Pages that are rendered now are shown as each one is done, as a preview first if previews are on
+    if image_data is not None:
+        pages = ((position, data, 1) for position, data in enumerate(image_data))
+    elif progressive_renderer is not None:
+        pages = progressive_renderer.pages(filename, page_no)
     else:
-        window_x_size = window_x_size / 2
-        window_y_size = window_y_size / 2
-        cur_page = page_no[0]
+        pages = ((position, data, 1) for position, data in iter_sample_pages(filename, page_no))
+    if image_data is not None and progressive_renderer is not None:
+        progressive_renderer.generation += 1  # Drop the refinements of the previous sample
 
-    pixmap = get_page(cur_page, dlist_tab, doc, width=window_x_size, height=window_y_size)  # show page 1 for start
-    data = pixmap.tobytes("png")
-    window_ref["-IMAGE-"].update(data=data, size=(int(window_x_size), int(window_y_size)))
+    window_x_size, window_y_size = get_image_size(page_no)
+    for position, data, zoom in pages:
+        with timed("window refresh"):
+            window_ref[IMAGE_ELEMENT_KEYS[position]].update(data=data, size=(int(window_x_size), int(window_y_size)),
+                                                            zoom=zoom)
+            # Refresh entire window
+            window_ref.refresh()
 
-    # Show list of which gates this sample has been classified as in the yaml
-    window_ref["-INDEX-"].update(sample_in_yaml_string)
-
-    # If image_index is a tuple, then load/update the second image
-    if isinstance(page_no, tuple):
-        second_page = page_no[1]
-        second_image_page = get_page(second_page, dlist_tab, doc, width=window_x_size, height=window_y_size)
-        second_image_data = second_image_page.tobytes("png")
-        window_ref["-IMAGE2-"].update(data=second_image_data, size=(window_x_size, window_y_size))
-
-        # If image_index is a tuple of length 3, then load/update the third image as well
-        if len(page_no) == 3:
-            third_page = page_no[2]
-            third_image_page = get_page(third_page, dlist_tab, doc, width=window_x_size, height=window_y_size)
-            third_image_data = third_image_page.tobytes("png")
-            window_ref["-IMAGE3-"].update(data=third_image_data, size=(window_x_size, window_y_size))
-
-    # Refresh entire window
-    window_ref.refresh()
+    if render_prefetcher is not None:
+        render_prefetcher.schedule(image_index, file_list)
 
 
 def create_pdf_window(fname: str, window_name) -> bool:
@@ -136,19 +2197,17 @@ def create_pdf_window(fname: str, window_name) -> bool:
     """
 
     try:
-        doc = fitz.open(fname)
+        page_count = get_page_count(fname)
     except FileNotFoundError:
         # Maybe print error?
         # Maybe done in the calling function?
         create_no_sample_pdf()
         return False
-    page_count = len(doc)
-    dlist_tab = [None] * page_count
     cur_page = 0
     old_page = 0
 
-    page_data = get_page(cur_page, dlist_tab, doc, width=480, height=480)  # show page 1 for start
-    data = page_data.tobytes("png")
+    width, height = 480, 480
+    data = get_page_image(fname, cur_page, width=width, height=height)  # show page 1 for start
     image_elem = sg.Image(data=data)
     goto = sg.InputText(str(cur_page + 1), size=(5, 1))
 
@@ -164,13 +2223,24 @@ def create_pdf_window(fname: str, window_name) -> bool:
     my_keys = ("Next", "Next:34", "Prev", "Prior:33", "MouseWheel:Down", "MouseWheel:Up")
 
     window = sg.Window(window_name, layout,
-                       return_keyboard_events=True, use_default_focus=False)
+                       return_keyboard_events=True, use_default_focus=False, resizable=True, finalize=True)
+    window.bind("<Configure>", "-CONFIGURE-")
+    resize = ResizeDebouncer(window.size)
 
     while True:
         event, values = window.read(timeout=100)
         force_page = False
         if event == sg.WIN_CLOSED:
             break
+        if event == "-CONFIGURE-":
+            resize.on_configure(window.size)
+            continue
+        resized = resize.settled() if event == sg.TIMEOUT_KEY else None
+        if resized is not None:  # Render the page at the size the window now has room for
+            (old_width, old_height), (new_width, new_height) = resized
+            width = max(MIN_IMAGE_WIDTH, round_image_length(width + new_width - old_width))
+            height = max(MIN_IMAGE_WIDTH, round_image_length(height + new_height - old_height))
+            force_page = True
         if event in ("Escape:27",):  # this spares me a 'Quit' button!
             break
         if event[0] == chr(13):  # surprise: this is 'Enter'!
@@ -197,10 +2267,12 @@ def create_pdf_window(fname: str, window_name) -> bool:
             force_page = True
         # Update
         if force_page:
-            page_data = get_page(cur_page, dlist_tab, doc, width=480, height=480)
-            data = page_data.tobytes("png")
+            data = get_page_image(fname, cur_page, width=width, height=height)
             image_elem.update(data=data)
             old_page = cur_page
+            window.refresh()  # Let the window fit the image, so that it is not taken for a resize
+            resize.rebase(window.size)
+    window.close()
     return True
 
 
@@ -269,18 +2341,22 @@ def create_complete_window():
     return
 
 
-def get_page(pno, dlist_tab, doc, width=0, height=0):
+def get_page(pno, dlist_tab, doc, width=0, height=0, keep_aspect=False):
     """
-    Get specific page of the document using pix.
+    Get specific page of the document using pix, scaled to width x height.
+    The zoom is computed from the bounding box of the display list, so the page is only rasterized once.
 
     :param pno: Page number
     :param dlist_tab:
     :param doc:
+    :param width: width of the returned pixmap
+    :param height: height of the returned pixmap
+    :param keep_aspect: If True, scale the page to fit inside width x height keeping its aspect ratio, instead of
+    stretching it to fill the box.
     :return:
     """
 
-    reportStr = "doclength: " + str(len(doc)) + " pageno: " + str(pno)
-    print(reportStr)
+    logger.debug("doclength: %d pageno: %d", len(doc), pno)
     if len(doc) <= pno:
         pno = len(doc) - 1
     dlist = dlist_tab[pno]
@@ -288,45 +2364,443 @@ def get_page(pno, dlist_tab, doc, width=0, height=0):
         dlist_tab[pno] = doc[pno].get_displaylist()
         dlist = dlist_tab[pno]
 
-    # get raw pixmap
-    raw_pixmap = dlist.get_pixmap(alpha=False)
-    # if raw_pixmap.width / raw_pixmap.height < width / height:
-    #    zoomY = height / raw_pixmap.height
-    #    zoomX = width / raw_pixmap.width
-    zoomY = height / raw_pixmap.height
-    zoomX = width / raw_pixmap.width
+    # size of the page at zoom 1, the same as that of an unscaled pixmap
+    raw_rect = dlist.rect.irect
+    zoomY = height / raw_rect.height
+    zoomX = width / raw_rect.width
+    if keep_aspect:
+        zoomX = zoomY = min(zoomX, zoomY)
     mat = fitz.Matrix(zoomX, zoomY)
     pix = dlist.get_pixmap(matrix=mat, alpha=False)
     return pix
 
 
-def check_if_discarded(image_index: int, file_list: list) -> bool:
+# Navigation modes of NavigationIndex, as shown in the "-NAVMODE-" selector
+NAVIGATION_MODES = ("Skip discarded", "Skip reviewed", "Show all")
+
+
+def natural_sort_key(path: str) -> list:
     """
-    Check if the sample is in the discarded list.
+    Sort key that orders numbers by value, so that sample_2.pdf comes before sample_10.pdf.
 
-    :param image_index: index of the sample in the file list
-    :param file_list: list of all samples that have been discarded
-    :return:
+    :param path: File name or path
+    :return: List of alternating text and number parts
     """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", path)]
 
-    if image_index is None:
-        print("WARNING, in check_if_discarded: image_index is None")
-        return False
 
-    if image_index >= len(file_list):
-        print("WARNING, in check_if_discarded: image_index out of range")
-        return False
+class SampleRecord:
+    """
+    A sample PDF in the SampleCatalog. The page count is read the first time it is asked for.
+    """
 
-    cleaned_name = collect_name_of_pdf_at_index(file_list, image_index)
-    if check_if_in_yaml(cleaned_name, gate_name="DISCARD"):
-        return True
-    return False
+    __slots__ = ("path", "sample_id", "mtime_ns", "page_count")
+
+    def __init__(self, path: str, mtime_ns: int):
+        self.path = path
+        self.sample_id = os.path.basename(path).replace(".pdf", "")
+        self.mtime_ns = mtime_ns
+        self.page_count = None
+
+
+class SampleCatalog(list):
+    """
+    The PDF files of the input folder in natural order, as a list of paths that can be used wherever file_list is.
+    Each path has a SampleRecord with its sample ID, so sample names are not recomputed on every lookup.
+    rescan() picks up PDFs added to (or removed from) the folder while the GUI runs. Only folders whose modification
+    time changed are listed again, so a rescan of an unchanged folder is a stat per folder.
+    """
+
+    def __init__(self, input_folder: str, recursive: bool = False):
+        """
+        :param input_folder: The input folder where the PDF files are located.
+        :param recursive: If True, PDFs in subfolders are included too (the output folder is never searched).
+        """
+        super().__init__()
+        self.input_folder = input_folder
+        self.recursive = recursive
+        self.records = []
+        self._records_by_path = {}
+        self._positions = {}
+        self._folders = {}  # folder -> (mtime_ns, {pdf path: mtime_ns}, subfolders), from the last listing
+        self.rescan()
+
+    def _list_folder(self, folder: str, pdfs: dict) -> None:
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            return
+        listing = self._folders.get(folder)
+        if listing is None or listing[0] != mtime_ns:
+            folder_pdfs, subfolders = {}, []
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".pdf") and entry.is_file():
+                        folder_pdfs[entry.path] = entry.stat().st_mtime_ns  # Cached by is_file
+                    elif self.recursive and entry.is_dir() and \
+                            not (folder == self.input_folder and entry.name == "output"):
+                        subfolders.append(entry.path)
+            listing = (mtime_ns, folder_pdfs, subfolders)
+            self._folders[folder] = listing
+        pdfs.update(listing[1])
+        for subfolder in listing[2]:
+            self._list_folder(subfolder, pdfs)
+
+    def rescan(self) -> bool:
+        """
+        Update the catalog with the PDFs currently in the input folder.
+
+        :return: True if PDFs were added or removed, so indices into the catalog may have changed
+        """
+
+        with timed("rescan"):
+            pdfs = {}
+            self._list_folder(self.input_folder, pdfs)
+            if len(pdfs) == len(self) and all(path in self._records_by_path for path in pdfs):
+                return False
+
+            records_by_path = {}
+            for path, mtime_ns in pdfs.items():
+                record = self._records_by_path.get(path)
+                records_by_path[path] = record if record is not None else SampleRecord(path, mtime_ns)
+            prefix_length = len(os.path.join(self.input_folder, ""))  # Sort on the path inside the input folder
+            self.records = sorted(records_by_path.values(),
+                                  key=lambda record: natural_sort_key(record.path[prefix_length:]))
+            self._records_by_path = records_by_path
+            self[:] = [record.path for record in self.records]
+            self._positions = {path: i for i, path in enumerate(self)}
+            return True
+
+    def index_of(self, path: str, default=None):
+        """
+        :return: Index of the PDF at 'path', or 'default' if it is not in the catalog
+        """
+        return self._positions.get(path, default)
+
+    def sample_id(self, image_index: int) -> str:
+        """
+        :return: Sample ID (the PDF file name without the extension) of the sample at image_index
+        """
+        return self.records[image_index].sample_id
+
+    def page_count(self, image_index: int) -> int:
+        """
+        :return: Number of pages of the sample at image_index
+        """
+        record = self.records[image_index]
+        if record.page_count is None:
+            record.page_count = get_page_count(record.path)
+        return record.page_count
+
+
+class ReviewLog:
+    """
+    Which samples have been reviewed at each gate. The correction file only has the samples that got corrections, so
+    samples approved without any are recorded here too. Kept as an append-only JSON Lines file in the output folder
+    (reviewed.jsonl) with one line per review: the sample, the gate and how it was reviewed ("approved",
+    "corrected", "NA", "DISCARD"), or "cleared" when its corrections were cleared.
+
+    The file is shared by all sessions working on the folder: lines are appended under a file lock, and refresh()
+    reads the lines other sessions appended since the last read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reviewed = {}  # gate -> set of sample IDs
+        self._offset = 0  # Bytes of the file read so far
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """
+        Read the reviews appended to the file since the last read.
+
+        :return: True if there were any
+        """
+
+        try:
+            with open(self.path, "rb") as in_file:
+                in_file.seek(self._offset)
+                data = in_file.read()
+        except FileNotFoundError:
+            return False
+        data = data[:data.rfind(b"\n") + 1]  # A line that is still being written is read next time
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Left by a session that was killed while writing it, and ended by the next session's write
+                logger.warning("Ignoring incomplete line in %s", self.path)
+                continue
+            if entry["state"] == "cleared":
+                self._reviewed.get(entry["gate"], set()).discard(entry["sample"])
+            else:
+                self._reviewed.setdefault(entry["gate"], set()).add(entry["sample"])
+        self._offset += len(data)
+        return len(data) > 0
+
+    def record(self, sample_id: str, gate_name: str, state: str) -> None:
+        """
+        Record that a sample was reviewed at a gate.
+
+        :param sample_id: ID of the sample
+        :param gate_name: Name of the gate
+        :param state: "approved", "corrected", "NA", "DISCARD", or "cleared" to mark the sample as not reviewed
+        :return: None
+        """
+
+        self.record_many([sample_id], gate_name, state)
+
+    def record_many(self, sample_ids: list, gate_name: str, state: str) -> None:
+        """
+        Record that each of the samples was reviewed at a gate, in one write.
+
+        :param sample_ids: IDs of the samples
+        :param gate_name: Name of the gate
+        :param state: See record
+        :return: None
+        """
+
+        review_time = time.strftime("%Y-%m-%dT%H:%M:%S")
+        lines = "".join(json.dumps({"sample": sample_id, "gate": gate_name, "state": state, "time": review_time}) + "\n"
+                        for sample_id in sample_ids)
+        with timed("review write"), open(self.path, "ab+") as out_file:
+            lock_file(out_file)
+            try:
+                # A session killed while writing leaves the file ending in an incomplete line. End it, so that the new
+                # lines are not appended to it
+                if out_file.seek(0, os.SEEK_END) > 0:
+                    out_file.seek(-1, os.SEEK_END)
+                    if out_file.read(1) != b"\n":
+                        lines = "\n" + lines
+                out_file.write(lines.encode())
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            finally:
+                unlock_file(out_file)
+        self.refresh()
+
+    def is_reviewed(self, sample_id: str, gate_name: str) -> bool:
+        """
+        :return: True if the sample has been reviewed at the gate
+        """
+        return sample_id in self._reviewed.get(gate_name, ())
+
+
+# Review log of the output folder, created by get_review_log
+global review_log
+review_log = None
+
+
+def get_review_log() -> ReviewLog:
+    """
+    Get the review log of the output folder of the current correction yaml file.
+
+    :return: ReviewLog
+    """
+
+    global review_log
+    path = os.path.join(os.path.dirname(os.path.abspath(correction_yaml_file)), "reviewed.jsonl")
+    if review_log is None or review_log.path != path:
+        review_log = ReviewLog(path)
+    return review_log
+
+
+def record_review(sample_id: str, gate_name: str, state: str) -> None:
+    """
+    Record that a sample was reviewed at a gate, see ReviewLog.record.
+
+    :return: None
+    """
+
+    get_review_log().record(sample_id, gate_name, state)
+
+
+def record_reviews(sample_ids: list, gate_name: str, state: str) -> None:
+    """
+    Record that each of the samples was reviewed at a gate, in one write, see ReviewLog.record_many.
+
+    :return: None
+    """
+
+    get_review_log().record_many(sample_ids, gate_name, state)
+
+
+def session_cursor_path() -> str:
+    """
+    :return: Path of the session cursor file of the current user, in the output folder
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(correction_yaml_file)),
+                        "session." + re.sub(r"[^\w.-]", "_", getpass.getuser()) + ".json")
+
+
+def save_session_cursor(gate_name: str, sample_id: str) -> None:
+    """
+    Remember the sample the user is at for the gate, so the next session can resume there.
+
+    :param gate_name: Name of the gate
+    :param sample_id: ID of the sample shown
+    :return: None
+    """
+
+    path = session_cursor_path()
+    cursors = {}
+    if os.path.exists(path):
+        with open(path, "r") as in_file:
+            cursors = json.load(in_file)
+    cursors[gate_name] = sample_id
+    with open(path + ".tmp", "w") as out_file:
+        json.dump(cursors, out_file)
+    os.replace(path + ".tmp", path)
+
+
+def load_session_cursor(gate_name: str):
+    """
+    :param gate_name: Name of the gate
+    :return: ID of the sample the user was at for the gate in the last session, or None
+    """
+
+    path = session_cursor_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as in_file:
+        return json.load(in_file).get(gate_name)
+
+
+class NavigationIndex:
+    """
+    Sorted array of the indices in file_list that next/previous navigation can land on, so that finding the next or
+    previous sample is a bisect instead of a walk over every skipped sample.
+    The mode selects which samples are skipped: "Skip discarded" skips discarded samples, "Skip reviewed" also skips
+    samples that have been reviewed at the gate (see ReviewLog), and "Show all" skips nothing.
+    A second array holds the samples that are neither discarded nor reviewed, whatever the mode, so that the first
+    unreviewed sample is found without a scan.
+    Call refresh(image_index) after changing the corrections of a sample to keep the index up to date.
+    """
+
+    def __init__(self, file_list: list, gate_name: str = None, mode: str = NAVIGATION_MODES[0]):
+        self.file_list = file_list
+        self.gate_name = gate_name
+        self._sample_names = [collect_name_of_pdf_at_index(file_list, i) for i in range(len(file_list))]
+        self._visible = []
+        self._unreviewed = [i for i in range(len(file_list)) if not self._is_reviewed(i)]
+        self.set_mode(mode)
+
+    def set_mode(self, mode: str) -> None:
+        """
+        Change the navigation mode and rebuild the index.
+
+        :param mode: One of NAVIGATION_MODES
+        :return: None
+        """
+
+        if mode not in NAVIGATION_MODES:
+            raise ValueError("Unknown navigation mode: " + str(mode))
+        self.mode = mode
+        self._visible = [i for i in range(len(self.file_list)) if self._is_visible(i)]
+
+    def _is_reviewed(self, image_index: int) -> bool:
+        sample_name = self._sample_names[image_index]
+        if get_correction_store().is_discarded(sample_name):
+            return True
+        if self.gate_name is None:
+            return False
+        return get_review_log().is_reviewed(sample_name, self.gate_name) or \
+            get_correction_store().contains(sample_name, self.gate_name)
+
+    def _is_visible(self, image_index: int) -> bool:
+        if self.mode == "Show all":
+            return True
+        if self.mode == "Skip reviewed":
+            return not self._is_reviewed(image_index)
+        return not get_correction_store().is_discarded(self._sample_names[image_index])
+
+    @staticmethod
+    def _update(indices: list, image_index: int, present: bool) -> None:
+        position = bisect.bisect_left(indices, image_index)
+        is_in_index = position < len(indices) and indices[position] == image_index
+        if present and not is_in_index:
+            indices.insert(position, image_index)
+        elif not present and is_in_index:
+            del indices[position]
+
+    def refresh(self, image_index: int) -> None:
+        """
+        Re-check whether a single sample should be skipped, after its corrections changed.
+
+        :param image_index: index of the sample in the file list
+        :return: None
+        """
+
+        self._update(self._visible, image_index, self._is_visible(image_index))
+        self._update(self._unreviewed, image_index, not self._is_reviewed(image_index))
+
+    def first_unreviewed(self):
+        """
+        :return: Index of the first sample that is neither discarded nor reviewed, or None if there is none
+        """
+        return self._unreviewed[0] if self._unreviewed else None
+
+    def next(self, image_index: int):
+        """
+        :return: The first index after image_index that is not skipped, or None if there is none
+        """
+        position = bisect.bisect_right(self._visible, image_index)
+        return self._visible[position] if position < len(self._visible) else None
+
+    def previous(self, image_index: int):
+        """
+        :return: The last index before image_index that is not skipped, or None if there is none
+        """
+        position = bisect.bisect_left(self._visible, image_index)
+        return self._visible[position - 1] if position > 0 else None
+
+    def is_visible(self, image_index: int) -> bool:
+        """
+        :return: True if the sample is not skipped in the current mode
+        """
+        position = bisect.bisect_left(self._visible, image_index)
+        return position < len(self._visible) and self._visible[position] == image_index
+
+    def __len__(self):
+        return len(self._visible)
+
+
+# Navigation index of the current file list, set by the event loop
+global navigation_index
+navigation_index = None
+
+
+def set_navigation_index(index) -> None:
+    """
+    Set the navigation index used by the navigation functions and the prefetcher.
+
+    :param index: NavigationIndex
+    :return: None
+    """
+
+    global navigation_index
+    navigation_index = index
+
+
+def get_navigation_index(file_list: list) -> NavigationIndex:
+    """
+    Get the navigation index of the file list. If none was set for this file list, one skipping discarded samples is
+    built.
+
+    :param file_list: list of all PDF files to process
+    :return: NavigationIndex
+    """
+
+    global navigation_index
+    if navigation_index is None or navigation_index.file_list is not file_list:
+        navigation_index = NavigationIndex(file_list)
+    return navigation_index
 
 
 def add_to_output_yaml(gate_name: str, descriptors: list, sample_id: str) -> None:
     """
     Add the corrections specified by the user to the yaml file specific to that gate.
-    TODO: Fix duplicated sample IDs. Entries on each descriptor should be unique.
+    Entries on each descriptor are unique.
 
     :param gate_name: Name of the gate the corrections apply to. It will be used to create the output file name.
     :param descriptors: List of descriptors to be added/expanded upon in the output file.
@@ -334,24 +2808,20 @@ def add_to_output_yaml(gate_name: str, descriptors: list, sample_id: str) -> Non
     :return:
     """
 
-    # Read the output file, add the corrections to the appropriate sample, then write the file again.
-    with open(correction_yaml_file, "r") as in_file:
-        yaml_full_dict = yaml.safe_load(in_file)  # Dict of lists
-        if yaml_full_dict is None:
-            yaml_full_dict = {}
-        # For each descriptor, if not already in yaml, add it. Otherwise, append to the list.
-        if gate_name not in yaml_full_dict:
-            yaml_full_dict[gate_name] = {}
-        for descriptor in descriptors:
-            if descriptor not in yaml_full_dict[gate_name].keys():
-                yaml_full_dict[gate_name][descriptor] = [sample_id]
-            else:
-                if sample_id not in yaml_full_dict[gate_name][descriptor]:
-                    yaml_full_dict[gate_name][descriptor].append(sample_id)
-                yaml_full_dict[gate_name][descriptor].sort()  # TODO: natural sorting instead?
+    get_correction_store().add(gate_name, descriptors, sample_id)
+
+
+def add_many_to_output_yaml(gate_name: str, descriptors: list, sample_ids: list) -> None:
+    """
+    Add the same corrections to several samples, in one write to the correction store.
+
+    :param gate_name: Name of the gate the corrections apply to.
+    :param descriptors: List of descriptors to be added/expanded upon in the output file.
+    :param sample_ids: IDs of the samples the corrections apply to.
+    :return: None
+    """
 
-    with open(correction_yaml_file, "w") as out_file:
-        yaml.safe_dump(yaml_full_dict, out_file)
+    get_correction_store().add_many(gate_name, descriptors, sample_ids)
 
 
 def collect_name_of_pdf_at_index(pdf_list: list, image_index: int) -> str:
@@ -363,6 +2833,8 @@ def collect_name_of_pdf_at_index(pdf_list: list, image_index: int) -> str:
     :return: Name of the PDF file without the extension
     """
 
+    if isinstance(pdf_list, SampleCatalog):
+        return pdf_list.sample_id(image_index)
     filename = pdf_list[image_index]
     cleaned_name = os.path.basename(filename).replace(".pdf", "")
 
@@ -379,18 +2851,7 @@ def check_if_in_yaml(sample_name: str, gate_name: str) -> bool:
     :return: True if the sample is already in the yaml file, False otherwise.
     """
 
-    # test print correction_yaml_file
-    # print("correct_yaml_file: ", correction_yaml_file)
-
-    with open(correction_yaml_file, "r") as in_file:
-        yaml_full_dict = yaml.safe_load(in_file)  # Dict of lists
-        if yaml_full_dict is None or gate_name not in yaml_full_dict:
-            return False  # If the file is empty, the sample is not in it. Same if the gate is not in the file.
-        for descriptor in yaml_full_dict[gate_name]:
-            if sample_name in yaml_full_dict[gate_name][descriptor]:
-                return True
-        else:
-            return False
+    return get_correction_store().contains(sample_name, gate_name)
 
 
 def remove_from_yaml(sample_name: str, gate_name: str) -> None:
@@ -402,27 +2863,35 @@ def remove_from_yaml(sample_name: str, gate_name: str) -> None:
     :return: None
     """
 
-    # test print correction_yaml_file
-    print("correct_yaml_file: ", correction_yaml_file)
+    logger.debug("correct_yaml_file: %s", correction_yaml_file)
 
-    with open(correction_yaml_file, "r") as in_file:
-        yaml_full_dict = yaml.safe_load(in_file)
-        if (yaml_full_dict is not None) and (gate_name in yaml_full_dict):
-            for descriptor in yaml_full_dict[gate_name]:
-                if sample_name in yaml_full_dict[gate_name][descriptor]:
-                    yaml_full_dict[gate_name][descriptor].remove(sample_name)
-    with open(correction_yaml_file, "w") as out_file:
-        yaml.safe_dump(yaml_full_dict, out_file)
+    get_correction_store().remove(sample_name, gate_name)
 
 
-def create_discard_are_you_sure_popup() -> bool:
+def replace_many_in_yaml(gate_name: str, descriptors: list, sample_ids: list) -> None:
+    """
+    Replace the corrections of several samples at the gate with the same descriptors, in one write to the correction
+    store.
+
+    :param gate_name: Name of the gate the corrections apply to.
+    :param descriptors: List of descriptors the samples get at the gate.
+    :param sample_ids: IDs of the samples the corrections apply to.
+    :return: None
+    """
+
+    get_correction_store().replace_many(gate_name, descriptors, sample_ids)
+
+
+def create_discard_are_you_sure_popup(number_of_samples: int = 1) -> bool:
     """
     Create a PySimpleGUI popup to confirm the user wants to discard the current sample.
 
+    :param number_of_samples: Number of samples to be discarded, when discarding several at once
     :return:
     """
 
-    layout = [[sg.Text("Are you sure you want to discard this sample?")],
+    question = "this sample" if number_of_samples == 1 else f"these {number_of_samples} samples"
+    layout = [[sg.Text(f"Are you sure you want to discard {question}?")],
               [sg.Button("Yes"), sg.Button("No")]]
     window = sg.Window("Discard sample", layout)
     event, values = window.read()
@@ -462,27 +2931,13 @@ def post_window_warning(window_ref, warning_string: str) -> str:
 
 
 def create_yaml_string(image_index: str, file_list: list) -> str:
-    # For the given sample name, parse the yaml and collect all descriptors where it appears,
+    # For the given sample name, collect all descriptors where it appears in the correction store,
     # also check the discard descriptor.
     # Return a string with all the descriptors and discard status.
     # Split it up in 1 descriptor per line
-    descriptors = ""
-
     sample_name = collect_name_of_pdf_at_index(file_list, image_index)
 
-    with open(correction_yaml_file, "r") as in_file:
-        yaml_full_dict = yaml.safe_load(in_file)
-        if yaml_full_dict is not None:
-            if "DISCARD" in yaml_full_dict.keys() and sample_name in yaml_full_dict["DISCARD"]["DISCARD"]:
-                descriptors += "Discard\n"
-            for gate_name in yaml_full_dict.keys():
-                gate_descriptors = []
-                for descriptor in yaml_full_dict[gate_name]:
-                    if sample_name in yaml_full_dict[gate_name][descriptor]:
-                        gate_descriptors.append(descriptor)
-                if len(gate_descriptors) > 0:
-                    descriptors += gate_name + ": " + ", ".join(gate_descriptors) + "\n"
-    return descriptors
+    return get_correction_store().summary_string(sample_name)
 
 
 def update_event_descriptor_dict(old_dict: dict, new_values: list) -> dict:
@@ -522,5 +2977,5 @@ def unbind_arrows(window_ref):
         window_ref.TKroot.unbind("<Right>")
         window_ref.TKroot.unbind("<Left>")
     except AttributeError:
-        print("WARNING: It was not possible to unbind key arrows."
-              "See https://github.com/PySimpleGUI/PySimpleGUI/issues/5300#issuecomment-1140442135")
+        logger.warning("It was not possible to unbind key arrows. "
+                       "See https://github.com/PySimpleGUI/PySimpleGUI/issues/5300#issuecomment-1140442135")
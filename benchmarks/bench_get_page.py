@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of get_page: the single-pass scaled rasterization against the previous implementation, which
+rasterized every page at full size first to read its dimensions.
+
+Usage: python benchmarks/bench_get_page.py [pdf_folder] [repeats]
+"""
+
+import os
+import sys
+import time
+from glob import glob
+
+import fitz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from AGClassifier_utilities import get_page  # noqa: E402
+
+
+def get_page_two_pass(pno, dlist_tab, doc, width=0, height=0):
+    """
+    get_page as it was before: a full resolution raster only to read the page size, then the scaled one.
+    """
+    if len(doc) <= pno:
+        pno = len(doc) - 1
+    dlist = dlist_tab[pno]
+    if not dlist:
+        dlist_tab[pno] = doc[pno].get_displaylist()
+        dlist = dlist_tab[pno]
+    raw_pixmap = dlist.get_pixmap(alpha=False)
+    zoomY = height / raw_pixmap.height
+    zoomX = width / raw_pixmap.width
+    mat = fitz.Matrix(zoomX, zoomY)
+    return dlist.get_pixmap(matrix=mat, alpha=False)
+
+
+def time_renderer(renderer, file_list, pages, width, height, repeats):
+    """
+    :return: Seconds per page, best of 'repeats' runs over all files and pages
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for filename in file_list:
+            doc = fitz.open(filename)
+            dlist_tab = [None] * len(doc)
+            for pno in pages:
+                renderer(pno, dlist_tab, doc, width=width, height=height)
+            doc.close()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / (len(file_list) * len(pages))
+
+
+def main():
+    pdf_folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "example_pdfs")
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    file_list = sorted(glob(os.path.join(pdf_folder, "*.pdf")))
+    if not file_list:
+        raise ValueError("No pdf files found in " + pdf_folder)
+    pages = (0, 1, 2)
+
+    for width, height in ((960, 840), (480, 420)):
+        two_pass = time_renderer(get_page_two_pass, file_list, pages, width, height, repeats)
+        single_pass = time_renderer(get_page, file_list, pages, width, height, repeats)
+        print(f"{width}x{height}: two-pass {two_pass * 1000:.2f} ms/page, single-pass {single_pass * 1000:.2f} ms/page,"
+              f" speedup {two_pass / single_pass:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
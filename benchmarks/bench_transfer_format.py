@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the image transfer formats: time to encode a rendered pixmap (pixmap.tobytes) and for Tk to decode it
+(tk.PhotoImage(data=...)), per sample, for 1-, 2- and 3-image layouts at the main window render size.
+Decoding needs a display; without one only encoding is measured.
+
+Usage: python benchmarks/bench_transfer_format.py [pdf_folder] [repeats]
+"""
+
+import os
+import sys
+import time
+from glob import glob
+
+import fitz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from AGClassifier_utilities import IMAGE_TRANSFER_FORMATS, get_image_size, get_page  # noqa: E402
+
+LAYOUTS = {"1 image": 0, "2 images": (0, 1), "3 images": (0, 1, 2)}
+
+
+def get_tk_root():
+    """
+    :return: A hidden Tk root window, or None if there is no display
+    """
+    try:
+        import tkinter
+        root = tkinter.Tk()
+    except Exception:
+        return None
+    root.withdraw()
+    return root
+
+
+def main():
+    pdf_folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "example_pdfs")
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    file_list = sorted(glob(os.path.join(pdf_folder, "*.pdf")))
+    if not file_list:
+        raise ValueError("No pdf files found in " + pdf_folder)
+
+    root = get_tk_root()
+    if root is None:
+        print("No display available, only measuring encoding")
+    else:
+        import tkinter
+
+    for layout_name, page_no in LAYOUTS.items():
+        pages = [page_no] if isinstance(page_no, int) else list(page_no)
+        width, height = get_image_size(page_no)
+        pixmaps = []
+        for filename in file_list:
+            doc = fitz.open(filename)
+            dlist_tab = [None] * len(doc)
+            pixmaps.append([get_page(pno, dlist_tab, doc, width=width, height=height) for pno in pages])
+            doc.close()
+
+        for image_format in IMAGE_TRANSFER_FORMATS:
+            encode_time = decode_time = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                encoded = [[pixmap.tobytes(image_format) for pixmap in sample] for sample in pixmaps]
+                elapsed = time.perf_counter() - start
+                encode_time = elapsed if encode_time is None else min(encode_time, elapsed)
+                if root is not None:
+                    start = time.perf_counter()
+                    for sample in encoded:
+                        for data in sample:
+                            tkinter.PhotoImage(master=root, data=data)
+                    elapsed = time.perf_counter() - start
+                    decode_time = elapsed if decode_time is None else min(decode_time, elapsed)
+            size = sum(len(data) for sample in encoded for data in sample) / len(encoded)
+            line = (f"{layout_name} {image_format}: encode {encode_time / len(file_list) * 1000:.2f} ms/sample, "
+                    f"{size / 1024:.0f} KiB/sample")
+            if decode_time is not None:
+                line += f", decode {decode_time / len(file_list) * 1000:.2f} ms/sample"
+            print(line)
+
+    if root is not None:
+        root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite with per-stage latencies on synthetic AliGater-like input.
+
+For each input size, a folder of synthetic sample PDFs and a correction yaml file with the same samples are generated
+in the work folder (and reused by later runs), and the latency of each stage is measured: page rendering, showing a
+sample in the main window (against a stub window, also as a preview and with the pages rendered in parallel),
+sample discovery, the correction store operations (yaml and sqlite backends) and navigation at several discard
+densities. Results are written as JSON. With --compare, the results are checked against a stored baseline and stages
+that got slower by more than the threshold are reported as regressions (exit code 1).
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 100 10000 --output results.json
+    python benchmarks/run_benchmarks.py --sizes 100 10000 --output results.json --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import AGClassifier_event_manager as event_manager  # noqa: E402
+import AGClassifier_utilities as utilities  # noqa: E402
+from synthetic_data import make_sample_folder, make_correction_yaml  # noqa: E402
+
+GATE_NAME = "singlet & pbmc"
+PAGE_NO = (0, 1, 2)
+DISCARD_DENSITIES = (0.0, 0.5, 0.9)
+
+
+class StubElement:
+    def update(self, *args, **kwargs):
+        pass
+
+
+class StubWindow:
+    """
+    Stands in for the PySimpleGUI main window, so update_image can be timed without a display.
+    """
+
+    def __init__(self):
+        self._element = StubElement()
+
+    def __getitem__(self, key):
+        return self._element
+
+    def refresh(self):
+        pass
+
+    def write_event_value(self, key, value):
+        pass
+
+
+def summarize(durations: list) -> dict:
+    """
+    :param durations: Durations in seconds
+    :return: Dict with the number of samples and the mean, median, p95 and max in milliseconds
+    """
+    durations = sorted(durations)
+    return {"n": len(durations),
+            "mean_ms": statistics.fmean(durations) * 1000,
+            "median_ms": statistics.median(durations) * 1000,
+            "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+            "max_ms": durations[-1] * 1000}
+
+
+def time_calls(function, arguments: list) -> dict:
+    """
+    Time one call of 'function' per element of 'arguments'.
+
+    :return: summarize() of the durations
+    """
+    durations = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def reset_render_state() -> None:
+    utilities.set_render_prefetcher(None)
+    utilities.set_render_pool(None)
+    utilities.set_page_archive(None)
+    utilities.render_cache.clear()
+    with utilities.fitz_lock:
+        utilities.document_pool.close_all()
+
+
+def bench_size(work_folder: str, n: int, rng: random.Random) -> dict:
+    """
+    Run every stage for one input size.
+
+    :return: Dict of stage name -> summary
+    """
+    results = {}
+    sample_folder = os.path.join(work_folder, f"samples_{n}")
+    file_list = make_sample_folder(sample_folder, n)
+    sample_ids = [utilities.collect_name_of_pdf_at_index(file_list, i) for i in range(n)]
+
+    # Sample catalog: discovery of the folder, and the rescan done while the GUI is idle
+    results["catalog_build"] = time_calls(utilities.SampleCatalog, [(sample_folder,)] * 3)
+    catalog = utilities.SampleCatalog(sample_folder)
+    results["catalog_rescan_unchanged"] = time_calls(catalog.rescan, [()] * 20)
+    reset_render_state()
+
+    # Rendering: every page of the distinct PDFs, at the size of the 3-image layout
+    templates = sorted(set(os.path.realpath(path) for path in file_list[:20]))
+    width, height = utilities.get_image_size(PAGE_NO)
+
+    def render_page(filename, pno):
+        doc = utilities.fitz.open(filename)
+        utilities.get_page(pno, [None] * len(doc), doc, width=width, height=height)
+        doc.close()
+    results["get_page"] = time_calls(render_page, [(filename, pno) for filename in templates for pno in PAGE_NO])
+
+    # Showing a sample: first time (rendered) and again (render cache)
+    window = StubWindow()
+    shown = rng.sample(range(n), min(n, 20))
+    results["update_image_cold"] = time_calls(
+        utilities.update_image, [(window, i, file_list, PAGE_NO) for i in shown])
+    results["update_image_warm"] = time_calls(
+        utilities.update_image, [(window, i, file_list, PAGE_NO) for i in shown])
+    reset_render_state()
+
+    # Showing a preview of a sample for the first time, waiting for its refinement before the next one
+    renderer = utilities.ProgressiveRenderer(window)
+    utilities.set_progressive_renderer(renderer)
+    durations = []
+    for i in shown:
+        start = time.perf_counter()
+        utilities.update_image(window, i, file_list, PAGE_NO)
+        durations.append(time.perf_counter() - start)
+        renderer._executor.submit(int).result()
+    results["update_image_cold_preview"] = summarize(durations)
+    utilities.set_progressive_renderer(None)
+    reset_render_state()
+
+    # Showing a sample for the first time, with its pages rendered in parallel by worker processes, handed back
+    # through shared memory as in the GUI, and through the process pool's pipe
+    for stage, slot_bytes in (("update_image_cold_parallel", utilities.ppm_size(width, height)),
+                              ("update_image_cold_parallel_pipe", None)):
+        utilities.set_render_pool(utilities.RenderPool(len(PAGE_NO), slot_bytes=slot_bytes))
+        for future in [utilities.render_pool.submit(file_list[0], pno, width, height, "ppm") for pno in PAGE_NO]:
+            future.result()  # Wait for the workers to start
+        results[stage] = time_calls(utilities.update_image, [(window, i, file_list, PAGE_NO) for i in shown])
+        reset_render_state()
+
+    # Correction store
+    for discard_density in DISCARD_DENSITIES:
+        yaml_file = os.path.join(work_folder, f"correction_{n}_{discard_density}.yaml")
+        make_correction_yaml(yaml_file, sample_ids, gate_name=GATE_NAME, discard_density=discard_density)
+        utilities.set_correction_yaml_global(yaml_file)
+        store = utilities.get_correction_store()
+        store.compact_every = 10 ** 9  # Compaction is timed separately
+
+        if discard_density == 0.0:
+            results["store_load"] = time_calls(utilities.CorrectionStore, [(yaml_file,)] * 3)
+            lookups = [(rng.choice(sample_ids), GATE_NAME) for _ in range(1000)]
+            results["check_if_in_yaml"] = time_calls(utilities.check_if_in_yaml, lookups)
+            results["create_yaml_string"] = time_calls(
+                utilities.create_yaml_string, [(rng.randrange(n), file_list) for _ in range(1000)])
+            results["add_to_output_yaml"] = time_calls(
+                utilities.add_to_output_yaml,
+                [(GATE_NAME, [rng.choice(["PBMC-FSC_70k", "NA"])], rng.choice(sample_ids)) for _ in range(200)])
+            results["compact"] = time_calls(store.compact, [()] * 3)
+
+            # The same operations on the sqlite backend, with a database created from the yaml file
+            db_path = os.path.splitext(yaml_file)[0] + ".sqlite"
+            if os.path.exists(db_path):
+                os.remove(db_path)
+            utilities.SQLiteCorrectionStore(yaml_file).close()
+            results["store_load_sqlite"] = time_calls(utilities.SQLiteCorrectionStore, [(yaml_file,)] * 3)
+            utilities.set_correction_backend("sqlite")
+            utilities.set_correction_yaml_global(yaml_file)
+            results["check_if_in_yaml_sqlite"] = time_calls(utilities.check_if_in_yaml, lookups)
+            results["create_yaml_string_sqlite"] = time_calls(
+                utilities.create_yaml_string, [(rng.randrange(n), file_list) for _ in range(1000)])
+            results["add_to_output_yaml_sqlite"] = time_calls(
+                utilities.add_to_output_yaml,
+                [(GATE_NAME, [rng.choice(["PBMC-FSC_70k", "NA"])], rng.choice(sample_ids)) for _ in range(200)])
+            results["export_sqlite"] = time_calls(utilities.get_correction_store().compact, [()] * 3)
+            utilities.set_correction_backend("yaml")
+            utilities.set_correction_yaml_global(yaml_file)
+            store = utilities.get_correction_store()
+            store.compact_every = 10 ** 9
+
+        # Navigation only: the image update is measured above
+        results[f"navigation_index_build_discard_{discard_density}"] = time_calls(
+            utilities.NavigationIndex, [(file_list, GATE_NAME)] * 5)
+        navigation = utilities.NavigationIndex(file_list, GATE_NAME)
+        utilities.set_navigation_index(navigation)
+        steps = []
+        image_index = navigation.next(-1)
+        while image_index is not None and len(steps) < min(1000, len(navigation) - 1):
+            steps.append((window, image_index, file_list, PAGE_NO))
+            image_index = navigation.next(image_index)
+        update_image = event_manager.update_image
+        event_manager.update_image = lambda **kwargs: None
+        try:
+            results[f"next_sample_discard_{discard_density}"] = time_calls(event_manager.next_sample, steps)
+        finally:
+            event_manager.update_image = update_image
+        utilities.set_correction_yaml_global(yaml_file)  # Closes the store of this density
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    """
+    Compare the median latency of every stage with the baseline.
+
+    :param results: Results of this run
+    :param baseline: Results of the baseline run
+    :param threshold: Allowed relative slowdown, 0.25 means 25 % slower
+    :param min_delta_ms: Slowdowns smaller than this are timing noise, not regressions
+    :return: List of (size, stage, baseline median, median) of the regressions
+    """
+    regressions = []
+    for size, stages in results["sizes"].items():
+        for stage, summary in stages.items():
+            base = baseline.get("sizes", {}).get(size, {}).get(stage)
+            if base is None:
+                continue
+            ratio = summary["median_ms"] / base["median_ms"] if base["median_ms"] > 0 else 1.0
+            delta = summary["median_ms"] - base["median_ms"]
+            flag = "REGRESSION" if ratio > 1 + threshold and delta > min_delta_ms else ""
+            print(f"{size:>8} {stage:<40} {base['median_ms']:10.3f} -> {summary['median_ms']:10.3f} ms "
+                  f"({ratio:5.2f}x) {flag}")
+            if flag:
+                regressions.append((size, stage, base["median_ms"], summary["median_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AGClassifier benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000],
+                        help="Numbers of samples to benchmark with, e.g. 100 10000 100000")
+    parser.add_argument("--work-folder", default=os.path.join(tempfile.gettempdir(), "agclassifier_benchmarks"),
+                        help="Folder for the generated input, reused between runs")
+    parser.add_argument("--output", default=None,
+                        help="JSON file to write the results to, default is benchmark_results.json in the work folder")
+    parser.add_argument("--compare", default=None, help="Baseline JSON file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown of a stage's median that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Smallest absolute slowdown of a stage's median that counts as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+               "platform": platform.platform(), "sizes": {}}
+    for n in args.sizes:
+        sys.stderr.write(f"Benchmarking {n} samples\n")
+        results["sizes"][str(n)] = bench_size(args.work_folder, n, rng)
+        for stage, summary in results["sizes"][str(n)].items():
+            print(f"{n:>8} {stage:<40} median {summary['median_ms']:10.3f} ms  p95 {summary['p95_ms']:10.3f} ms")
+
+    if args.output is None:
+        args.output = os.path.join(args.work_folder, "benchmark_results.json")
+    with open(args.output, "w") as out_file:
+        json.dump(results, out_file, indent=2)
+    sys.stderr.write(f"Results written to {args.output}\n")
+
+    if args.compare is not None:
+        with open(args.compare) as in_file:
+            baseline = json.load(in_file)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            sys.stderr.write(f"{len(regressions)} stage(s) slower than the baseline by more than "
+                             f"{args.threshold:.0%}\n")
+            sys.exit(1)
+        sys.stderr.write("No regressions\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Soak check for long annotation sessions: walk thousands of synthetic PDFs through render_sample_pages and the
+"Open pdf" page lookup, and fail if the resident memory or the number of open file descriptors keeps growing.
+Memory and file descriptors are read from /proc, so this check only runs on Linux.
+
+Usage: python benchmarks/soak_document_pool.py [n_pdfs] [pdf_folder]
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import AGClassifier_utilities as utilities  # noqa: E402
+from synthetic_data import make_synthetic_pdfs  # noqa: E402
+
+# Allowed growth after the warm-up samples
+MAX_RSS_GROWTH_MB = 50
+MAX_FD_GROWTH = 4
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("VmRSS not found in /proc/self/status")
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    pdf_folder = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), "agclassifier_soak_pdfs")
+    print(f"Generating {n} synthetic PDFs in {pdf_folder}")
+    file_list = make_synthetic_pdfs(pdf_folder, n, pages=3, points=100)
+
+    # Keep the render cache small, so that its (bounded) growth does not hide a leak
+    utilities.set_render_cache_budget(16)
+    warmup = min(200, n // 10)
+    baseline_rss = baseline_fds = None
+    peak_rss = peak_fds = 0
+    for i, filename in enumerate(file_list):
+        utilities.render_sample_pages(filename, (0, 1, 2))
+        utilities.get_page_count(filename)
+        if i == warmup:
+            baseline_rss, baseline_fds = rss_mb(), open_fds()
+        elif i > warmup and i % 100 == 0:
+            peak_rss, peak_fds = max(peak_rss, rss_mb()), max(peak_fds, open_fds())
+
+    print(f"RSS: {baseline_rss:.1f} MB after warm-up, peak {peak_rss:.1f} MB")
+    print(f"Open fds: {baseline_fds} after warm-up, peak {peak_fds}")
+    print(f"Documents opened {utilities.document_pool.opened}, closed {utilities.document_pool.closed}, "
+          f"pooled {len(utilities.document_pool)}")
+    assert peak_rss - baseline_rss < MAX_RSS_GROWTH_MB, "Resident memory keeps growing"
+    assert peak_fds - baseline_fds <= MAX_FD_GROWTH, "File descriptors are leaking"
+    assert len(utilities.document_pool) <= utilities.document_pool.max_documents
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic AliGater-like input for the benchmarks: multi-page PDFs with a scatter plot and a gate on each page, and
+correction yaml files of matching size.
+"""
+
+import os
+import random
+import shutil
+
+import fitz
+import yaml
+
+
+def make_synthetic_pdf(path: str, pages: int = 3, points: int = 400, seed: int = 0) -> None:
+    """
+    Write a PDF with 'pages' square pages, each with axes, a cloud of points and a gate rectangle.
+
+    :param path: Output path of the PDF
+    :param pages: Number of pages
+    :param points: Number of points drawn on each page
+    :param seed: Seed for the point positions
+    :return: None
+    """
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for pno in range(pages):
+        page = doc.new_page(width=720, height=720)
+        shape = page.new_shape()
+        shape.draw_line((60, 660), (700, 660))
+        shape.draw_line((60, 660), (60, 20))
+        shape.finish(color=(0, 0, 0), width=1.5)
+        cx, cy = rng.uniform(200, 520), rng.uniform(200, 520)
+        for _ in range(points):
+            x, y = rng.gauss(cx, 60), rng.gauss(cy, 60)
+            shape.draw_circle((x, y), 2)
+        shape.finish(color=None, fill=(0.1, 0.3, 0.8), fill_opacity=0.6)
+        shape.draw_rect(fitz.Rect(cx - 90, cy - 90, cx + 90, cy + 90))
+        shape.finish(color=(0.9, 0.1, 0.1), width=2)
+        shape.commit()
+        page.insert_text((80, 50), f"{os.path.basename(path)} page {pno}", fontsize=14)
+    doc.save(path)
+    doc.close()
+
+
+def make_synthetic_pdfs(folder: str, n: int, pages: int = 3, points: int = 400) -> list:
+    """
+    Write 'n' synthetic sample PDFs to 'folder'. Existing files are kept, so a folder can be reused between runs.
+
+    :param folder: Output folder, created if needed
+    :param n: Number of PDFs
+    :param pages: Number of pages in each PDF
+    :param points: Number of points drawn on each page
+    :return: Sorted list of the PDF paths
+    """
+
+    os.makedirs(folder, exist_ok=True)
+    file_list = []
+    for i in range(n):
+        path = os.path.join(folder, f"sample_{i:07d}.pdf")
+        if not os.path.exists(path):
+            make_synthetic_pdf(path, pages=pages, points=points, seed=i)
+        file_list.append(path)
+    return file_list
+
+
+def make_sample_folder(folder: str, n: int, distinct: int = 20, pages: int = 3) -> list:
+    """
+    Write a folder of 'n' sample PDFs quickly: 'distinct' synthetic PDFs are generated, and the samples are links to
+    them (copies where links are not supported). Used for the large benchmark sizes, where generating every PDF would
+    take hours.
+
+    :param folder: Output folder, created if needed
+    :param n: Number of sample PDFs
+    :param distinct: Number of different PDFs the samples link to
+    :param pages: Number of pages in each PDF
+    :return: Sorted list of the sample PDF paths
+    """
+
+    os.makedirs(folder, exist_ok=True)
+    templates = make_synthetic_pdfs(os.path.join(folder, "templates"), min(n, distinct), pages=pages)
+    file_list = []
+    for i in range(n):
+        path = os.path.join(folder, f"sample_{i:07d}.pdf")
+        if not os.path.exists(path):
+            template = templates[i % len(templates)]
+            try:
+                os.symlink(os.path.abspath(template), path)
+            except OSError:
+                shutil.copyfile(template, path)
+        file_list.append(path)
+    return file_list
+
+
+def make_correction_yaml(path: str, sample_ids: list, gate_name: str = "singlet & pbmc", correction_density=0.3,
+                         discard_density=0.0, seed: int = 0) -> None:
+    """
+    Write a correction yaml file in the layout AGClassifier produces, for the given samples. A fraction of the samples
+    gets corrections at the gate (and at a few other gates), and a fraction is discarded.
+
+    :param path: Output path of the yaml file
+    :param sample_ids: Sample IDs to distribute over the descriptors
+    :param gate_name: Gate of the corrections
+    :param correction_density: Fraction of samples with corrections at each gate
+    :param discard_density: Fraction of samples that are discarded
+    :param seed: Seed for the selection of samples
+    :return: None
+    """
+
+    rng = random.Random(seed)
+    descriptors = ["PBMC-FSC_70k", "PBMC-FSC_80k", "PBMC-FSC_90k", "PBMC_remove_more_debris", "PBMC_total_failure",
+                   "SINGLET_bad_review", "NA"]
+    correction_dict = {}
+    for gate in (gate_name, "CD4 & CD8", "B cells", "NK cells"):
+        gate_dict = {descriptor: [] for descriptor in descriptors}
+        for sample_id in sample_ids:
+            if rng.random() < correction_density:
+                gate_dict[rng.choice(descriptors)].append(sample_id)
+        correction_dict[gate] = {descriptor: sorted(ids) for descriptor, ids in gate_dict.items()}
+    correction_dict["DISCARD"] = {"DISCARD": sorted(sample_id for sample_id in sample_ids
+                                                    if rng.random() < discard_density)}
+    with open(path, "w") as out_file:
+        yaml.safe_dump(correction_dict, out_file)
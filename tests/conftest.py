@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules are not installed as a package; import them from the repository root, as the scripts do. The synthetic
+# data generator of the benchmarks is used for test PDFs
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
@@ -0,0 +1,18 @@
+from AGClassifier import parse_arguments
+
+
+def test_profile_before_command():
+    args = parse_arguments(["--profile", "report", "a"])
+    assert args.profile == "all"
+    assert args.command == "report" and args.folders == ["a"]
+
+
+def test_profile_events(monkeypatch):
+    monkeypatch.delenv("AGCLASSIFIER_PROFILE", raising=False)
+    assert parse_arguments(["--profile-events", "10:60"]).profile == "10:60"
+    assert parse_arguments([]).profile is None
+
+
+def test_profile_environment_variable(monkeypatch):
+    monkeypatch.setenv("AGCLASSIFIER_PROFILE", "5:")
+    assert parse_arguments([]).profile == "5:"
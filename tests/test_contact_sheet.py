@@ -0,0 +1,62 @@
+import logging
+import queue
+import time
+
+import pytest
+
+from AGClassifier_contact_sheet import ThumbnailRenderer, parse_contact_sheet_grid, thumbnail_size
+from AGClassifier_utilities import RenderPool, ppm_size, set_render_pool, get_render_pool
+from synthetic_data import make_synthetic_pdfs
+
+
+class EventWindow:
+    """
+    Stands in for the contact sheet window, collecting the events posted to it.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def write_event_value(self, key, value):
+        self.events.put((key, value))
+
+
+@pytest.fixture
+def render_pool():
+    set_render_pool(RenderPool(1, slot_bytes=ppm_size(*thumbnail_size((0, 1)))))
+    yield get_render_pool()
+    set_render_pool(None)
+
+
+def test_parse_contact_sheet_grid():
+    assert parse_contact_sheet_grid("4x6") == (4, 6)
+    assert parse_contact_sheet_grid("2X3") == (2, 3)
+    for spec in ("4", "0x6", "ax6", "4x"):
+        with pytest.raises(ValueError):
+            parse_contact_sheet_grid(spec)
+
+
+def test_page_turn_mid_render(render_pool, tmp_path, caplog):
+    files = make_synthetic_pdfs(str(tmp_path), 12, pages=1)
+    window = EventWindow()
+    renderer = ThumbnailRenderer(window, 0, *thumbnail_size((0, 1)))
+
+    with caplog.at_level(logging.ERROR, logger="concurrent.futures"):
+        assert renderer.show(files[:6]) == []
+        shown = {tile for tile, data in renderer.show(files[6:])}  # Turn the page before its thumbnails are done
+        deadline = time.monotonic() + 60
+        while len(shown) < 6 and time.monotonic() < deadline:
+            key, (generation, tile, data) = window.events.get(timeout=60)
+            assert key == "-THUMB-" and data.startswith(b"P6")
+            if generation == renderer.generation:
+                shown.add(tile)
+        assert shown == set(range(6))
+
+        renderer.shutdown()
+        deadline = time.monotonic() + 60
+        while render_pool.ring.free_slots() < render_pool.ring.slots and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert render_pool.ring.free_slots() == render_pool.ring.slots
+        # Callbacks of the cancelled renders run before the result of a later one is set
+        render_pool.submit(files[0], 0, 96, 84, "ppm").result(timeout=60)
+    assert not [record for record in caplog.records if "exception calling callback" in record.getMessage()]
@@ -0,0 +1,99 @@
+import glob
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+import yaml
+
+from AGClassifier_utilities import CorrectionStore, SQLiteCorrectionStore
+from conftest import ROOT
+
+
+def read_yaml(path) -> dict:
+    with open(path) as in_file:
+        return yaml.safe_load(in_file)
+
+
+def test_sqlite_store_created_on_another_thread(tmp_path):
+    path = str(tmp_path / "correction.yaml")
+    stores = []
+    loader = threading.Thread(target=lambda: stores.append(SQLiteCorrectionStore(path)))  # As the session loader
+    loader.start()
+    loader.join()
+
+    store = stores[0]
+    store.add("gate1", ["DISCARD"], "sample_1")
+    assert store.contains("sample_1", "gate1") and not store.contains("sample_2", "gate1")
+    store.close()
+    assert read_yaml(path) == {"gate1": {"DISCARD": ["sample_1"]}}
+
+
+def test_replay_journal_of_killed_session(tmp_path):
+    path = str(tmp_path / "correction.yaml")
+    session = textwrap.dedent(f"""
+        import os
+        from AGClassifier_utilities import CorrectionStore
+        store = CorrectionStore({path!r}, session_id="killed")
+        store.add("DISCARD", ["DISCARD"], "sample_1")
+        store.add_many("gate1", ["PBMC-FSC_70k"], ["sample_2", "sample_3"])
+        store.remove("sample_3", "gate1")
+        os._exit(9)  # Killed before the journal was compacted
+    """)
+    subprocess.run([sys.executable, "-c", session], cwd=ROOT, check=False)
+    journal_path = str(tmp_path / "correction.journal.killed.jsonl")
+    with open(journal_path, "a") as journal:
+        journal.write('{"op": "add", "gate": "gate1", "desc')  # Torn last line
+
+    store = CorrectionStore(path)
+    assert store.is_discarded("sample_1")
+    assert store.sample_gates("sample_2") == {"gate1": {"PBMC-FSC_70k"}}
+    assert not store.contains("sample_3", "gate1")
+    assert not os.path.exists(journal_path)
+    assert read_yaml(path) == {"DISCARD": {"DISCARD": ["sample_1"]}, "gate1": {"PBMC-FSC_70k": ["sample_2"]}}
+    store.close()
+
+
+def test_two_sessions_merge(tmp_path):
+    path = str(tmp_path / "correction.yaml")
+    first = CorrectionStore(path, session_id="first")
+    second = CorrectionStore(path, session_id="second")
+    first.add("gate1", ["PBMC-FSC_70k"], "sample_1")
+    second.add("gate1", ["PBMC-FSC_80k"], "sample_2")
+    second.add("gate2", ["DISCARD"], "sample_3")
+    first.compact()
+    second.compact()  # Reads the corrections of the first session before writing
+    assert second.contains("sample_1", "gate1")
+
+    first.remove("sample_2", "gate1")
+    first.close()
+    second.close()
+    assert read_yaml(path) == {"gate1": {"PBMC-FSC_70k": ["sample_1"], "PBMC-FSC_80k": []},
+                               "gate2": {"DISCARD": ["sample_3"]}}
+    assert not glob.glob(str(tmp_path / "correction.journal*"))
+
+
+def test_replace_many_is_one_journal_entry(tmp_path):
+    path = str(tmp_path / "correction.yaml")
+    store = CorrectionStore(path, session_id="bulk")
+    store.add_many("gate1", ["PBMC-FSC_70k", "PBMC_total_failure"], ["sample_1", "sample_2"])
+    store.replace_many("gate1", ["PBMC-FSC_80k"], ["sample_1", "sample_3"])
+    with open(store.journal_path) as journal:
+        assert len(journal.readlines()) == 2
+    assert store.sample_gates("sample_1") == {"gate1": {"PBMC-FSC_80k"}}
+    assert store.sample_gates("sample_2") == {"gate1": {"PBMC-FSC_70k", "PBMC_total_failure"}}
+
+    replayed = CorrectionStore(path, session_id="replay")
+    assert replayed._replay_journal(store.journal_path) == 2
+    assert replayed.to_dict() == store.to_dict()
+    replayed.close()
+    store.close()
+
+
+def test_sqlite_replace_many(tmp_path):
+    store = SQLiteCorrectionStore(str(tmp_path / "correction.yaml"))
+    store.add_many("gate1", ["PBMC-FSC_70k"], ["sample_1", "sample_2"])
+    store.replace_many("gate1", ["PBMC-FSC_80k"], ["sample_1", "sample_3"])
+    assert store.to_dict() == {"gate1": {"PBMC-FSC_70k": ["sample_2"], "PBMC-FSC_80k": ["sample_1", "sample_3"]}}
+    store.close()
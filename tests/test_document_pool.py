@@ -0,0 +1,31 @@
+import sys
+
+import pytest
+
+import AGClassifier_utilities as utilities
+from soak_document_pool import MAX_FD_GROWTH, open_fds
+from synthetic_data import make_synthetic_pdfs
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Open files are counted in /proc")
+
+
+def test_documents_are_closed(tmp_path):
+    """
+    A short version of benchmarks/soak_document_pool.py: the pool stays within its size and does not leak files.
+    """
+    file_list = make_synthetic_pdfs(str(tmp_path), 300, pages=1, points=20)
+    render_cache = utilities.render_cache
+    utilities.set_render_cache_budget(1)
+    warmup = 2 * utilities.document_pool.max_documents
+    try:
+        for i, filename in enumerate(file_list):
+            utilities.render_sample_pages(filename, 0)
+            utilities.get_page_count(filename)
+            if i == warmup:
+                baseline_fds = open_fds()
+            elif i > warmup:
+                assert open_fds() - baseline_fds <= MAX_FD_GROWTH, "File descriptors are leaking"
+            assert len(utilities.document_pool) <= utilities.document_pool.max_documents
+    finally:
+        utilities.render_cache = render_cache
+    assert utilities.document_pool.closed >= len(file_list) - utilities.document_pool.max_documents
@@ -0,0 +1,31 @@
+import pickle
+
+import PySimpleGUI as sg
+
+from AGClassifier_layouts import convert_layout_pickle, load_layout_spec, DEFAULT_CUSTOM_BUTTON_SIZE
+
+
+def write_layout_pickle(path, custom_sizes):
+    variable_layout = [
+        [sg.Text("Currently selected corrections are: "), sg.Text("", key="-CORRECTIONS-")],
+        [sg.Button("PBMC-FSC 70k", size=(12, 4)), sg.Button("PBMC too large", size=(14, 4))],
+        [sg.Button(f"Custom {number}", size=size, pad=(35, 0)) for number, size in enumerate(custom_sizes, start=1)],
+    ]
+    event_descriptor_dict = {"PBMC-FSC 70k": "PBMC-FSC_70k", "PBMC too large": "PBMC_remove_more_debris",
+                             "Custom 1": "CUSTOM_Xlim", "Custom 2": "CUSTOM_Ylim", "Custom 3": "CUSTOM_other"}
+    with open(path, "wb") as f:
+        pickle.dump({"gate_name": "singlet & pbmc", "number_of_images": 1, "page_indicies": 0,
+                     "variable_layout": variable_layout, "event_descriptor_dict": event_descriptor_dict}, f)
+
+
+def test_convert_keeps_button_sizes(tmp_path):
+    pickle_path = str(tmp_path / "gate.pickle")
+    write_layout_pickle(pickle_path, [(16, 4), (16, 4), (20, 5)])
+    spec = convert_layout_pickle(pickle_path)
+    assert [button.get("size") for button in spec["button_rows"][0]] == [None, [14, 4]]
+    assert [button.get("size") for button in spec["custom_buttons"]] == [None, None, [20, 5]]
+
+    layout = load_layout_spec(str(tmp_path / "gate.layout.yaml"))
+    assert [button["size"] for button in layout["custom_buttons"]] == [DEFAULT_CUSTOM_BUTTON_SIZE,
+                                                                       DEFAULT_CUSTOM_BUTTON_SIZE, (20, 5)]
+    assert [button["size"] for button in layout["button_rows"][0]] == [(12, 4), (14, 4)]
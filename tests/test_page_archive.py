@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+
+import AGClassifier_utilities
+from AGClassifier_utilities import PageArchive, file_content_hash, page_archive_key, set_page_archive, \
+    lookup_page_image, store_page_image, lock_file, unlock_file
+from synthetic_data import make_synthetic_pdf
+
+
+def test_put_later(tmp_path):
+    archive = PageArchive(str(tmp_path / "render_cache"))
+    archive.put_later(b"a" * 20, b"page a")
+    archive.put_later(lambda: b"b" * 20, b"page b")
+    assert archive.get(b"a" * 20) == b"page a"  # Queued or written
+    archive.close()
+
+    archive = PageArchive(str(tmp_path / "render_cache"))
+    assert archive.get(b"a" * 20) == b"page a"
+    assert archive.get(b"b" * 20) == b"page b"
+    assert len(archive) == 2
+    archive.close()
+
+
+def test_gui_thread_does_not_hash(tmp_path):
+    pdf = str(tmp_path / "sample.pdf")
+    make_synthetic_pdf(pdf, pages=1)
+    set_page_archive(PageArchive(str(tmp_path / "render_cache")))
+    try:
+        assert threading.current_thread() is threading.main_thread()
+        data, cache_key, archive_key = lookup_page_image(pdf, 0, 48, 42, "ppm")
+        assert data is None and callable(archive_key)
+        store_page_image(cache_key, archive_key, b"P6 page")
+        AGClassifier_utilities.render_cache.clear()
+        AGClassifier_utilities.page_archive.close()  # Waits for the page to be written
+
+        set_page_archive(PageArchive(str(tmp_path / "render_cache")))
+        assert file_content_hash(pdf, wait=False) is not None
+        data, _, archive_key = lookup_page_image(pdf, 0, 48, 42, "ppm")
+        assert data == b"P6 page" and archive_key == page_archive_key(pdf, 0, 48, 42, "ppm")
+    finally:
+        set_page_archive(None)
+        AGClassifier_utilities.render_cache.clear()
+    assert os.path.getsize(str(tmp_path / "render_cache" / "pages.pack")) == len(b"P6 page")
+
+
+def test_get_while_another_writer_holds_the_lock(tmp_path):
+    archive = PageArchive(str(tmp_path / "render_cache"))
+    archive.put(b"a" * 20, b"page a")
+    with open(archive.lock_path, "a+b") as other_writer:  # As prerender or another session
+        lock_file(other_writer)
+        writer = threading.Thread(target=archive.put, args=(b"b" * 20, b"page b"))
+        writer.start()
+        time.sleep(0.2)  # The writer waits for the lock
+        found = []
+        reader = threading.Thread(target=lambda: found.append(archive.get(b"a" * 20)))
+        reader.start()
+        reader.join(timeout=1)
+        assert found == [b"page a"], "get() waited for the other writer"
+        unlock_file(other_writer)
+    writer.join(timeout=10)
+    assert archive.get(b"b" * 20) == b"page b"
+    archive.close()
@@ -0,0 +1,48 @@
+import logging
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from AGClassifier_utilities import RenderPool, ppm_size
+from synthetic_data import make_synthetic_pdf
+
+WIDTH, HEIGHT = 480, 420
+
+
+@pytest.fixture(scope="module")
+def render_pool():
+    pool = RenderPool(1, slot_bytes=ppm_size(WIDTH, HEIGHT))
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture(scope="module")
+def pdf(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("pdfs") / "sample.pdf")
+    make_synthetic_pdf(path, pages=6)
+    return path
+
+
+def wait_for_free_slots(pool, timeout=60):
+    deadline = time.monotonic() + timeout
+    while pool.ring.free_slots() < pool.ring.slots and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return pool.ring.free_slots()
+
+
+def test_cancel_mid_render(render_pool, pdf, caplog):
+    render_pool.submit(pdf, 0, WIDTH, HEIGHT, "ppm").result(timeout=60)  # Workers started
+
+    with caplog.at_level(logging.ERROR, logger="concurrent.futures"):
+        # The first pages are sent to the worker right away, the others are still queued when they are cancelled
+        futures = [render_pool.submit(pdf, pno, WIDTH, HEIGHT, "ppm") for pno in range(6)]
+        assert all(future.cancel() for future in futures)
+        assert not wait(futures, timeout=10).not_done
+        assert wait_for_free_slots(render_pool) == render_pool.ring.slots
+
+        # The pool still renders. Its result comes after the callbacks of the cancelled renders
+        data = render_pool.submit(pdf, 1, WIDTH, HEIGHT, "ppm").result(timeout=60)
+        assert data.startswith(b"P6")
+        assert wait_for_free_slots(render_pool) == render_pool.ring.slots
+    assert not [record for record in caplog.records if "exception calling callback" in record.getMessage()]
@@ -0,0 +1,24 @@
+import os
+
+from AGClassifier_utilities import ReviewLog
+
+
+def test_record_after_torn_line(tmp_path):
+    path = str(tmp_path / "reviewed.jsonl")
+    review_log = ReviewLog(path)
+    review_log.record("sample_1", "gate", "approved")
+    review_log.record("sample_2", "gate", "NA")
+
+    # A session killed while writing the last line
+    with open(path, "rb+") as in_file:
+        in_file.truncate(os.path.getsize(path) - 10)
+
+    review_log = ReviewLog(path)
+    assert review_log.is_reviewed("sample_1", "gate")
+    assert not review_log.is_reviewed("sample_2", "gate")
+    review_log.record_many(["sample_3", "sample_4"], "gate", "approved")
+    assert review_log.is_reviewed("sample_3", "gate")
+
+    review_log = ReviewLog(path)
+    assert [review_log.is_reviewed(sample, "gate") for sample in ("sample_1", "sample_2", "sample_3", "sample_4")] == \
+        [True, False, True, True]